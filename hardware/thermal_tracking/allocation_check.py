@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Per-frame memory allocation check for the thermal droplet tracker
+Runs process_frame under tracemalloc on a synthetic scene or a recording
+and reports, per frame and per stage, the memory allocated on top of the
+steady-state heap, what stays allocated, and new garbage-collected
+objects, so allocation regressions show up before they cause jitter.
+Retained memory is measured over the second half of the run, after
+bounded histories and library caches have filled, so it shows leaks.
+"""
+
+import sys
+import os
+import gc
+import json
+import argparse
+import tracemalloc
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), 'code'))
+
+from thermal_droplet_tracker import ThermalDropletTracker
+from frame_sources import FrameSource, ReplayImage, ReplayFrameSource
+from synthetic_scene import SyntheticDropletScene
+from flight_recorder import FlightRecorder
+
+# Tracker methods measured as stages of process_frame
+STAGES = ('detect_droplets', 'update_kalman_trackers', 'send_to_fpga')
+
+
+class AllocationProbe:
+    """
+    Wraps tracker stages to measure their transient allocations
+    A stage's transient allocation is its tracemalloc peak above the
+    traced memory at stage entry: the working memory it needed, whether
+    or not it was freed again before returning.
+    """
+
+    def __init__(self, tracker, frames):
+        self.transient = {stage: np.zeros(frames, dtype=np.int64)
+                          for stage in STAGES + ('frame',)}
+        self.frame = 0
+        self._peak = 0
+        for stage in STAGES:
+            setattr(tracker, stage, self._wrap(stage, getattr(tracker, stage)))
+
+    def _wrap(self, stage, method):
+        def measured(*args, **kwargs):
+            self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            try:
+                return method(*args, **kwargs)
+            finally:
+                peak = tracemalloc.get_traced_memory()[1]
+                if self.frame >= 0:
+                    self.transient[stage][self.frame] = peak - start
+                self._peak = max(self._peak, peak)
+                tracemalloc.reset_peak()
+        return measured
+
+    def begin_frame(self, frame):
+        self.frame = frame
+        tracemalloc.reset_peak()
+        self._start = tracemalloc.get_traced_memory()[0]
+        self._peak = self._start
+
+    def end_frame(self):
+        peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+        if self.frame >= 0:
+            self.transient['frame'][self.frame] = peak - self._start
+
+
+def summarize(values):
+    """p50/p99/max of a byte series in KiB"""
+    kib = np.asarray(values) / 1024
+    return {
+        'p50': float(np.percentile(kib, 50)),
+        'p99': float(np.percentile(kib, 99)),
+        'max': float(kib.max()),
+    }
+
+
+def load_frames(args):
+    """(frames, timestamps) from a recording or a synthetic scene"""
+    count = args.warmup + args.frames
+    if args.replay:
+        source = ReplayFrameSource(args.replay, speed=0)
+        source.initialize()
+        if len(source) < count:
+            raise SystemExit(f"{args.replay}: {len(source)} frames, need {count}")
+        return source.frames[:count], source.timestamps[:count]
+    scene = SyntheticDropletScene(
+        num_droplets=args.droplets,
+        droplet_temp=args.droplet_temp,
+        seed=args.seed
+    )
+    frames, timestamps, _ = scene.generate(count)
+    return frames, timestamps
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure per-frame memory allocation of the tracker with tracemalloc"
+    )
+    parser.add_argument('--replay', metavar='RECORDING',
+                        help='Use a recording instead of a synthetic scene')
+    parser.add_argument('--droplets', type=int, default=10,
+                        help='Droplets in view (synthetic scene)')
+    parser.add_argument('--droplet-temp', type=float, default=300.0,
+                        help='Droplet temperature (°C, synthetic scene)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Scene random seed')
+    parser.add_argument('--min-temp', type=float, default=200,
+                        help='Tracker minimum temperature (°C)')
+    parser.add_argument('--frames', type=int, default=600,
+                        help='Measured frames')
+    parser.add_argument('--warmup', type=int, default=120,
+                        help='Unmeasured warm-up frames (buffers, tracks, caches)')
+    parser.add_argument('--roi', action='store_true',
+                        help='Enable prediction-guided ROI detection')
+    parser.add_argument('--record', action='store_true',
+                        help='Include the flight recorder')
+    parser.add_argument('--fpga-protocol', choices=['legacy', 'framed'],
+                        default='framed', help='FPGA packet format')
+    parser.add_argument('--fpga-port', type=int, default=5000,
+                        help='Destination UDP port on 127.0.0.1')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Allocation sites of retained memory to list')
+    parser.add_argument('--max-frame-kib', type=float, default=None,
+                        help='Fail if p99 transient allocation per frame exceeds this (KiB)')
+    parser.add_argument('--max-retained-blocks', type=float, default=1.0,
+                        help='Fail if more memory blocks than this per frame stay allocated')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Also write results as JSON')
+    args = parser.parse_args()
+
+    frames, timestamps = load_frames(args)
+    tracker = ThermalDropletTracker(fpga_ip='127.0.0.1', fpga_port=args.fpga_port,
+                                    frame_source=FrameSource())
+    tracker.min_temp_celsius = args.min_temp
+    tracker.roi_detection = args.roi
+    tracker.fpga_protocol = args.fpga_protocol
+    tracker.latency_compensation = True
+    if args.record:
+        # Recording only: no automatic dumps (droplets leaving the scene
+        # would trigger track-loss dumps on a writer thread)
+        tracker.recorder = FlightRecorder(frames.shape[1:], seconds=2,
+                                          output_dir='logs/allocation_check',
+                                          loss_burst=args.warmup + args.frames + 1)
+
+    tracemalloc.start(8)
+    probe = AllocationProbe(tracker, args.frames)
+    gc.collect()
+    gc.disable()  # Count new GC objects instead of collecting them
+    gc_objects = np.zeros(args.frames, dtype=np.int64)
+    try:
+        for i in range(len(frames)):
+            k = i - args.warmup
+            if k == args.frames // 2:
+                gc.collect()
+                start_snapshot = tracemalloc.take_snapshot()
+            image = ReplayImage(np.asarray(frames[i]), int(timestamps[i]), i)
+            probe.begin_frame(k)
+            count = gc.get_count()[0]
+            tracker.process_frame(image)
+            if k >= 0:
+                gc_objects[k] = gc.get_count()[0] - count
+            probe.end_frame()
+        gc.collect()
+        end_snapshot = tracemalloc.take_snapshot()
+    finally:
+        gc.enable()
+        tracemalloc.stop()
+        if tracker.recorder is not None:
+            tracker.recorder.close()
+        tracker.cleanup()
+
+    code_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '')
+    not_probe = [tracemalloc.Filter(False, tracemalloc.__file__),
+                 tracemalloc.Filter(False, __file__)]
+    sites = [stat for stat in end_snapshot.filter_traces(not_probe).compare_to(
+                 start_snapshot.filter_traces(not_probe), 'lineno')
+             if stat.size_diff > 0]
+    retained_frames = args.frames - args.frames // 2
+    retained_bytes = sum(stat.size_diff for stat in sites) / retained_frames
+    retained_blocks = sum(max(stat.count_diff, 0) for stat in sites) / retained_frames
+
+    result = {
+        'frames': args.frames,
+        'transient_kib': {stage: summarize(probe.transient[stage])
+                          for stage in ('frame',) + STAGES},
+        'retained_bytes_per_frame': retained_bytes,
+        'retained_blocks_per_frame': retained_blocks,
+        'gc_objects_per_frame': float(gc_objects.mean()),
+        'gc_objects_max': int(gc_objects.max()),
+        'top_retained': [
+            {'site': str(stat.traceback), 'bytes': stat.size_diff, 'blocks': stat.count_diff}
+            for stat in sites[:args.top]
+        ],
+    }
+
+    print(f"{args.frames} frames after {args.warmup} warm-up\n")
+    print(f"{'Transient (KiB)':<26} {'p50':>9} {'p99':>9} {'max':>9}")
+    for stage, s in result['transient_kib'].items():
+        print(f"  {stage:<24} {s['p50']:>9.1f} {s['p99']:>9.1f} {s['max']:>9.1f}")
+    print(f"\nRetained per frame: {retained_bytes:.1f} bytes, "
+          f"{retained_blocks:.2f} blocks")
+    print(f"New GC-tracked objects per frame: {result['gc_objects_per_frame']:.2f} "
+          f"(max {result['gc_objects_max']})")
+    if sites:
+        print("\nRetained memory by allocation site:")
+        for stat in sites[:args.top]:
+            frame = stat.traceback[0]
+            where = frame.filename.replace(code_dir, '')
+            print(f"  {where}:{frame.lineno}  +{stat.size_diff} B in {stat.count_diff} blocks")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResults saved to {args.json}")
+
+    failures = []
+    if args.max_frame_kib is not None and result['transient_kib']['frame']['p99'] > args.max_frame_kib:
+        failures.append(f"p99 transient {result['transient_kib']['frame']['p99']:.1f} KiB "
+                        f"> {args.max_frame_kib:g} KiB")
+    if retained_blocks > args.max_retained_blocks:
+        failures.append(f"{retained_blocks:.2f} blocks retained per frame "
+                        f"> {args.max_retained_blocks:g}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
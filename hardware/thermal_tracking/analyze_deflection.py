@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Offline deflection analysis of TE-000 high-speed footage
+Streams recordings, image directories or video files through the
+droplet detection and tracking core, sharded across CPU cores, writes
+per-droplet lateral deflection statistics and optionally attaches them
+to the TE-000 (acoustic steering physics validation) test execution
+"""
+
+import sys
+import os
+import json
+import argparse
+import math
+import time
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), 'code'))
+
+from config.performance_config import KALMAN_CONFIG, DEFLECTION_CONFIG
+from deflection_analysis import DEFLECTION_DTYPE, analyze, summarize
+from parameter_tuning import load_tuned_parameters
+
+TEST_ID = 'TE-000'
+
+
+def save_results(directory, paths, records, lengths, summary):
+    """deflections.npy, deflections.csv and summary.json in directory"""
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'deflections.npy'), records)
+    names = DEFLECTION_DTYPE.names
+    with open(os.path.join(directory, 'deflections.csv'), 'w') as f:
+        f.write(','.join(('path',) + names[1:]) + '\n')
+        for r in records:
+            f.write(','.join([paths[r['sequence']]] + [f"{r[n]:g}" if r.dtype[n].kind == 'f'
+                                                        else str(r[n]) for n in names[1:]]) + '\n')
+    summary_path = os.path.join(directory, 'summary.json')
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary_path
+
+
+def attach(summary, summary_path, verification_dir, engineer):
+    """Record the analysis on the TE-000 TestExecution"""
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+    from test_management.verification_logic import VerificationEngine
+    from test_management.data_models import TestStatus
+
+    overall = summary['overall']
+    notes = (f"Deflection analysis {summary['date']}: {overall['deflected']}/{overall['droplets']} "
+             f"droplets > {overall['threshold_mm']} mm, median |deflection| "
+             f"{overall['deflection_median_abs_mm']:.3f} mm, "
+             f"max {overall['deflection_max_abs_mm']:.3f} mm")
+    issues = [] if summary['deflection_criterion_met'] else [
+        f"Deflection analysis {summary['date']}: lateral deflection criterion "
+        f"(>{overall['threshold_mm']} mm) not met"]
+
+    # The result stays with the engineer: the force-model comparison of
+    # the acceptance criteria does not come from footage
+    engine = VerificationEngine(verification_dir)
+    if not engine.update_test_status(TEST_ID, TestStatus.IN_PROGRESS, test_engineer=engineer,
+                                     notes=notes, issues=issues,
+                                     report_path=os.path.abspath(summary_path)):
+        raise SystemExit(f"{TEST_ID} is not in the test registry")
+    return notes
+
+
+def main():
+    defaults = DEFLECTION_CONFIG
+    parser = argparse.ArgumentParser(
+        description="Per-droplet lateral deflection of high-speed footage (TE-000)"
+    )
+    parser.add_argument('sequences', nargs='+', metavar='SEQUENCE',
+                        help='Recording (.npy), directory of images or video file')
+    parser.add_argument('--output-dir', default=defaults['output_dir'])
+    parser.add_argument('--fps', type=float, default=defaults['fps'],
+                        help='Camera frame rate (recordings with timestamps use those)')
+    parser.add_argument('--pixel-to-mm', type=float, default=defaults['pixel_to_mm'])
+    parser.add_argument('--bit-depth', type=int, default=defaults['bit_depth'],
+                        help='Significant bits per pixel (8-16)')
+    parser.add_argument('--dark', dest='dark', action='store_true',
+                        default=defaults['dark_droplets'],
+                        help='Droplets are dark on a bright background (backlit)')
+    parser.add_argument('--bright', dest='dark', action='store_false',
+                        help='Droplets are bright on a dark background')
+    parser.add_argument('--threshold', type=float, default=defaults['threshold'],
+                        help='Detection threshold (camera counts, after --dark inversion)')
+    parser.add_argument('--tilt-deg', type=float, default=defaults['tilt_deg'],
+                        help='Camera roll (fall direction relative to image +y)')
+    parser.add_argument('--gravity', type=float, default=9810.0,
+                        help='Fall acceleration for the tracking model (mm/s², 0=constant velocity)')
+    parser.add_argument('--fall-speed', type=float, default=defaults['fall_speed_mm_s'],
+                        help='Expected fall speed (mm/s); new tracks start with it')
+    parser.add_argument('--gate-mm', type=float, default=defaults['association_gate_mm'],
+                        help='Association gate (mm, default: one frame of fall at --fall-speed)')
+    parser.add_argument('--params',
+                        help='Ranked parameter file from tune_tracker.py (gates, noise, lifecycle)')
+    parser.add_argument('--params-rank', type=int, default=1)
+    parser.add_argument('--entry-fraction', type=float, default=defaults['entry_fraction'],
+                        help='Leading share of each track fitted as its undeflected path '
+                             '(0 = tangent of the whole-track fit)')
+    parser.add_argument('--min-points', type=int, default=defaults['min_points'],
+                        help='Detections needed to analyse a track')
+    parser.add_argument('--shard-frames', type=int, default=defaults['shard_frames'])
+    parser.add_argument('--max-track-frames', type=int, default=defaults['max_track_frames'],
+                        help='Frames a shard may read past its end to finish its tracks')
+    parser.add_argument('--workers', type=int, default=defaults['workers'],
+                        help='Worker processes (default: one per core)')
+    parser.add_argument('--threshold-mm', type=float, default=defaults['threshold_mm'])
+    parser.add_argument('--min-fraction', type=float, default=defaults['min_fraction'],
+                        help='Share of droplets above --threshold-mm for the criterion')
+    parser.add_argument('--attach', action='store_true',
+                        help=f'Attach the summary to the {TEST_ID} test execution')
+    parser.add_argument('--engineer', default='', help='Test engineer recorded with --attach')
+    parser.add_argument('--verification-dir',
+                        default=os.path.join(os.path.dirname(__file__),
+                                             defaults['verification_dir']),
+                        help='Test management state updated by --attach')
+    args = parser.parse_args()
+
+    if not 8 <= args.bit_depth <= 16:
+        parser.error("--bit-depth must be 8-16")
+    # Droplets move a large part of the gate every frame at >1000 fps, so
+    # new tracks start at the expected fall velocity along the fall direction
+    tilt = math.radians(args.tilt_deg)
+    down = (math.sin(tilt), math.cos(tilt))
+    kalman = dict(KALMAN_CONFIG, dt=1.0 / args.fps,
+                  gravity_mm_s2=(args.gravity * down[0], args.gravity * down[1]),
+                  initial_velocity_mm_s=(args.fall_speed * down[0], args.fall_speed * down[1]),
+                  motion_model='ballistic' if args.gravity else 'constant_velocity')
+    kalman['measurement_noise'] = defaults['measurement_noise']
+    gate_mm = args.gate_mm
+    if gate_mm is None:
+        gate_mm = max(defaults['min_gate_mm'], args.fall_speed / args.fps)
+    parameters = {'association_gate_mm': gate_mm}
+    if args.params:
+        try:
+            tuned = load_tuned_parameters(args.params, args.params_rank)
+        except (OSError, ValueError) as e:
+            parser.error(f"--params: {e}")
+        # The tuned threshold is a temperature; --threshold is used instead
+        tuned.pop('min_temp_celsius', None)
+        kalman.update((k, v) for k, v in tuned.items() if k in KALMAN_CONFIG)
+        parameters.update((k, v) for k, v in tuned.items() if k not in KALMAN_CONFIG)
+
+    settings = {
+        'fps': args.fps,
+        'pixel_to_mm': args.pixel_to_mm,
+        'kalman': kalman,
+        'parameters': parameters,
+        'fall_speed_mm_s': args.fall_speed,
+        # Frames deeper than the 14-bit lookup table are shifted down
+        'threshold': args.threshold / (1 << max(0, args.bit_depth - 14)),
+        'bit_depth': args.bit_depth,
+        'invert': args.dark,
+        'tilt_deg': args.tilt_deg,
+        'min_points': args.min_points,
+        'entry_fraction': args.entry_fraction,
+    }
+
+    print(f"Analysing {len(args.sequences)} sequences "
+          f"({args.workers or os.cpu_count()} workers, {args.shard_frames} frames per shard)")
+    started = time.time()
+
+    def progress(done, total, frames_read):
+        progress.frames += frames_read
+        elapsed = time.time() - started
+        print(f"\r{done}/{total} shards, {progress.frames} frames "
+              f"({progress.frames / max(elapsed, 1e-9):.0f} fps)", end='')
+    progress.frames = 0
+
+    records, lengths = analyze(args.sequences, settings, workers=args.workers,
+                               shard_frames=args.shard_frames,
+                               lead_frames=defaults['lead_frames'],
+                               tail_frames=args.max_track_frames, progress=progress)
+    print()
+
+    overall = summarize(records, args.threshold_mm)
+    if not overall['droplets']:
+        # A tracking or configuration failure, not a physics result
+        print(f"No droplet tracks with {args.min_points}+ detections in "
+              f"{sum(lengths)} frames; check --threshold ({args.threshold:g} counts, "
+              f"--dark/--bright), --fall-speed and the gate ({gate_mm:g} mm)",
+              file=sys.stderr)
+        sys.exit(1)
+    summary = {
+        'test_id': TEST_ID,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {k: v for k, v in settings.items() if k != 'kalman'},
+        'sequences': [dict(summarize(records[records['sequence'] == i], args.threshold_mm),
+                           path=path, frames=lengths[i])
+                      for i, path in enumerate(args.sequences)],
+        'overall': overall,
+        'min_fraction': args.min_fraction,
+        'deflection_criterion_met': overall['deflected_fraction'] >= args.min_fraction,
+    }
+    summary_path = save_results(args.output_dir, args.sequences, records, lengths, summary)
+
+    for entry in summary['sequences']:
+        line = f"{entry['path']}: {entry['droplets']} droplets, {entry['deflected']} deflected"
+        if entry['droplets']:
+            line += (f", median |deflection| {entry['deflection_median_abs_mm']:.3f} mm"
+                     f", p95 {entry['deflection_p95_abs_mm']:.3f} mm")
+        print(line)
+    print(f"Deflection > {args.threshold_mm} mm: {overall['deflected']}/{overall['droplets']} "
+          f"droplets -> criterion {'met' if summary['deflection_criterion_met'] else 'NOT met'}")
+    print(f"Results saved to {args.output_dir}")
+
+    if args.attach:
+        notes = attach(summary, summary_path, args.verification_dir, args.engineer)
+        print(f"{TEST_ID} updated: {notes}")
+
+
+if __name__ == "__main__":
+    main()
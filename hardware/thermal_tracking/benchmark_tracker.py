@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Stage benchmark for the thermal droplet tracker
+Times detect_droplets, update_kalman_trackers and send_to_fpga on
+synthetic droplet scenes against the SR014 control loop budget
+"""
+
+import sys
+import os
+import json
+import time
+import argparse
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), 'code'))
+
+from thermal_droplet_tracker import ThermalDropletTracker
+from frame_sources import FrameSource
+from synthetic_scene import SyntheticDropletScene
+from kalman_filter_bank import KalmanFilterBank
+from motion_model import BallisticModel
+from tiled_detection import TiledDetector
+
+# SR014: total control loop time (see docs/behavioral/diagrams/control-loop.py)
+LOOP_BUDGET_MS = 3.0
+
+STAGES = ('detect', 'track', 'send', 'total')
+
+
+def summarize(samples_ns):
+    """p50/p99/max of a timing series in milliseconds"""
+    samples_ms = np.asarray(samples_ns) / 1e6
+    return {
+        'p50': float(np.percentile(samples_ms, 50)),
+        'p99': float(np.percentile(samples_ms, 99)),
+        'max': float(samples_ms.max()),
+    }
+
+
+def benchmark_droplet_count(num_droplets, args):
+    """Run the tracker stages over a synthetic scene with num_droplets in view"""
+    scene = SyntheticDropletScene(
+        num_droplets=num_droplets,
+        droplet_temp=args.droplet_temp,
+        radius=args.radius,
+        velocity=(0.0, args.velocity),
+        gravity=args.gravity,
+        noise=args.noise,
+        merge_distance=args.merge_distance,
+        width=args.width,
+        height=args.height,
+        seed=args.seed
+    )
+    # Render up front so scene generation is not part of the measurement
+    frames, timestamps, _ = scene.generate(args.warmup + args.frames)
+
+    tracker = ThermalDropletTracker(
+        fpga_ip=args.fpga_ip,
+        fpga_port=args.fpga_port,
+        frame_source=FrameSource()
+    )
+    tracker.min_temp_celsius = args.min_temp
+    tracker.detection_mode = args.detection_mode
+    tracker.roi_detection = args.roi
+    tracker.fpga_protocol = args.fpga_protocol
+    tracker.roi.sweep_interval = args.roi_sweep
+    tracker.max_droplets = max(tracker.max_droplets, num_droplets)
+    if args.tiles:
+        rows, cols = (int(n) for n in args.tiles.lower().split('x'))
+        tracker.tiler = TiledDetector(tracker, (rows, cols))
+    if args.gravity:
+        # Same acceleration as the scene, in mm/s²
+        tracker.trackers = KalmanFilterBank(motion_model=BallisticModel(
+            (0.0, args.gravity * tracker.pixel_to_mm * scene.frame_rate ** 2)))
+
+    timings = {stage: np.zeros(args.frames, dtype=np.int64) for stage in STAGES}
+    detections_seen = 0
+    tracks_seen = 0
+
+    try:
+        for i, frame in enumerate(frames):
+            t0 = time.perf_counter_ns()
+            tracker.trackers.set_dt(tracker.frame_interval(timestamps[i]))
+            detections = tracker.detect_droplets(frame)
+            t1 = time.perf_counter_ns()
+            tracker.update_kalman_trackers(detections)
+            t2 = time.perf_counter_ns()
+            tracker.send_to_fpga(tracker.trackers)
+            t3 = time.perf_counter_ns()
+
+            if i < args.warmup:
+                continue
+            k = i - args.warmup
+            timings['detect'][k] = t1 - t0
+            timings['track'][k] = t2 - t1
+            timings['send'][k] = t3 - t2
+            timings['total'][k] = t3 - t0
+            detections_seen += len(detections)
+            tracks_seen += len(tracker.trackers)
+    finally:
+        tracker.cleanup()
+
+    result = {stage: summarize(timings[stage]) for stage in STAGES}
+    result['droplets'] = num_droplets
+    result['mean_detections'] = detections_seen / args.frames
+    result['mean_tracks'] = tracks_seen / args.frames
+    result['budget_used_p99'] = result['total']['p99'] / LOOP_BUDGET_MS
+    if args.roi:
+        result['roi'] = tracker.roi.stats()
+    return result
+
+
+def print_results(results):
+    """Print a per-stage timing table"""
+    header = f"{'Droplets':>8} {'Dets':>6} {'Tracks':>6}"
+    for stage in STAGES:
+        header += f" | {stage + ' p50/p99/max (ms)':>26}"
+    header += f" | {'SR014 p99':>9}"
+    print(header)
+    print('-' * len(header))
+
+    for r in results:
+        line = f"{r['droplets']:>8} {r['mean_detections']:>6.1f} {r['mean_tracks']:>6.1f}"
+        for stage in STAGES:
+            s = r[stage]
+            line += f" | {s['p50']:>8.3f}/{s['p99']:>7.3f}/{s['max']:>8.3f}"
+        line += f" | {r['budget_used_p99'] * 100:>8.0f}%"
+        print(line)
+
+    roi_results = [r for r in results if 'roi' in r]
+    if roi_results:
+        print(f"\n{'Droplets':>8} {'ROI frames':>10} {'Sweeps':>6} "
+              f"{'Hit rate':>8} {'Outside':>7} {'Pixels':>6}")
+        for r in roi_results:
+            roi = r['roi']
+            print(f"{r['droplets']:>8} {roi['roi_frames']:>10} {roi['full_sweeps']:>6} "
+                  f"{roi['hit_rate'] * 100:>7.1f}% {roi['sweep_outside']:>7} "
+                  f"{roi['pixel_fraction'] * 100:>5.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark thermal tracker stages on synthetic droplet scenes"
+    )
+    parser.add_argument(
+        '--droplets',
+        default='1,2,5,10,25,50,100,200,400',
+        help='Comma-separated droplet counts to benchmark'
+    )
+    parser.add_argument('--frames', type=int, default=600,
+                        help='Measured frames per droplet count')
+    parser.add_argument('--warmup', type=int, default=60,
+                        help='Unmeasured warm-up frames per droplet count')
+    parser.add_argument('--droplet-temp', type=float, default=300.0,
+                        help='Droplet temperature (°C)')
+    parser.add_argument('--min-temp', type=float, default=200,
+                        help='Tracker minimum temperature (°C)')
+    parser.add_argument('--detection-mode', choices=['raw', 'legacy'],
+                        default='raw', help='Tracker detection mode')
+    parser.add_argument('--roi', action='store_true',
+                        help='Enable prediction-guided ROI detection')
+    parser.add_argument('--roi-sweep', type=int, default=30,
+                        help='Frames between full-frame sweeps with --roi')
+    parser.add_argument('--tiles', metavar='ROWSxCOLS',
+                        help='Tiled full-frame detection on a worker pool (e.g. 2x2)')
+    parser.add_argument('--width', type=int, default=320,
+                        help='Scene width (pixels, A35: 320)')
+    parser.add_argument('--height', type=int, default=256,
+                        help='Scene height (pixels, A35: 256)')
+    parser.add_argument('--radius', type=float, default=3.0,
+                        help='Droplet radius (pixels)')
+    parser.add_argument('--velocity', type=float, default=3.0,
+                        help='Fall velocity (pixels/frame)')
+    parser.add_argument('--gravity', type=float, default=0.0,
+                        help='Fall acceleration (pixels/frame², tracked with the ballistic model)')
+    parser.add_argument('--noise', type=float, default=2.0,
+                        help='Sensor noise (counts, 1 sigma)')
+    parser.add_argument('--merge-distance', type=float, default=0.0,
+                        help='Merge droplets closer than this (pixels, 0=off)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Scene random seed')
+    parser.add_argument('--fpga-ip', default='127.0.0.1',
+                        help='Destination for FPGA packets')
+    parser.add_argument('--fpga-port', type=int, default=5000,
+                        help='Destination UDP port')
+    parser.add_argument('--fpga-protocol', choices=['legacy', 'framed'],
+                        default='legacy', help='FPGA packet format')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Also write results as JSON')
+
+    args = parser.parse_args()
+    counts = [int(n) for n in args.droplets.split(',') if n]
+
+    print(f"SR014 loop budget: {LOOP_BUDGET_MS:.1f} ms | "
+          f"{args.frames} frames per run after {args.warmup} warm-up\n")
+
+    results = []
+    for num_droplets in counts:
+        results.append(benchmark_droplet_count(num_droplets, args))
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'budget_ms': LOOP_BUDGET_MS,
+                'frames': args.frames,
+                'results': results
+            }, f, indent=2)
+        print(f"\nResults saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
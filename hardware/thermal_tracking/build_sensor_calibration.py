@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Build and publish sensor calibration versions for the thermal tracker
+Combines lens intrinsics, a two-point non-uniformity correction and a
+noise map from recordings of uniform targets, and emissivity tables for
+the alloys of a DRIP level into a new version under calibration/sensor.
+A running tracker switches to a published version between frames.
+"""
+
+import sys
+import os
+import json
+import argparse
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), 'code'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from thermal_droplet_tracker import ThermalDropletTracker
+from frame_sources import FrameSource
+from frame_statistics import accumulate_recording
+from sensor_calibration import (SensorCalibration, save_calibration, publish_version,
+                                current_version, version_name)
+from config.performance_config import CALIBRATION_CONFIG
+from models.component_registry import ComponentRegistry
+
+
+def load_intrinsics(path):
+    """(camera_matrix, dist_coeffs) from an OpenCV .npz or a JSON file"""
+    if path.endswith('.json'):
+        with open(path) as f:
+            data = json.load(f)
+    else:
+        data = np.load(path)
+    return np.asarray(data['camera_matrix']), np.asarray(data['dist_coeffs'])
+
+
+def two_point_nuc(cold, hot):
+    """
+    Gain and offset maps mapping each pixel's response onto the array mean
+    cold and hot are per-pixel means of two uniform targets
+    """
+    span = hot - cold
+    if np.any(span <= 0):
+        raise SystemExit("Hot flat-field is not hotter than the cold one at every pixel")
+    gain = (hot.mean() - cold.mean()) / span
+    offset = cold.mean() - gain * cold
+    return gain, offset
+
+
+def level_materials(level):
+    return ComponentRegistry.LEVEL_CAPABILITIES[level]['materials']
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build, list and publish versioned sensor calibrations"
+    )
+    parser.add_argument('--root', default=CALIBRATION_CONFIG['sensor_dir'],
+                        help='Calibration directory (version directories + CURRENT)')
+    parser.add_argument('--resolution', metavar='WxH',
+                        help='Sensor resolution (default: from the flat fields, else 320x256)')
+    parser.add_argument('--intrinsics', metavar='PATH',
+                        help='camera_matrix and dist_coeffs (.npz or .json, OpenCV model)')
+    parser.add_argument('--flat-cold', metavar='RECORDING',
+                        help='Recording of a uniform cold target (two-point NUC)')
+    parser.add_argument('--flat-hot', metavar='RECORDING',
+                        help='Recording of a uniform hot target (two-point NUC)')
+    parser.add_argument('--noise-map', metavar='PATH',
+                        help='Per-pixel noise (.npy, e.g. calibration/noise_map.npy); '
+                             'default: from the cold flat field')
+    parser.add_argument('--level', type=int, choices=sorted(ComponentRegistry.LEVEL_CAPABILITIES),
+                        help='Emissivity tables for the alloys of this DRIP level')
+    parser.add_argument('--emissivity', metavar='MATERIAL=E', nargs='+', default=[],
+                        help='Emissivity override or additional material')
+    parser.add_argument('--reflected-temp', type=float,
+                        default=CALIBRATION_CONFIG['reflected_temp_c'],
+                        help='Reflected (chamber wall) temperature (°C)')
+    parser.add_argument('--notes', default='', help='Stored in the manifest')
+    parser.add_argument('--no-publish', action='store_true',
+                        help='Write the version without switching CURRENT to it')
+    parser.add_argument('--publish', type=int, metavar='VERSION',
+                        help='Only switch CURRENT to an existing version (e.g. roll back)')
+    parser.add_argument('--list', action='store_true', help='List versions')
+    args = parser.parse_args()
+
+    if args.list:
+        current = current_version(args.root)
+        names = sorted(n for n in os.listdir(args.root) if n.startswith('v')) \
+            if os.path.isdir(args.root) else []
+        for name in names:
+            try:
+                description = SensorCalibration(os.path.join(args.root, name)).describe()
+            except (OSError, ValueError, KeyError) as e:
+                description = f"{name}: unreadable ({e})"
+            print(("* " if name == current else "  ") + description)
+        return
+
+    if args.publish is not None:
+        SensorCalibration(os.path.join(args.root, version_name(args.publish)))
+        publish_version(args.root, args.publish)
+        print(f"CURRENT -> {version_name(args.publish)}")
+        return
+
+    nuc_gain = nuc_offset = noise_map = None
+    resolution = (320, 256)
+    if args.flat_cold or args.flat_hot:
+        if not (args.flat_cold and args.flat_hot):
+            parser.error("two-point NUC needs --flat-cold and --flat-hot")
+        cold = accumulate_recording(args.flat_cold)
+        hot = accumulate_recording(args.flat_hot)
+        nuc_gain, nuc_offset = two_point_nuc(cold.mean.astype(np.float64),
+                                             hot.mean.astype(np.float64))
+        noise_map = cold.noise_map()
+        resolution = (cold.shape[1], cold.shape[0])
+        print(f"NUC: gain {nuc_gain.min():.3f}..{nuc_gain.max():.3f}, "
+              f"offset {nuc_offset.min():+.1f}..{nuc_offset.max():+.1f} counts, "
+              f"{cold.count} + {hot.count} frames")
+    if args.noise_map:
+        noise_map = np.load(args.noise_map)
+        resolution = (noise_map.shape[1], noise_map.shape[0])
+    if args.resolution:
+        resolution = tuple(int(n) for n in args.resolution.lower().split('x'))
+        for name, grid in (('flat fields', nuc_gain), ('noise map', noise_map)):
+            if grid is not None and grid.shape != resolution[::-1]:
+                parser.error(f"{name} are {grid.shape[1]}x{grid.shape[0]}")
+
+    camera_matrix = dist_coeffs = None
+    if args.intrinsics:
+        camera_matrix, dist_coeffs = load_intrinsics(args.intrinsics)
+
+    emissivity = {}
+    if args.level:
+        table = CALIBRATION_CONFIG['material_emissivity']
+        emissivity = {m: table[m] for m in level_materials(args.level)}
+    for item in args.emissivity:
+        material, value = item.split('=')
+        emissivity[material] = float(value)
+
+    # The camera's blackbody count → temperature conversion
+    tracker = ThermalDropletTracker(frame_source=FrameSource())
+    apparent_lut = tracker.temperature_lut
+    tracker.cleanup()
+
+    path = save_calibration(
+        args.root, resolution,
+        camera_matrix=camera_matrix, dist_coeffs=dist_coeffs,
+        nuc_gain=nuc_gain, nuc_offset=nuc_offset, noise_map=noise_map,
+        apparent_lut=apparent_lut, emissivity=emissivity,
+        reflected_temp=args.reflected_temp, notes=args.notes,
+        publish=not args.no_publish
+    )
+    print(SensorCalibration(path).describe())
+    print(f"Written to {path}" + ("" if args.no_publish else " (published)"))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,10 +8,38 @@ import numpy as np
 import cv2
 import time
 
-def calibrate_camera(tracker):
+from frame_statistics import PixelStatistics
+
+def capture_statistics(tracker, num_frames):
+    """
+    Stream num_frames complete frames into per-pixel running statistics
+    Memory stays constant however many frames are averaged; returns None
+    if no complete frame arrived
+    """
+    height, width = tracker.frame_shape
+    stats = PixelStatistics((height, width))
+    for i in range(num_frames):
+        try:
+            image_result = tracker.frame_source.next_image(1000)
+            if image_result is None:
+                break
+            if not image_result.IsIncomplete():
+                stats.add(image_result.GetNDArray())
+            image_result.Release()
+            
+            # Progress bar
+            progress = int((i + 1) / num_frames * 50)
+            print(f"\r[{'='*progress}{' '*(50-progress)}] {i+1}/{num_frames}", end='')
+        except Exception as e:
+            print(f"\nError capturing frame: {e}")
+            return None
+    return stats if stats.count else None
+
+def calibrate_camera(tracker, num_frames=60):
     """
     Calibrate pixel-to-mm conversion using known target
     Place a heated target of known size at known position
+    num_frames are averaged (use more for Level 2+ steel temperatures)
     """
     print("\nCAMERA CALIBRATION PROCEDURE")
     print("============================")
@@ -30,26 +58,20 @@ def calibrate_camera(tracker):
     
     print("\nCapturing calibration frames...")
     
-    # Capture frames for averaging
-    frames = []
-    for i in range(60):  # 1 second of data at 60Hz
-        try:
-            image_result = tracker.camera.GetNextImage(1000)
-            if not image_result.IsIncomplete():
-                frames.append(image_result.GetNDArray())
-            image_result.Release()
-            
-            # Progress bar
-            progress = int((i + 1) / 60 * 50)
-            print(f"\r[{'='*progress}{' '*(50-progress)}] {i+1}/60", end='')
-        except Exception as e:
-            print(f"\nError capturing frame: {e}")
-            return
+    # Running per-pixel mean/variance of the capture (constant memory)
+    stats = capture_statistics(tracker, num_frames)
     
     print("\n\nProcessing calibration data...")
     
-    # Average frames to reduce noise
-    avg_frame = np.mean(frames, axis=0)
+    if stats is None:
+        print("\nERROR: No complete calibration frames captured!")
+        return
+    
+    # Averaged frame, and per-pixel temporal noise for adaptive thresholds
+    avg_frame = stats.mean
+    noise = stats.summary()
+    print(f"Averaged {noise['frames']} frames, noise {noise['noise_median']:.2f} counts "
+          f"(p99 {noise['noise_p99']:.2f})")
     
     # Convert to temperature
     temp_frame = tracker.pixel_to_temperature(avg_frame)
@@ -118,21 +140,25 @@ def calibrate_camera(tracker):
     
     # Save calibration
     tracker.pixel_to_mm = pixel_to_mm_avg
+    height, width = avg_frame.shape
     
     calib_data = {
         'pixel_to_mm': pixel_to_mm_avg,
         'pixel_to_mm_width': pixel_to_mm_width,
         'pixel_to_mm_height': pixel_to_mm_height,
-        'image_center': [160, 128],  # A35 resolution 320×256
+        'image_center': [width / 2, height / 2],  # Optical axis (pixel x, y)
         'target_size_mm': [target_width, target_height],
         'target_size_pixels': [w, h],
+        'frames_averaged': stats.count,
         'calibration_date': time.strftime('%Y-%m-%d %H:%M:%S'),
         'camera_model': 'FLIR A35',
-        'resolution': [320, 256]
+        'resolution': [width, height]
     }
     
     np.save('calibration/camera_calibration.npy', calib_data)
     print(f"\nCalibration saved to camera_calibration.npy")
+    np.save('calibration/noise_map.npy', stats.noise_map())
+    print("Noise map saved to noise_map.npy (build_sensor_calibration.py --noise-map)")
     
     # Optional: capture calibration image
     save_image = input("\nSave calibration image? (y/n): ").lower() == 'y'
@@ -176,7 +202,9 @@ def calibrate_camera(tracker):
         
         try:
             while time.time() - start_time < test_duration:
-                image_result = tracker.camera.GetNextImage(1000)
+                image_result = tracker.frame_source.next_image(1000)
+                if image_result is None:
+                    break
                 if not image_result.IsIncomplete():
                     frame = image_result.GetNDArray()
                     detections = tracker.detect_droplets(frame)
@@ -200,7 +228,7 @@ def calibrate_camera(tracker):
         print("\n\nCalibration test complete!")
 
 
-def verify_calibration(tracker):
+def verify_calibration(tracker, num_frames=60):
     """Verify existing calibration is still accurate"""
     try:
         calib_data = np.load('calibration/camera_calibration.npy', allow_pickle=True).item()
@@ -212,9 +240,23 @@ def verify_calibration(tracker):
         print(f"Target size: {calib_data['target_size_mm'][0]} × {calib_data['target_size_mm'][1]} mm")
         print(f"Detected pixels: {calib_data['target_size_pixels'][0]} × {calib_data['target_size_pixels'][1]}")
         
+        # Sensor noise now against the noise map of the last calibration
+        print(f"\nMeasuring sensor noise over {num_frames} frames...")
+        stats = capture_statistics(tracker, num_frames)
+        if stats is not None:
+            noise = stats.summary()
+            print(f"\nNoise: {noise['noise_median']:.2f} counts median, "
+                  f"{noise['noise_p99']:.2f} p99")
+            try:
+                saved = np.load('calibration/noise_map.npy')
+                print(f"At calibration: {np.median(saved):.2f} counts median, "
+                      f"{np.percentile(saved, 99):.2f} p99")
+            except FileNotFoundError:
+                pass
+        
         recalibrate = input("\nRecalibrate? (y/n): ").lower() == 'y'
         if recalibrate:
-            calibrate_camera(tracker)
+            calibrate_camera(tracker, num_frames)
         else:
             tracker.pixel_to_mm = calib_data['pixel_to_mm']
             print(f"Using existing calibration: {tracker.pixel_to_mm:.4f} mm/pixel")
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Gated detection-to-track association
+Splits the track/detection gating graph into independent clusters so
+that assignment cost grows with droplets per cluster, not total droplets
+"""
+
+from itertools import chain
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial import cKDTree
+
+# Above this many track×detection pairs, gate with a k-d tree instead of
+# computing the dense distance matrix
+DENSE_PAIR_LIMIT = 4096
+
+# Cost used for forbidden (out-of-gate) pairs inside a cluster
+_FORBIDDEN = 1e12
+
+_EMPTY = np.zeros(0, dtype=np.intp)
+
+
+def _inverse_2x2(cov):
+    """Closed-form inverse of a stack of 2×2 matrices"""
+    a, b = cov[:, 0, 0], cov[:, 0, 1]
+    c, d = cov[:, 1, 0], cov[:, 1, 1]
+    det = a * d - b * c
+    inv = np.empty_like(cov)
+    inv[:, 0, 0] = d / det
+    inv[:, 0, 1] = -b / det
+    inv[:, 1, 0] = -c / det
+    inv[:, 1, 1] = a / det
+    return inv
+
+
+def gated_pairs(track_xy, det_xy, gate, track_cov=None):
+    """
+    Find all track/detection pairs inside the gate
+
+    Without track_cov the cost is the Euclidean distance and gate is in mm.
+    With track_cov (N×2×2 position innovation covariances) the cost is the
+    squared Mahalanobis distance and gate is a chi-square threshold.
+    Returns (track_idx, det_idx, cost) arrays.
+    """
+    n, m = len(track_xy), len(det_xy)
+    cov_inv = None if track_cov is None else _inverse_2x2(track_cov)
+
+    if n * m <= DENSE_PAIR_LIMIT:
+        diff = det_xy[None, :, :] - track_xy[:, None, :]
+        if cov_inv is None:
+            d2 = np.einsum('ijk,ijk->ij', diff, diff)
+            rows, cols = np.nonzero(d2 < gate * gate)
+            return rows, cols, np.sqrt(d2[rows, cols])
+        m2 = np.einsum('ijk,ikl,ijl->ij', diff, cov_inv, diff)
+        rows, cols = np.nonzero(m2 < gate)
+        return rows, cols, m2[rows, cols]
+
+    # Sparse gating: Euclidean search radius per track
+    if cov_inv is None:
+        radius = gate
+    else:
+        # Largest eigenvalue of a 2×2 covariance is bounded by its trace
+        radius = np.sqrt(gate * np.trace(track_cov, axis1=1, axis2=2))
+    neighbors = cKDTree(det_xy).query_ball_point(track_xy, radius)
+    counts = np.fromiter((len(nb) for nb in neighbors), dtype=np.intp, count=n)
+    rows = np.repeat(np.arange(n), counts)
+    cols = np.fromiter(chain.from_iterable(neighbors), dtype=np.intp,
+                       count=int(counts.sum()))
+
+    diff = det_xy[cols] - track_xy[rows]
+    if cov_inv is None:
+        cost = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+    else:
+        cost = np.einsum('ij,ijk,ik->i', diff, cov_inv[rows], diff)
+    keep = cost < gate
+    return rows[keep], cols[keep], cost[keep]
+
+
+def cluster_labels(rows, cols, n, m):
+    """
+    Connected components of the bipartite gating graph
+    Nodes 0..n-1 are tracks and n..n+m-1 are detections. Uses min-label
+    propagation, which converges in a few passes for the small, sparse
+    clusters produced by gating. Returns (num_clusters, labels).
+    """
+    labels = np.arange(n + m)
+    a, b = rows, cols + n
+    while True:
+        low = np.minimum(labels[a], labels[b])
+        if np.array_equal(labels[a], low) and np.array_equal(labels[b], low):
+            break
+        np.minimum.at(labels, a, low)
+        np.minimum.at(labels, b, low)
+        labels = labels[labels]  # Pointer jumping
+    roots, labels = np.unique(labels, return_inverse=True)
+    return len(roots), labels
+
+
+def associate(track_xy, det_xy, gate, track_cov=None):
+    """
+    Assign detections to tracks within the gate
+    Returns (track_idx, det_idx) arrays of matched pairs
+    """
+    n, m = len(track_xy), len(det_xy)
+    if n == 0 or m == 0:
+        return _EMPTY, _EMPTY
+
+    rows, cols, cost = gated_pairs(track_xy, det_xy, gate, track_cov)
+    if len(rows) == 0:
+        return _EMPTY, _EMPTY
+
+    # Fastest path: a track and a detection that only gate with each other
+    lone = ((np.bincount(rows, minlength=n)[rows] == 1)
+            & (np.bincount(cols, minlength=m)[cols] == 1))
+    if lone.all():
+        return rows, cols
+    matched_rows = [rows[lone]]
+    matched_cols = [cols[lone]]
+    rows, cols, cost = rows[~lone], cols[~lone], cost[~lone]
+
+    num_clusters, labels = cluster_labels(rows, cols, n, m)
+    edge_cluster = labels[rows]
+    tracks_in = np.bincount(labels[:n], minlength=num_clusters)
+    dets_in = np.bincount(labels[n:], minlength=num_clusters)
+
+    # Fast path: clusters with a single track or a single detection are
+    # stars, so their cheapest edge is the optimal assignment
+    star = (tracks_in[edge_cluster] == 1) | (dets_in[edge_cluster] == 1)
+    edges = np.nonzero(star)[0]
+    edges = edges[np.lexsort((cost[edges], edge_cluster[edges]))]
+    first = np.ones(len(edges), dtype=bool)
+    first[1:] = edge_cluster[edges[1:]] != edge_cluster[edges[:-1]]
+    best = edges[first]
+    matched_rows.append(rows[best])
+    matched_cols.append(cols[best])
+
+    # Exact assignment for the remaining (contested) clusters
+    edges = np.nonzero(~star)[0]
+    if len(edges):
+        # Rank every node within its cluster; the stable sort keeps tracks
+        # (lower node numbers) ahead of detections
+        nodes = np.argsort(labels, kind='stable')
+        starts = np.searchsorted(labels[nodes], np.arange(num_clusters))
+        rank = np.empty_like(nodes)
+        rank[nodes] = np.arange(n + m) - starts[labels[nodes]]
+
+        edges = edges[np.argsort(edge_cluster[edges], kind='stable')]
+        splits = np.nonzero(np.diff(edge_cluster[edges]))[0] + 1
+        for group in np.split(edges, splits):
+            k = edge_cluster[group[0]]
+            num_tracks = tracks_in[k]
+            sub = np.full((num_tracks, dets_in[k]), _FORBIDDEN)
+            sub[rank[rows[group]], rank[cols[group] + n] - num_tracks] = cost[group]
+            a, b = linear_sum_assignment(sub)
+            ok = sub[a, b] < _FORBIDDEN
+            members = nodes[starts[k]:starts[k] + num_tracks + dets_in[k]]
+            matched_rows.append(members[a[ok]])
+            matched_cols.append(members[num_tracks + b[ok]] - n)
+
+    return np.concatenate(matched_rows), np.concatenate(matched_cols)
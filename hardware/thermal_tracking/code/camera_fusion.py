@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+Multi-camera tracking with 3D fusion
+Each thermal camera is tracked in 2D by its own worker process; a fusion
+stage time-aligns the per-camera tracks by camera timestamp, triangulates
+3D positions from the calibrated camera extrinsics and keeps one global
+track table that is sent to the FPGA with real Z
+"""
+
+import multiprocessing
+import queue
+import threading
+import time
+import numpy as np
+
+from frame_sources import SpinnakerFrameSource, ReplayFrameSource
+from kalman_filter_bank import TRACK_DTYPE, TrackSnapshot
+from latency_metrics import LatencyMonitor
+
+# Per-camera 2D track, in pixels, as sent by a camera worker
+CAMERA_TRACK_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('u', '<f8'),        # pixel column
+    ('v', '<f8'),        # pixel row
+    ('vu', '<f8'),       # pixels/s
+    ('vv', '<f8'),       # pixels/s
+    ('temp', '<f8'),
+    ('age', '<i4'),
+    ('missed', '<i4'),
+])
+
+# Global 3D track: TRACK_DTYPE plus Z, the number of cameras that saw the
+# droplet in this fused frame and the triangulation residual
+FUSED_TRACK_DTYPE = np.dtype(TRACK_DTYPE.descr + [
+    ('z', '<f8'),         # mm
+    ('vz', '<f8'),        # mm/s
+    ('views', '<i4'),
+    ('residual', '<f8'),  # RMS ray distance (mm)
+])
+
+# Fusion latency stages: camera skew within a fused frame, fusion time,
+# send_to_fpga call and oldest exposure → packet sent
+FUSION_STAGES = ('skew', 'fuse', 'send', 'total')
+
+# Time step (s) for differentiating positions into velocities
+VELOCITY_STEP = 0.01
+
+
+class CameraGeometry:
+    """
+    Pinhole model of one calibrated camera
+    K is the 3×3 intrinsic matrix (pixels), R and t map world (chamber)
+    coordinates in mm to camera coordinates: x_cam = R x_world + t.
+    serial selects the live camera (None: by position in the rig).
+    """
+
+    def __init__(self, K, R, t, name='', pixel_to_mm=0.5, serial=None):
+        self.K = np.asarray(K, dtype=float)
+        self.R = np.asarray(R, dtype=float)
+        self.t = np.asarray(t, dtype=float).reshape(3)
+        self.name = name
+        self.serial = serial
+        self.pixel_to_mm = pixel_to_mm  # Scale at the working distance (2D tracker)
+        self.K_inv = np.linalg.inv(self.K)
+        self.center = -self.R.T @ self.t
+
+    @classmethod
+    def from_pnp(cls, object_points, image_points, K, dist=None, name='', pixel_to_mm=0.5,
+                 serial=None):
+        """Extrinsics from known chamber points (mm) and their pixel positions"""
+        import cv2
+        ok, rvec, tvec = cv2.solvePnP(
+            np.asarray(object_points, dtype=np.float64),
+            np.asarray(image_points, dtype=np.float64),
+            np.asarray(K, dtype=np.float64), dist
+        )
+        if not ok:
+            raise ValueError(f"solvePnP failed for camera '{name}'")
+        R, _ = cv2.Rodrigues(rvec)
+        return cls(K, R, tvec, name, pixel_to_mm, serial)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['K'], data['R'], data['t'], data.get('name', ''),
+                   data.get('pixel_to_mm', 0.5), data.get('serial'))
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'K': self.K.tolist(),
+            'R': self.R.tolist(),
+            't': self.t.tolist(),
+            'pixel_to_mm': self.pixel_to_mm,
+            'serial': self.serial,
+        }
+
+    def rays(self, u, v):
+        """Unit world directions (N×3) of the rays through pixels (u, v)"""
+        pixels = np.column_stack([u, v, np.ones(len(u))])
+        directions = pixels @ (self.R.T @ self.K_inv).T
+        return directions / np.linalg.norm(directions, axis=1, keepdims=True)
+
+    def project(self, points):
+        """Pixel (u, v) of world points (N×3)"""
+        cam = np.asarray(points, dtype=float) @ self.R.T + self.t
+        uvw = cam @ self.K.T
+        return uvw[:, :2] / uvw[:, 2:3]
+
+
+def save_camera_rig(path, cameras):
+    """Save calibrated camera geometries, in camera order"""
+    np.save(path, {
+        'cameras': [camera.to_dict() for camera in cameras],
+        'calibration_date': time.strftime('%Y-%m-%d %H:%M:%S'),
+    })
+
+
+def load_camera_rig(path):
+    """Load the CameraGeometry list written by save_camera_rig"""
+    data = np.load(path, allow_pickle=True).item()
+    return [CameraGeometry.from_dict(camera) for camera in data['cameras']]
+
+
+def triangulate(origins, directions):
+    """
+    Least-squares intersection of rays origin + s * direction (unit)
+    Returns (point, rms distance of the point from the rays)
+    """
+    # Projectors onto the plane normal to each ray
+    projectors = np.eye(3) - directions[:, :, None] * directions[:, None, :]
+    A = projectors.sum(axis=0)
+    b = np.einsum('nij,nj->i', projectors, origins)
+    point = np.linalg.solve(A, b)
+    offsets = np.einsum('nij,nj->ni', projectors, point - origins)
+    return point, float(np.sqrt(np.mean(np.einsum('ni,ni->n', offsets, offsets))))
+
+
+def closest_on_ray(origin, direction, point):
+    """Point on a ray closest to point"""
+    return origin + max(np.dot(point - origin, direction), 0.0) * direction
+
+
+class TrackFusion:
+    """
+    Global 3D track table built from per-camera 2D tracks
+
+    A global track is a set of member (camera, local track ID) pairs.
+    Membership is established once, when rays from two cameras meet within
+    gate_mm (or a new camera's ray passes within gate_mm of an existing
+    track), and is then carried by the per-camera track IDs, so the
+    correspondence problem is only solved for new tracks. Every fused
+    frame each track is triangulated from its members' rays, with
+    velocities from triangulating the members' positions VELOCITY_STEP
+    ahead. A track seen by one camera keeps its last depth along that
+    camera's ray; a track whose members are all lost is dropped.
+    """
+
+    def __init__(self, cameras, gate_mm=10.0, min_track_age=3, max_missed_frames=5):
+        self.cameras = cameras
+        self.gate_mm = gate_mm
+        self.min_track_age = min_track_age
+        self.max_missed_frames = max_missed_frames
+        self.members = {}  # (camera, local ID) → global ID
+        self.table = np.zeros(0, dtype=FUSED_TRACK_DTYPE)
+        self.time_ns = None
+        self.next_id = 0
+        self.births = 0
+
+    def _observations(self, views, t_ns):
+        """(camera, local ID) → (origin, ray at t, ray at t + VELOCITY_STEP, temp, age)"""
+        observations = {}
+        for camera, (host_ns, records) in views.items():
+            if len(records) == 0:
+                continue
+            geometry = self.cameras[camera]
+            dt = (t_ns - host_ns) / 1e9
+            u = records['u'] + records['vu'] * dt
+            v = records['v'] + records['vv'] * dt
+            rays = geometry.rays(u, v)
+            ahead = geometry.rays(u + records['vu'] * VELOCITY_STEP,
+                                  v + records['vv'] * VELOCITY_STEP)
+            for i, record in enumerate(records):
+                observations[(camera, int(record['id']))] = (
+                    geometry.center, rays[i], ahead[i], record['temp'], int(record['age'])
+                )
+        return observations
+
+    def _assign(self, observations, predicted):
+        """Add unassigned, established local tracks to existing or new global tracks"""
+        free = [key for key in observations
+                if key not in self.members and observations[key][4] >= self.min_track_age]
+        taken = {(gid, camera) for (camera, _), gid in self.members.items()}
+
+        # Join a track whose predicted position lies on the ray
+        for key in list(free):
+            origin, ray = observations[key][:2]
+            best, best_distance = None, self.gate_mm
+            for gid, point in predicted.items():
+                if (gid, key[0]) in taken:
+                    continue
+                distance = np.linalg.norm(point - closest_on_ray(origin, ray, point))
+                if distance < best_distance:
+                    best, best_distance = gid, distance
+            if best is not None:
+                self.members[key] = best
+                taken.add((best, key[0]))
+                free.remove(key)
+
+        # Start tracks where rays from two cameras meet
+        pairs = []
+        for i, a in enumerate(free):
+            for b in free[i + 1:]:
+                if a[0] == b[0]:
+                    continue
+                (oa, ra), (ob, rb) = observations[a][:2], observations[b][:2]
+                point, residual = triangulate(np.array([oa, ob]), np.array([ra, rb]))
+                if (residual < self.gate_mm / 2 and np.dot(point - oa, ra) > 0
+                        and np.dot(point - ob, rb) > 0):
+                    pairs.append((residual, a, b, point))
+        used = set()
+        for residual, a, b, point in sorted(pairs, key=lambda pair: pair[0]):
+            if a in used or b in used:
+                continue
+            gid = self.next_id
+            self.next_id += 1
+            self.births += 1
+            for key in (a, b):
+                self.members[key] = gid
+                used.add(key)
+            predicted[gid] = point
+            # Further cameras whose rays pass through the new track
+            for key in free:
+                if key in used or key[0] in (a[0], b[0]):
+                    continue
+                origin, ray = observations[key][:2]
+                if np.linalg.norm(point - closest_on_ray(origin, ray, point)) < self.gate_mm:
+                    self.members[key] = gid
+                    used.add(key)
+
+    def fuse(self, views, t_ns):
+        """
+        Fuse per-camera tracks into the global table at host time t_ns
+        views maps camera index → (host_ns, CAMERA_TRACK_DTYPE records) for
+        the cameras taking part; a camera missing from views keeps its
+        memberships. Returns a TrackSnapshot of FUSED_TRACK_DTYPE records.
+        """
+        observations = self._observations(views, t_ns)
+
+        # Forget members whose local track ended
+        for key in [key for key in self.members
+                    if key[0] in views and key not in observations]:
+            del self.members[key]
+
+        # Previous table predicted to t_ns
+        dt = 0.0 if self.time_ns is None else (t_ns - self.time_ns) / 1e9
+        self.time_ns = t_ns
+        previous = {int(r['id']): r for r in self.table}
+        predicted = {gid: np.array([r['x'] + r['vx'] * dt, r['y'] + r['vy'] * dt,
+                                    r['z'] + r['vz'] * dt])
+                     for gid, r in previous.items()}
+
+        self._assign(observations, predicted)
+
+        grouped = {}
+        for key, gid in self.members.items():
+            if key in observations:
+                grouped.setdefault(gid, []).append(observations[key])
+
+        alive = set(self.members.values())
+        table = np.zeros(len(alive), dtype=FUSED_TRACK_DTYPE)
+        for row, gid in zip(table, sorted(alive)):
+            seen = grouped.get(gid, [])
+            old = previous.get(gid)
+            row['id'] = gid
+            row['views'] = len(seen)
+            if len(seen) >= 2:
+                origins = np.array([obs[0] for obs in seen])
+                point, residual = triangulate(origins, np.array([obs[1] for obs in seen]))
+                ahead, _ = triangulate(origins, np.array([obs[2] for obs in seen]))
+                row['residual'] = residual
+            elif seen and gid in predicted:
+                # One view: keep the previous depth along the ray
+                origin, ray, ray_ahead = seen[0][:3]
+                point = closest_on_ray(origin, ray, predicted[gid])
+                ahead = closest_on_ray(origin, ray_ahead, point + (
+                    np.array([old['vx'], old['vy'], old['vz']]) * VELOCITY_STEP))
+            elif old is not None:
+                # Members exist but their cameras did not report: coast
+                point = predicted[gid]
+                ahead = point + np.array([old['vx'], old['vy'], old['vz']]) * VELOCITY_STEP
+            else:
+                continue
+            velocity = (ahead - point) / VELOCITY_STEP
+            row['x'], row['y'], row['z'] = point
+            row['vx'], row['vy'], row['vz'] = velocity
+            row['temp'] = np.mean([obs[3] for obs in seen]) if seen else old['temp']
+            row['age'] = 0 if old is None else old['age'] + 1
+            row['missed'] = 0 if seen else old['missed'] + 1
+
+        # Drop tracks that have coasted too long
+        lost = table['missed'] > self.max_missed_frames
+        for gid in table['id'][lost].tolist():
+            for key in [key for key, value in self.members.items() if value == gid]:
+                del self.members[key]
+        self.table = table[~lost]
+        return TrackSnapshot(self.table.copy())
+
+
+def make_frame_source(spec):
+    """
+    Frame source for a camera worker from a picklable spec:
+    {'serial': ...} or {'index': i} for a live camera, or
+    {'replay': path, 'speed': 1.0, 'loop': False} for a recording
+    """
+    if 'replay' in spec:
+        return ReplayFrameSource(spec['replay'], speed=spec.get('speed', 1.0),
+                                 loop=spec.get('loop', False))
+    return SpinnakerFrameSource(serial=spec.get('serial'), index=spec.get('index', 0))
+
+
+def live_sources(cameras):
+    """Frame source specs for the live cameras of a rig"""
+    return [{'serial': camera.serial} if camera.serial is not None else {'index': i}
+            for i, camera in enumerate(cameras)]
+
+
+def camera_tracks(tracker):
+    """The worker tracker's tracks as CAMERA_TRACK_DTYPE records (pixels)"""
+    records = tracker.trackers.snapshot().records
+    tracks = np.zeros(len(records), dtype=CAMERA_TRACK_DTYPE)
+    uv = tracker.mm_to_pixel(np.column_stack([records['x'], records['y']]))
+    tracks['id'] = records['id']
+    tracks['u'], tracks['v'] = uv[:, 0], uv[:, 1]
+    tracks['vu'] = records['vx'] / tracker.pixel_to_mm
+    tracks['vv'] = records['vy'] / tracker.pixel_to_mm
+    tracks['temp'] = records['temp']
+    tracks['age'] = records['age']
+    tracks['missed'] = records['missed']
+    return tracks
+
+
+def _camera_main(index, spec, settings, kalman_config, results, stop_event):
+    """
+    Camera worker process: 2D tracking of one camera
+    Puts (camera, frame_id, camera_timestamp, host_ns, tracks) on results
+    for every frame and (camera, None, ...) when the source ends.
+    host_ns is on the perf_counter clock (CLOCK_MONOTONIC), which is
+    shared by all processes on the host.
+    """
+    from thermal_droplet_tracker import ThermalDropletTracker
+    tracker = ThermalDropletTracker(frame_source=make_frame_source(spec))
+    if kalman_config is not None:
+        tracker.configure_kalman(kalman_config)
+    for name, value in settings.items():
+        setattr(tracker, name, value)
+    source = tracker.frame_source
+    try:
+        tracker.initialize_camera()
+        source.begin()
+        while not stop_event.is_set():
+            image = source.next_image(1000)
+            if image is None:
+                break
+            if image.IsIncomplete():
+                image.Release()
+                continue
+            camera_timestamp = image.GetTimeStamp()
+            host_ns = tracker.camera_clock.update(camera_timestamp, time.perf_counter_ns())
+            tracker.track_frame(image.GetNDArray(), camera_timestamp)
+            frame_id = image.GetFrameID()
+            image.Release()
+            results.put((index, frame_id, camera_timestamp, host_ns, camera_tracks(tracker)))
+    except KeyboardInterrupt:
+        pass  # Ctrl+C reaches the whole process group; the parent shuts down
+    finally:
+        results.put((index, None, 0, 0, None))
+        source.end()
+        tracker.cleanup()
+
+
+class MultiCameraTracker:
+    """
+    N cameras, each tracked in its own process, fused into one track table
+
+    Camera workers share nothing but a result queue, so per-camera work
+    (detection, 2D association and filtering) scales across cores. The
+    fusion thread keeps the newest report of every camera and fuses once
+    every camera has reported since the last fused frame; a camera more
+    than max_skew_ms behind the newest report sits that frame out, so a
+    stalled camera cannot hold up the others. The fused table goes to
+    the FPGA through sender.send_to_fpga(), with the fused host time as
+    the timestamp (sender.camera_clock should be a HostClock). Camera
+    trackers take their filter settings from kalman_config (KALMAN_CONFIG).
+    """
+
+    def __init__(self, cameras, sources, sender, settings=None, kalman_config=None,
+                 max_skew_ms=20.0, gate_mm=10.0, min_track_age=3, max_missed_frames=5):
+        if len(cameras) < 2:
+            raise ValueError("Multi-camera tracking needs at least two calibrated cameras")
+        if len(sources) != len(cameras):
+            raise ValueError(f"{len(sources)} frame sources for {len(cameras)} cameras")
+        self.cameras = cameras
+        self.sources = sources
+        self.sender = sender
+        self.settings = settings or {}
+        self.max_skew_ns = int(max_skew_ms * 1e6)
+        self.fusion = TrackFusion(cameras, gate_mm, min_track_age, max_missed_frames)
+        self.latency = LatencyMonitor(FUSION_STAGES)
+
+        context = multiprocessing.get_context('spawn')
+        self.results = context.Queue()
+        self.stop_event = context.Event()
+        self.workers = [
+            context.Process(
+                target=_camera_main,
+                args=(i, spec, dict(self.settings, pixel_to_mm=cameras[i].pixel_to_mm),
+                      kalman_config, self.results, self.stop_event),
+                name=f'thermal-camera-{i}',
+                daemon=True
+            )
+            for i, spec in enumerate(sources)
+        ]
+        self.thread = None
+        self.running = False
+        self.latest = None  # TrackSnapshot of the last fused frame
+        self.frames = [0] * len(cameras)
+        self.fused = 0
+        self.skipped = 0  # Camera reports left out of a fused frame as too old
+        self.sent = 0
+        self.errors = 0
+
+    def start(self):
+        self.running = True
+        for worker in self.workers:
+            worker.start()
+        self.thread = threading.Thread(target=self._fusion_loop, name='thermal-fusion',
+                                       daemon=True)
+        self.thread.start()
+
+    def is_running(self):
+        return self.running
+
+    def _fusion_loop(self):
+        pending = {}  # camera → (host_ns, frame_id, tracks) reported since last fusion
+        live = set(range(len(self.cameras)))
+        while live and not self.stop_event.is_set():
+            try:
+                item = self.results.get(timeout=0.1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in self.workers):
+                    break  # Workers died without reporting the end of their source
+                item = None
+            # Drain everything that arrived; only the newest report per camera matters
+            while item is not None:
+                camera, frame_id, _, host_ns, tracks = item
+                if frame_id is None:
+                    live.discard(camera)
+                    pending.pop(camera, None)
+                else:
+                    self.frames[camera] += 1
+                    pending[camera] = (host_ns, frame_id, tracks)
+                try:
+                    item = self.results.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            if not pending:
+                continue
+            newest = max(report[0] for report in pending.values())
+            if len(pending) < len(live) and time.perf_counter_ns() - newest < self.max_skew_ns:
+                continue  # Wait for the remaining cameras
+            self._fuse(pending, newest)
+            pending.clear()
+        self.running = False
+
+    def _fuse(self, pending, t_ns):
+        views = {}
+        for camera, (host_ns, _, tracks) in pending.items():
+            if t_ns - host_ns > self.max_skew_ns:
+                self.skipped += 1
+                continue
+            views[camera] = (host_ns, tracks)
+        frame_id = self.fused
+        oldest = min(host_ns for host_ns, _ in views.values())
+        self.latency.record('skew', t_ns - oldest, frame_id)
+
+        t0 = time.perf_counter_ns()
+        self.latest = self.fusion.fuse(views, t_ns)
+        t1 = time.perf_counter_ns()
+        try:
+            self.sender.send_to_fpga(self.latest, t_ns)
+            self.sent += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"\nFPGA send error: {e}")
+        t2 = time.perf_counter_ns()
+        self.latency.record('fuse', t1 - t0, frame_id)
+        self.latency.record('send', t2 - t1, frame_id)
+        self.latency.record('total', t2 - oldest, frame_id)
+        self.fused += 1
+
+    def stats(self):
+        return {
+            'camera_frames': list(self.frames),
+            'fused': self.fused,
+            'skipped': self.skipped,
+            'sent': self.sent,
+            'errors': self.errors,
+            'tracks': len(self.fusion.table),
+            'births': self.fusion.births,
+        }
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for worker in self.workers:
+            if worker.pid is not None:
+                worker.join(2.0)
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+        self.running = False
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Clock synchronization for the tracking loop
+Maps camera chunk timestamps onto the host monotonic clock, and the host
+clock onto the FPGA's, so track states can be predicted to the time the
+transducers actually act on them
+"""
+
+from collections import deque
+import numpy as np
+
+
+class ClockOffsetEstimator:
+    """
+    Offset and drift of a remote clock (camera) against the host clock
+
+    Every sample (remote_ns, host_ns) taken on arrival bounds the offset
+    host - remote from above, since transport delay only ever adds. The
+    minimum of each block of samples is kept, and a line through the
+    recent block minima follows oscillator drift. fixed_delay_ns is the
+    part of the minimum transport delay that cannot be observed (exposure
+    to first byte on the wire); it is subtracted in to_host().
+
+    update() must be called from one thread; the fitted model is published
+    as a single tuple so other threads can call to_host() without locking.
+    """
+
+    def __init__(self, block=60, blocks=30, fixed_delay_ns=0):
+        self.block = block
+        self.fixed_delay_ns = fixed_delay_ns
+        self.minima = deque(maxlen=blocks)
+        self.resets = 0
+        self.reset()
+
+    def reset(self):
+        self.minima.clear()
+        self.samples = 0
+        self._last_remote = None
+        self._block_count = 0
+        self._block_min = None
+        # (reference remote time, offset at reference, drift) or None
+        self.model = None
+
+    def update(self, remote_ns, host_ns):
+        """Add one timestamp pair; returns the host time of remote_ns"""
+        remote_ns = int(remote_ns)
+        if self._last_remote is not None and remote_ns < self._last_remote:
+            self.reset()  # Camera clock restarted
+            self.resets += 1
+        self._last_remote = remote_ns
+        self.samples += 1
+
+        offset = host_ns - remote_ns
+        if self._block_min is None or offset < self._block_min[1]:
+            self._block_min = (remote_ns, offset)
+        self._block_count += 1
+
+        if not self.minima:
+            # No complete block yet: use the running minimum
+            self.model = (self._block_min[0], self._block_min[1], 0.0)
+        if self._block_count >= self.block:
+            self.minima.append(self._block_min)
+            self._block_min = None
+            self._block_count = 0
+            self._fit()
+        return self.to_host(remote_ns)
+
+    def _fit(self):
+        ref, base = self.minima[-1]
+        if len(self.minima) < 3:
+            self.model = (ref, min(offset for _, offset in self.minima), 0.0)
+            return
+        # Fit relative to the newest minimum to keep float64 precision
+        points = np.array(self.minima, dtype=np.int64) - (ref, base)
+        drift, intercept = np.polyfit(points[:, 0].astype(float),
+                                      points[:, 1].astype(float), 1)
+        self.model = (ref, base + int(round(intercept)), float(drift))
+
+    def to_host(self, remote_ns):
+        """Host clock time (ns) of a remote timestamp"""
+        model = self.model
+        if model is None:
+            return None
+        ref, offset, drift = model
+        remote_ns = int(remote_ns)
+        return remote_ns + offset + int(drift * (remote_ns - ref)) - self.fixed_delay_ns
+
+    def stats(self):
+        model = self.model
+        return {
+            'samples': self.samples,
+            'offset_ns': model[1] if model else 0,
+            'drift_ppm': model[2] * 1e6 if model else 0.0,
+            'resets': self.resets,
+        }
+
+
+class HostClock:
+    """
+    Identity stand-in for ClockOffsetEstimator, for timestamps that are
+    already on the host clock (fused multi-camera frames)
+    """
+
+    fixed_delay_ns = 0
+
+    def update(self, remote_ns, host_ns):
+        return int(remote_ns)
+
+    def to_host(self, remote_ns):
+        return int(remote_ns)
+
+    def stats(self):
+        return {'samples': 0, 'offset_ns': 0, 'drift_ppm': 0.0, 'resets': 0}
+
+
+class EchoClockEstimator:
+    """
+    Host ↔ FPGA clock offset from timestamp echoes
+
+    A datagram leaves the host at t0, reaches the FPGA at its clock t1 and
+    the echo is back at t3. Assuming a symmetric path the offset is
+    t1 - (t0 + t3) / 2 and the one-way delay (t3 - t0) / 2. As in NTP's
+    clock filter, the sample with the smallest round trip among the last
+    `window` echoes is used, since queueing only ever lengthens the trip.
+    """
+
+    def __init__(self, window=64):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        # (offset, one-way delay, round trip) in ns, or None
+        self.model = None
+
+    def update(self, sent_ns, fpga_ns, received_ns):
+        round_trip = received_ns - sent_ns
+        if round_trip < 0:
+            return
+        offset = fpga_ns - (sent_ns + received_ns) // 2
+        self.samples.append((round_trip, offset))
+        self.count += 1
+        best_trip, best_offset = min(self.samples)
+        self.model = (best_offset, best_trip // 2, best_trip)
+
+    def one_way_ns(self, default=0):
+        model = self.model
+        return default if model is None else model[1]
+
+    def to_fpga(self, host_ns):
+        model = self.model
+        return None if model is None else host_ns + model[0]
+
+    def stats(self):
+        model = self.model
+        return {
+            'samples': self.count,
+            'offset_ns': model[0] if model else 0,
+            'one_way_ns': model[1] if model else 0,
+        }
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Local control channel for the running tracker
+Line-delimited JSON over a Unix socket: read and change tracking
+parameters, read statistics, dump the flight recorder and reload the
+sensor calibration without restarting (and re-initializing the camera)
+"""
+
+import os
+import json
+import math
+import socket
+import threading
+import socketserver
+import numpy as np
+
+from flight_recorder import TRIGGER_MANUAL
+
+# Parameters that can be changed while running: (type, minimum, maximum)
+# for numbers, (type, choices) for strings, (bool,) for switches
+PARAMETERS = {
+    'min_temp_celsius': (float, 0.0, 2000.0),
+    'association_metric': (str, ('euclidean', 'mahalanobis')),
+    'association_gate_mm': (float, 0.1, 200.0),
+    'mahalanobis_gate': (float, 0.1, 100.0),
+    'min_track_age': (int, 0, 100),
+    'max_missed_frames': (int, 0, 1000),
+    'process_noise': (float, 1e-9, 1e6),
+    'velocity_noise': (float, 1e-9, 1e6),
+    'measurement_noise': (float, 1e-9, 1e6),
+    'temp_noise': (float, 1e-9, 1e6),
+    'noise_threshold_sigma': (float, 0.0, 20.0),
+    'roi_detection': (bool,),
+    'roi_sweep_interval': (int, 1, 100000),
+    'latency_compensation': (bool,),
+    'fpga_ip': (str, None),
+    'fpga_port': (int, 1, 65535),
+}
+
+NOISE_PARAMETERS = ('process_noise', 'velocity_noise', 'measurement_noise', 'temp_noise')
+
+COMMANDS = ('get', 'set', 'stats', 'record', 'reload_calibration', 'help')
+
+
+def read_parameters(tracker):
+    """Current values of every PARAMETERS entry"""
+    values = {
+        'min_temp_celsius': tracker.min_temp_celsius,
+        'association_metric': tracker.association_metric,
+        'association_gate_mm': tracker.association_gate_mm,
+        'mahalanobis_gate': tracker.mahalanobis_gate,
+        'min_track_age': tracker.min_track_age,
+        'max_missed_frames': tracker.max_missed_frames,
+        'noise_threshold_sigma': tracker.noise_threshold_sigma,
+        'roi_detection': tracker.roi_detection,
+        'roi_sweep_interval': tracker.roi.sweep_interval,
+        'latency_compensation': tracker.latency_compensation,
+        'fpga_ip': tracker.fpga_address[0],
+        'fpga_port': tracker.fpga_address[1],
+    }
+    values.update(tracker.trackers.noise())
+    return values
+
+
+def validate_parameters(changes):
+    """
+    Checked copy of a {name: value} dict; raises ValueError naming the
+    first bad entry, so a request is applied completely or not at all
+    """
+    if not isinstance(changes, dict) or not changes:
+        raise ValueError("'parameters' must be a non-empty object")
+    checked = {}
+    for name, value in changes.items():
+        spec = PARAMETERS.get(name)
+        if spec is None:
+            raise ValueError(f"unknown parameter '{name}'")
+        kind = spec[0]
+        if kind is bool:
+            if not isinstance(value, bool):
+                raise ValueError(f"{name} must be true or false")
+        elif kind is str:
+            if not isinstance(value, str):
+                raise ValueError(f"{name} must be a string")
+            if spec[1] is not None and value not in spec[1]:
+                raise ValueError(f"{name} must be one of {', '.join(spec[1])}")
+        else:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"{name} must be a number")
+            if kind is int:
+                if value != int(value):
+                    raise ValueError(f"{name} must be an integer")
+                value = int(value)
+            elif not math.isfinite(value):
+                raise ValueError(f"{name} must be finite")
+            value = kind(value)
+            low, high = spec[1], spec[2]
+            if not low <= value <= high:
+                raise ValueError(f"{name} must be in [{low:g}, {high:g}]")
+        checked[name] = value
+    if 'fpga_ip' in checked:
+        try:
+            socket.inet_aton(checked['fpga_ip'])
+        except OSError:
+            raise ValueError(f"fpga_ip '{checked['fpga_ip']}' is not an IPv4 address")
+    return checked
+
+
+def apply_parameters(tracker, changes):
+    """Set validated parameters on the tracker (processing thread, between frames)"""
+    for name in ('min_temp_celsius', 'association_metric', 'association_gate_mm',
+                 'mahalanobis_gate', 'min_track_age', 'max_missed_frames',
+                 'noise_threshold_sigma', 'latency_compensation'):
+        if name in changes:
+            setattr(tracker, name, changes[name])
+
+    # Filter noise changes keep every live track
+    if any(name in changes for name in NOISE_PARAMETERS):
+        noise = tracker.trackers.noise()
+        noise.update((name, changes[name]) for name in NOISE_PARAMETERS if name in changes)
+        tracker.trackers.set_noise(**noise)
+
+    if 'roi_sweep_interval' in changes:
+        tracker.roi.sweep_interval = changes['roi_sweep_interval']
+    if changes.get('roi_detection') and not tracker.roi_detection:
+        tracker.roi.since_sweep = tracker.roi.sweep_interval  # Start with a full sweep
+    if 'roi_detection' in changes:
+        tracker.roi_detection = changes['roi_detection']
+
+    # One tuple assignment, so the send thread never sees half an address
+    if 'fpga_ip' in changes or 'fpga_port' in changes:
+        ip, port = tracker.fpga_address
+        tracker.fpga_address = (changes.get('fpga_ip', ip), changes.get('fpga_port', port))
+
+
+def json_value(value):
+    """json.dumps default for numpy scalars and arrays"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class ControlServer:
+    """
+    Unix-socket control channel of a running ThermalDropletTracker
+
+    Each connection sends one JSON object per line, {"command": ...}, and
+    gets one JSON object per line back ({"ok": true, ...} or {"ok": false,
+    "error": ...}). Connections are served on their own threads; nothing
+    here runs on the capture or processing threads.
+
+    'set' validates every parameter of the request before anything
+    changes, then publishes the batch as one pending dict. The processing
+    thread adopts it in apply() at the start of the next frame, so a frame
+    never sees half a change and acquisition is never paused. The reply
+    waits up to apply_timeout for the batch to be adopted.
+    """
+
+    def __init__(self, tracker, path, pipeline=None, apply_timeout=1.0):
+        self.tracker = tracker
+        self.pipeline = pipeline
+        self.path = path
+        self.apply_timeout = apply_timeout
+
+        self.pending = None        # Validated changes waiting for apply()
+        self.published = 0         # Batches published (pending generation)
+        self.applied = 0           # Last generation adopted by apply()
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._adopted = threading.Condition(self._lock)
+        self.server = None
+        self.thread = None
+        self._inode = None
+
+    # Processing thread ---------------------------------------------------
+
+    def apply(self):
+        """Adopt pending parameter changes (call between frames); True if applied"""
+        if self.pending is None:
+            return False
+        with self._lock:
+            changes, self.pending = self.pending, None
+            generation = self.published
+        apply_parameters(self.tracker, changes)
+        with self._lock:
+            self.applied = generation
+            self._adopted.notify_all()
+        return True
+
+    # Server --------------------------------------------------------------
+
+    def start(self):
+        """Listen on the socket path (owner-only) on a background thread"""
+        if self.server is not None:
+            return
+        if os.path.exists(self.path):
+            # Never take over the channel of a tracker that is still running
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(self.path)
+                except OSError:
+                    os.unlink(self.path)  # Stale socket of a previous run
+                else:
+                    raise RuntimeError(f"another tracker is listening on {self.path}")
+        control = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    reply = control.handle_line(line)
+                    self.wfile.write(json.dumps(reply, default=json_value).encode() + b"\n")
+
+        self.server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self.server.daemon_threads = True
+        os.chmod(self.path, 0o600)
+        self._inode = os.stat(self.path).st_ino
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='thermal-control', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.thread = None
+            # Leave the path alone if it no longer is this server's socket
+            try:
+                if os.stat(self.path).st_ino == self._inode:
+                    os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def handle_line(self, line):
+        """Reply dict for one request line"""
+        self.requests += 1
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+            reply = self.handle(request)
+            reply['ok'] = True
+        except (ValueError, RuntimeError) as e:
+            self.errors += 1
+            reply = {'ok': False, 'error': str(e)}
+        except Exception as e:
+            # E.g. stats() reading arrays the processing thread is resizing;
+            # the client gets an error instead of a dropped connection
+            self.errors += 1
+            reply = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        return reply
+
+    def handle(self, request):
+        command = request.get('command')
+        if command == 'get':
+            return {'parameters': read_parameters(self.tracker)}
+        if command == 'set':
+            return self.set(request.get('parameters'))
+        if command == 'stats':
+            return self.stats()
+        if command == 'record':
+            return self.record()
+        if command == 'reload_calibration':
+            return self.reload_calibration()
+        if command == 'help':
+            return {
+                'commands': list(COMMANDS),
+                'parameters': {name: [spec[0].__name__] + list(spec[1:])
+                               for name, spec in PARAMETERS.items()},
+            }
+        raise ValueError(f"unknown command {command!r} (one of {', '.join(COMMANDS)})")
+
+    # Commands ------------------------------------------------------------
+
+    def set(self, changes):
+        """Validate and publish changes, then wait for the next frame to adopt them"""
+        changes = validate_parameters(changes)
+        with self._lock:
+            if self.pending is not None:
+                changes = dict(self.pending, **changes)  # Not adopted yet: merge
+            self.pending = changes
+            self.published += 1
+            generation = self.published
+            applied = self._adopted.wait_for(lambda: self.applied >= generation,
+                                             self.apply_timeout)
+        reply = {'applied': applied, 'parameters': read_parameters(self.tracker)}
+        if not applied:
+            reply['note'] = "no frame processed yet; changes apply at the next frame"
+        return reply
+
+    def stats(self):
+        tracker = self.tracker
+        reply = {
+            'tracks': len(tracker.trackers),
+            'confirmed': int(tracker.trackers.confirmed(tracker.min_track_age).sum()),
+            'pixel_to_mm': tracker.pixel_to_mm,
+            'sensor_calibration': tracker.sensor.describe() if tracker.sensor else None,
+            'material': tracker.material,
+            'control': {'requests': self.requests, 'errors': self.errors,
+                        'published': self.published, 'applied': self.applied},
+        }
+        times = list(tracker.frame_times)
+        if len(times) > 1 and times[-1] > times[0]:
+            reply['fps'] = (len(times) - 1) / (times[-1] - times[0])
+        if self.pipeline is not None:
+            reply['pipeline'] = self.pipeline.stats()
+            reply['shedding'] = self.pipeline.scheduler.shedding()
+            reply['latency_ms'] = {
+                stage: {key: s[key] / 1e6 for key in ('p50', 'p99', 'max')}
+                for stage, s in self.pipeline.latency.summary().items() if s['count']
+            }
+        if tracker.roi_detection:
+            reply['roi'] = tracker.roi.stats()
+        if tracker.calibrator is not None:
+            reply['self_calibration'] = tracker.calibrator.stats()
+        if tracker.calibration_store is not None:
+            store = tracker.calibration_store
+            reply['calibration_store'] = {'loaded': store.loaded, 'reloads': store.reloads,
+                                          'errors': store.errors}
+        if tracker.recorder is not None:
+            reply['recordings'] = list(tracker.recorder.dumps)
+        return reply
+
+    def record(self):
+        """Dump the flight recorder (written by its own thread)"""
+        recorder = self.tracker.recorder
+        if recorder is None:
+            raise RuntimeError("flight recorder is disabled (--record-seconds 0)")
+        return {'triggered': recorder.trigger(TRIGGER_MANUAL),
+                'recordings': list(recorder.dumps)}
+
+    def reload_calibration(self):
+        """Load the published sensor calibration now; adopted at the next frame"""
+        store = self.tracker.calibration_store
+        if store is None:
+            raise RuntimeError("no sensor calibration store")
+        calibration = store.reload()
+        return {'loaded': store.loaded, 'changed': calibration is not None,
+                'errors': store.errors}
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Black-box flight recorder for the tracking loop
+Keeps the last few seconds of raw Mono14 frames and track tables in an
+in-memory ring, packed to 14 bits and delta-coded against the previous
+frame, and dumps them to an indexed file when something goes wrong
+(SIGUSR1, a burst of lost tracks or a burst of incomplete images)
+"""
+
+import os
+import threading
+import time
+import zlib
+from collections import deque
+import numpy as np
+
+from kalman_filter_bank import TRACK_DTYPE
+from frame_sources import save_recording
+
+# Trigger reasons
+TRIGGER_SIGNAL = 'signal'
+TRIGGER_TRACK_LOSS = 'track_loss'
+TRIGGER_INCOMPLETE = 'incomplete'
+TRIGGER_MANUAL = 'manual'
+
+PIXEL_MASK = 0x3FFF  # Mono14
+
+FILE_MAGIC = b'DRIPREC1'
+FILE_VERSION = 1
+
+# File header (little-endian, 64 bytes)
+FILE_HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('height', '<u4'),
+    ('width', '<u4'),
+    ('frame_count', '<u4'),
+    ('index_offset', '<u8'),
+    ('tracks_offset', '<u8'),
+    ('trigger_ns', '<u8'),       # time.time_ns() of the trigger
+    ('trigger', 'S16'),
+])
+
+# Per-frame index entry; frames are stored as zlib streams of the packed
+# delta, so a frame is decoded from the nearest keyframe at or before it
+INDEX_DTYPE = np.dtype([
+    ('frame_id', '<i8'),
+    ('camera_timestamp', '<u8'),
+    ('host_ns', '<i8'),          # perf_counter_ns() when recorded
+    ('offset', '<u8'),           # File offset of the compressed frame
+    ('size', '<u4'),
+    ('track_start', '<u4'),      # First row in the track table
+    ('track_count', '<u2'),
+    ('detection_count', '<u2'),
+    ('keyframe', 'u1'),
+])
+
+# Ring bookkeeping for one recorded frame
+_RING_META_DTYPE = np.dtype([
+    ('number', '<i8'),           # Frames recorded before this one (-1 = empty)
+    ('frame_id', '<i8'),
+    ('camera_timestamp', '<u8'),
+    ('host_ns', '<i8'),
+    ('track_count', '<u2'),
+    ('detection_count', '<u2'),
+    ('keyframe', 'u1'),
+])
+
+
+def packed_size(num_pixels):
+    """Bytes per frame at 14 bits per pixel (pixel count padded to 4)"""
+    return (num_pixels + 3) // 4 * 7
+
+
+class FramePacker:
+    """
+    Packs Mono14 frames to 14 bits per pixel, delta-coded against the
+    previous frame (modulo 2**14, so every delta fits). Layout of a packed
+    frame: the low bytes of all pixels, then the 6 high bits of every four
+    pixels as three byte planes. Only contiguous numpy operations on
+    preallocated buffers, so packing a frame allocates nothing.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.pixels = int(np.prod(self.shape))
+        self.padded = (self.pixels + 3) // 4 * 4
+        self.size = packed_size(self.pixels)
+        quarter = self.padded // 4
+
+        self._delta = np.zeros(self.padded, dtype=np.uint16)
+        self._high = np.zeros(self.padded, dtype=np.uint8)
+        self._acc = np.zeros(quarter, dtype=np.uint32)
+        self._tmp = np.zeros(quarter, dtype=np.uint32)
+        self._prev = np.zeros(self.pixels, dtype=np.uint16)
+
+    def pack(self, frame, out, keyframe=False):
+        """Pack frame into out (uint8, self.size); keyframes are not delta-coded"""
+        flat = frame.reshape(-1)
+        delta = self._delta
+        if keyframe:
+            delta[:self.pixels] = flat
+        else:
+            np.subtract(flat, self._prev, out=delta[:self.pixels])
+        np.copyto(self._prev, flat)
+
+        n = self.padded
+        quarter = n // 4
+        np.copyto(out[:n], delta, casting='unsafe')  # Low bytes
+        np.right_shift(delta, 8, out=self._high, casting='unsafe')
+
+        # Four 6-bit high parts per uint32 → 24 bits
+        x = self._high.view(np.uint32)
+        acc, tmp = self._acc, self._tmp
+        np.bitwise_and(x, 0x3F, out=acc)
+        for k in (1, 2, 3):
+            np.right_shift(x, 2 * k, out=tmp)
+            np.bitwise_and(tmp, 0x3F << (6 * k), out=tmp)
+            np.bitwise_or(acc, tmp, out=acc)
+        for k in range(3):
+            plane = out[n + k * quarter:n + (k + 1) * quarter]
+            if k:
+                np.right_shift(acc, 8 * k, out=tmp)
+                np.copyto(plane, tmp, casting='unsafe')
+            else:
+                np.copyto(plane, acc, casting='unsafe')
+
+    def reset(self):
+        self._prev[:] = 0
+
+
+def unpack_frame(packed, shape, prev=None):
+    """Inverse of FramePacker.pack; prev is the previous decoded frame (None for keyframes)"""
+    pixels = int(np.prod(shape))
+    n = (pixels + 3) // 4 * 4
+    quarter = n // 4
+    packed = np.frombuffer(packed, dtype=np.uint8)
+    acc = (packed[n:n + quarter].astype(np.uint32)
+           | (packed[n + quarter:n + 2 * quarter].astype(np.uint32) << 8)
+           | (packed[n + 2 * quarter:n + 3 * quarter].astype(np.uint32) << 16))
+    high = np.empty((quarter, 4), dtype=np.uint16)
+    for k in range(4):
+        high[:, k] = (acc >> (6 * k)) & 0x3F
+    values = (high.reshape(-1) << 8) | packed[:n]
+    values = values[:pixels]
+    if prev is not None:
+        values = (values + prev.reshape(-1)) & PIXEL_MASK
+    return values.reshape(shape).astype(np.uint16)
+
+
+class FlightRecorder:
+    """
+    Always-on ring of the last `seconds` of frames and track tables
+
+    record() runs on the processing thread and costs one pack of the frame
+    plus a copy of the track table into preallocated ring slots. trigger()
+    may be called from any thread or a signal handler; a dump thread then
+    copies the ring, compresses the frames and writes an indexed file
+    (read it with FlightRecording). Every keyframe_interval-th frame is a
+    keyframe so a dump can start mid-ring.
+
+    A track only counts as lost if it vanished inside the field of view:
+    its last position and one-step prediction, mapped to pixels with
+    to_pixel (e.g. tracker.mm_to_pixel), are more than edge_margin pixels
+    inside the image. Droplets leaving the frame are not losses.
+    """
+
+    def __init__(self, shape, seconds=10.0, frame_rate=60.0, max_tracks=64,
+                 keyframe_interval=30, output_dir='recordings',
+                 loss_burst=3, loss_window=30, loss_min_age=5,
+                 incomplete_burst=5, incomplete_window=1.0, cooldown=None,
+                 to_pixel=None, edge_margin=8.0):
+        self.shape = tuple(shape)
+        self.capacity = max(int(seconds * frame_rate), keyframe_interval + 1)
+        self.max_tracks = max_tracks
+        self.keyframe_interval = keyframe_interval
+        self.output_dir = output_dir
+
+        # Trigger thresholds
+        self.loss_burst = loss_burst            # Lost tracks ...
+        self.loss_window = loss_window          # ... within this many frames
+        self.loss_min_age = loss_min_age        # Ignore tracks younger than this
+        self.to_pixel = to_pixel                # mm → pixels (None: positions are pixels)
+        self.edge_margin = edge_margin          # Losses this close to the border are exits
+        self.frame_period = 1.0 / frame_rate
+        self.incomplete_burst = incomplete_burst    # Incomplete images ...
+        self.incomplete_window = incomplete_window  # ... within this many seconds
+        self.cooldown = seconds if cooldown is None else cooldown
+
+        self.packer = FramePacker(self.shape)
+        self.frames = np.zeros((self.capacity, self.packer.size), dtype=np.uint8)
+        self.tracks = np.zeros((self.capacity, max_tracks), dtype=TRACK_DTYPE)
+        self.meta = np.zeros(self.capacity, dtype=_RING_META_DTYPE)
+        self.meta['number'] = -1
+        self.recorded = 0
+
+        # Track-loss detection (processing thread)
+        self._prev = np.zeros(0, dtype=TRACK_DTYPE)
+        self._losses = deque()
+        # Incomplete-image detection (capture thread)
+        self._incomplete = deque(maxlen=max(1, incomplete_burst))
+
+        self._request = None
+        self._last_trigger = None
+        self._wake = threading.Event()
+        self._stop = False
+        self.dumps = []  # Paths written
+        self.dump_thread = threading.Thread(target=self._dump_loop,
+                                            name='flight-recorder', daemon=True)
+        self.dump_thread.start()
+
+    # Recording (processing thread) -----------------------------------------
+
+    def record(self, frame, snapshot, frame_id, camera_timestamp=0, detection_count=0):
+        """Add one frame and its track table to the ring"""
+        number = self.recorded
+        slot = number % self.capacity
+        keyframe = number % self.keyframe_interval == 0
+
+        meta = self.meta[slot:slot + 1]
+        meta['number'] = -1  # Slot invalid while being overwritten
+        self.packer.pack(frame, self.frames[slot], keyframe)
+        records = snapshot.records[:self.max_tracks]
+        self.tracks[slot, :len(records)] = records
+        meta['frame_id'] = frame_id
+        meta['camera_timestamp'] = camera_timestamp
+        meta['host_ns'] = time.perf_counter_ns()
+        meta['track_count'] = len(records)
+        meta['detection_count'] = detection_count
+        meta['keyframe'] = keyframe
+        meta['number'] = number
+        self.recorded = number + 1
+
+        self._check_track_loss(snapshot.records, number)
+
+    def _check_track_loss(self, records, number):
+        prev = self._prev
+        gone = prev[(prev['age'] >= self.loss_min_age)
+                    & ~np.isin(prev['id'], records['id'])]
+        if len(gone):
+            lost = int(np.count_nonzero(self.in_view(gone)))
+            self._losses.extend([number] * lost)
+        while self._losses and number - self._losses[0] >= self.loss_window:
+            self._losses.popleft()
+        if len(self._losses) >= self.loss_burst:
+            self._losses.clear()
+            self.trigger(TRIGGER_TRACK_LOSS)
+        self._prev = records.copy()
+
+    def in_view(self, records):
+        """Tracks whose position and one-step prediction are well inside the image"""
+        xy = np.column_stack([records['x'], records['y']])
+        step = np.column_stack([records['vx'], records['vy']]) * self.frame_period
+        inside = np.ones(len(records), dtype=bool)
+        height, width = self.shape
+        m = self.edge_margin
+        for point in (xy, xy + step):
+            px = self.to_pixel(point) if self.to_pixel is not None else point
+            inside &= ((px[:, 0] >= m) & (px[:, 0] < width - m)
+                       & (px[:, 1] >= m) & (px[:, 1] < height - m))
+        return inside
+
+    def note_incomplete(self):
+        """Count an incomplete image (capture thread)"""
+        now = time.monotonic()
+        self._incomplete.append(now)
+        if (len(self._incomplete) == self._incomplete.maxlen
+                and now - self._incomplete[0] <= self.incomplete_window):
+            self._incomplete.clear()
+            self.trigger(TRIGGER_INCOMPLETE)
+
+    # Dumping ------------------------------------------------------------
+
+    def trigger(self, reason=TRIGGER_MANUAL):
+        """Request a dump of the ring; returns False while cooling down"""
+        now = time.monotonic()
+        if (self._request is not None
+                or (self._last_trigger is not None
+                    and now - self._last_trigger < self.cooldown)):
+            return False
+        self._last_trigger = now
+        self._request = (reason, time.time_ns(), self.recorded)
+        self._wake.set()
+        return True
+
+    def close(self):
+        self._stop = True
+        self._wake.set()
+        self.dump_thread.join()
+
+    def _dump_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._request is not None:
+                reason, trigger_ns, end = self._request
+                try:
+                    path = self.dump(reason, trigger_ns, end)
+                    if path:
+                        print(f"\nFlight recorder: {reason} → {path}")
+                except Exception as e:
+                    print(f"\nFlight recorder dump failed: {e}")
+                self._request = None
+            if self._stop:
+                return
+
+    def dump(self, reason=TRIGGER_MANUAL, trigger_ns=None, end=None):
+        """Copy the ring up to frame number `end` and write it to a file"""
+        if end is None:
+            end = self.recorded
+        start = max(0, end - self.capacity)
+        numbers = np.arange(start, end)
+        slots = numbers % self.capacity
+
+        # Copy first, compress later: the writer keeps overwriting the
+        # oldest slots while we work
+        frames = self.frames[slots]
+        tracks = self.tracks[slots]
+        meta = self.meta[slots]
+        valid = meta['number'] == numbers
+        valid &= self.meta['number'][slots] == numbers  # Not overwritten during the copy
+
+        # Start at the first keyframe after the last invalid frame
+        invalid = np.flatnonzero(~valid)
+        first = invalid[-1] + 1 if len(invalid) else 0
+        keyframes = np.flatnonzero(meta['keyframe'][first:]) + first
+        if len(keyframes) == 0:
+            return None
+        first = keyframes[0]
+        frames, tracks, meta = frames[first:], tracks[first:], meta[first:]
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.output_dir, f"flight_{stamp}_{reason}.drec")
+        write_recording(path, self.shape, frames, tracks, meta, reason,
+                        trigger_ns or time.time_ns())
+        self.dumps.append(path)
+        return path
+
+    def stats(self):
+        return {
+            'recorded': self.recorded,
+            'capacity': self.capacity,
+            'ring_bytes': self.frames.nbytes + self.tracks.nbytes + self.meta.nbytes,
+            'dumps': len(self.dumps),
+        }
+
+
+def write_recording(path, shape, frames, tracks, meta, reason, trigger_ns):
+    """Write packed frames, track tables and their index to path"""
+    count = len(frames)
+    index = np.zeros(count, dtype=INDEX_DTYPE)
+    index['frame_id'] = meta['frame_id']
+    index['camera_timestamp'] = meta['camera_timestamp']
+    index['host_ns'] = meta['host_ns']
+    index['track_count'] = meta['track_count']
+    index['detection_count'] = meta['detection_count']
+    index['keyframe'] = meta['keyframe']
+    index['track_start'][1:] = np.cumsum(meta['track_count'])[:-1]
+    track_table = np.concatenate(
+        [tracks[i, :meta['track_count'][i]] for i in range(count)]
+    ) if count else np.zeros(0, dtype=TRACK_DTYPE)
+
+    header = np.zeros(1, dtype=FILE_HEADER_DTYPE)
+    header['magic'] = FILE_MAGIC
+    header['version'] = FILE_VERSION
+    header['height'], header['width'] = shape
+    header['frame_count'] = count
+    header['trigger_ns'] = trigger_ns
+    header['trigger'] = reason.encode()[:16]
+
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(header.tobytes())
+        offset = FILE_HEADER_DTYPE.itemsize
+        for i in range(count):
+            data = zlib.compress(frames[i], 1)
+            index['offset'][i] = offset
+            index['size'][i] = len(data)
+            f.write(data)
+            offset += len(data)
+        header['tracks_offset'] = offset
+        f.write(track_table.tobytes())
+        header['index_offset'] = offset + track_table.nbytes
+        f.write(index.tobytes())
+        f.seek(0)
+        f.write(header.tobytes())
+    os.replace(tmp, path)
+
+
+class FlightRecording:
+    """
+    Random-access reader for flight recorder files
+
+    The file is memory-mapped; the index and track table are zero-copy
+    views. recording[i] decodes frame i from the nearest keyframe, and
+    sequential access reuses the previous frame, so stepping through a
+    recording decodes each frame once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        header = self.data[:FILE_HEADER_DTYPE.itemsize].view(FILE_HEADER_DTYPE)[0]
+        if header['magic'] != FILE_MAGIC:
+            raise ValueError(f"{path}: not a flight recording")
+        if header['version'] != FILE_VERSION:
+            raise ValueError(f"{path}: unsupported version {int(header['version'])}")
+        self.shape = (int(header['height']), int(header['width']))
+        self.trigger = header['trigger'].decode()
+        self.trigger_ns = int(header['trigger_ns'])
+        count = int(header['frame_count'])
+        index_offset = int(header['index_offset'])
+        tracks_offset = int(header['tracks_offset'])
+
+        self.index = self.data[index_offset:index_offset + count * INDEX_DTYPE.itemsize] \
+            .view(INDEX_DTYPE)
+        self.track_table = self.data[tracks_offset:index_offset].view(TRACK_DTYPE)
+        # Keyframe each frame is decoded from
+        keyframe_pos = np.where(self.index['keyframe'] == 1, np.arange(count), 0)
+        self._keyframe_of = np.maximum.accumulate(keyframe_pos) if count else keyframe_pos
+        self._cached = (None, None)  # (position, frame)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def frame_ids(self):
+        return self.index['frame_id']
+
+    @property
+    def timestamps(self):
+        return self.index['camera_timestamp']
+
+    def _packed(self, i):
+        entry = self.index[i]
+        start = int(entry['offset'])
+        return zlib.decompress(self.data[start:start + int(entry['size'])])
+
+    def frame(self, i):
+        """Decoded Mono14 frame at position i"""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        cached_pos, cached = self._cached
+        if cached_pos is not None and cached_pos < i and self._keyframe_of[i] <= cached_pos:
+            start, frame = cached_pos + 1, cached
+        else:
+            start, frame = int(self._keyframe_of[i]), None
+        for k in range(start, i + 1):
+            frame = unpack_frame(self._packed(k), self.shape,
+                                 None if self.index['keyframe'][k] else frame)
+        self._cached = (i, frame)
+        return frame
+
+    __getitem__ = frame
+
+    def tracks(self, i):
+        """TRACK_DTYPE records of the track table at position i"""
+        entry = self.index[i]
+        start = int(entry['track_start'])
+        return self.track_table[start:start + int(entry['track_count'])]
+
+    def export(self, path):
+        """Write the frames as a replay recording (see frame_sources.save_recording)"""
+        frames = np.empty((len(self),) + self.shape, dtype=np.uint16)
+        for i in range(len(self)):
+            frames[i] = self.frame(i)
+        return save_recording(path, frames, self.timestamps.astype(np.int64))
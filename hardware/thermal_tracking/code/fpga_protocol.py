@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Framed UDP protocol for droplet states sent to the FPGA
+One datagram per camera frame: a header carrying sequence number, camera
+timestamp, track count and CRC, followed by a packed array of track
+records with the same 28-byte layout as the legacy per-track packet
+"""
+
+import zlib
+import numpy as np
+
+from kalman_filter_bank import KalmanFilterBank, TrackSnapshot
+
+# Packet formats selectable with ThermalDropletTracker.fpga_protocol
+PROTOCOL_LEGACY = 'legacy'  # One '<Iffffff' datagram per track
+PROTOCOL_FRAMED = 'framed'  # One datagram per frame (FramedPacketBuilder)
+PROTOCOLS = (PROTOCOL_LEGACY, PROTOCOL_FRAMED)
+
+FRAME_MAGIC = 0x50495244  # b'DRIP' little-endian
+PROTOCOL_VERSION = 1
+
+# Datagram header (little-endian, packed, 24 bytes)
+HEADER_DTYPE = np.dtype([
+    ('magic', '<u4'),
+    ('version', '<u2'),
+    ('track_count', '<u2'),
+    ('sequence', '<u4'),
+    ('camera_timestamp', '<u8'),  # Camera clock (ns)
+    ('crc32', '<u4'),             # CRC-32 of every other byte in the datagram
+])
+
+# Track record, identical to the legacy packet and DropletData in
+# fpga_thermal_interface.h (28 bytes)
+TRACK_RECORD_DTYPE = np.dtype([
+    ('track_id', '<u4'),
+    ('x', '<f4'),     # mm
+    ('y', '<f4'),     # mm
+    ('z', '<f4'),     # mm, from acoustic model
+    ('temp', '<f4'),  # °C
+    ('vx', '<f4'),    # mm/s
+    ('vy', '<f4'),    # mm/s
+])
+
+HEADER_SIZE = HEADER_DTYPE.itemsize
+RECORD_SIZE = TRACK_RECORD_DTYPE.itemsize
+_CRC_OFFSET = HEADER_DTYPE.fields['crc32'][1]
+
+# Timestamp echo returned by the FPGA stand-in (fpga_standin.py) for each
+# framed datagram, so the tracker can measure round-trip latency
+ECHO_MAGIC = 0x4F484345  # b'ECHO' little-endian
+ECHO_DTYPE = np.dtype([
+    ('magic', '<u4'),
+    ('sequence', '<u4'),          # Sequence of the echoed datagram
+    ('camera_timestamp', '<u8'),  # Copied from the echoed datagram
+    ('receive_ns', '<u8'),        # Stand-in clock at reception (ns)
+])
+ECHO_SIZE = ECHO_DTYPE.itemsize
+
+# Largest UDP payload over IPv4
+MAX_DATAGRAM = 65507
+MAX_TRACKS = (MAX_DATAGRAM - HEADER_SIZE) // RECORD_SIZE
+
+
+def packet_crc(packet):
+    """CRC-32 (zlib/IEEE 802.3) over a datagram, skipping the crc32 field"""
+    view = memoryview(packet)
+    crc = zlib.crc32(view[:_CRC_OFFSET])
+    return zlib.crc32(view[_CRC_OFFSET + 4:], crc)
+
+
+def track_columns(tracks):
+    """(ids, x, y, vx, vy, temp) arrays for a filter bank, snapshot or track mapping"""
+    if isinstance(tracks, KalmanFilterBank):
+        n = len(tracks)
+        state = tracks.state[:n]
+        return (tracks.track_ids(), state[:, 0], state[:, 1],
+                state[:, 2], state[:, 3], state[:, 4])
+    if isinstance(tracks, TrackSnapshot):
+        r = tracks.records
+        return r['id'], r['x'], r['y'], r['vx'], r['vy'], r['temp']
+    ids = list(tracks.keys())
+    states = [tracks[tid].get_state() for tid in ids]
+    return (np.array(ids, dtype=np.int64),
+            *(np.array([s[k] for s in states], dtype=float)
+              for k in ('x', 'y', 'vx', 'vy', 'temp')))
+
+
+def track_z(tracks):
+    """Z (mm) of every track: fused 3D tracks carry it, 2D tracks send 0"""
+    if isinstance(tracks, TrackSnapshot) and 'z' in tracks.records.dtype.names:
+        return tracks.records['z']
+    return 0.0  # Z from acoustic model
+
+
+class FramedPacketBuilder:
+    """
+    Builds framed datagrams in one preallocated buffer
+    The header and record arrays are structured views on the buffer, so a
+    datagram is filled in place and handed to the socket without copying.
+    Not thread-safe: use one builder per sending thread.
+    """
+
+    def __init__(self, max_tracks=16):
+        self._allocate(max_tracks)
+
+    def _allocate(self, max_tracks):
+        self.max_tracks = max_tracks
+        self.buffer = np.zeros(HEADER_SIZE + max_tracks * RECORD_SIZE, dtype=np.uint8)
+        self.header = self.buffer[:HEADER_SIZE].view(HEADER_DTYPE)[0]
+        self.records = self.buffer[HEADER_SIZE:].view(TRACK_RECORD_DTYPE)
+        self.header['magic'] = FRAME_MAGIC
+        self.header['version'] = PROTOCOL_VERSION
+
+    def build(self, tracks, sequence, camera_timestamp=0):
+        """Fill the datagram for one frame; returns a memoryview of it"""
+        ids, x, y, vx, vy, temp = track_columns(tracks)
+        n = len(ids)
+        if n > MAX_TRACKS:
+            raise ValueError(f"{n} tracks do not fit one datagram (max {MAX_TRACKS})")
+        if n > self.max_tracks:
+            self._allocate(min(max(n, 2 * self.max_tracks), MAX_TRACKS))
+
+        records = self.records[:n]
+        records['track_id'] = ids
+        records['x'] = x
+        records['y'] = y
+        records['z'] = track_z(tracks)
+        records['temp'] = temp
+        records['vx'] = vx
+        records['vy'] = vy
+
+        header = self.header
+        header['track_count'] = n
+        header['sequence'] = sequence & 0xFFFFFFFF
+        header['camera_timestamp'] = camera_timestamp
+        packet = memoryview(self.buffer)[:HEADER_SIZE + n * RECORD_SIZE]
+        header['crc32'] = packet_crc(packet)
+        return packet
+
+
+def parse_framed_packet(data):
+    """
+    Decode and validate one framed datagram
+    Returns (header, records) as numpy structured values; raises
+    ValueError for a malformed or corrupted packet
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"Packet too short ({len(data)} bytes)")
+    header = np.frombuffer(data, dtype=HEADER_DTYPE, count=1)[0]
+    if header['magic'] != FRAME_MAGIC:
+        raise ValueError(f"Bad magic 0x{int(header['magic']):08x}")
+    if header['version'] != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {int(header['version'])}")
+    count = int(header['track_count'])
+    if len(data) != HEADER_SIZE + count * RECORD_SIZE:
+        raise ValueError(f"Length {len(data)} does not match {count} tracks")
+    if packet_crc(data) != header['crc32']:
+        raise ValueError("CRC mismatch")
+    records = np.frombuffer(data, dtype=TRACK_RECORD_DTYPE, count=count,
+                            offset=HEADER_SIZE)
+    return header, records
+
+
+def parse_legacy_packet(data):
+    """Decode one legacy per-track datagram into a TRACK_RECORD_DTYPE record"""
+    if len(data) != RECORD_SIZE:
+        raise ValueError(f"Legacy packet must be {RECORD_SIZE} bytes, got {len(data)}")
+    return np.frombuffer(data, dtype=TRACK_RECORD_DTYPE, count=1)[0]
+
+
+def parse_echo_packet(data):
+    """Decode a timestamp echo; raises ValueError if data is not one"""
+    if len(data) != ECHO_SIZE:
+        raise ValueError(f"Echo must be {ECHO_SIZE} bytes, got {len(data)}")
+    echo = np.frombuffer(data, dtype=ECHO_DTYPE, count=1)[0]
+    if echo['magic'] != ECHO_MAGIC:
+        raise ValueError(f"Bad echo magic 0x{int(echo['magic']):08x}")
+    return echo
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Software stand-in for the FPGA end of the tracker link
+Binds the FPGA UDP port, decodes legacy and framed track packets and
+measures what the transmit path delivers: inter-arrival jitter, loss,
+reordering and duplicates. Framed datagrams can be echoed back with a
+receive timestamp so the tracker measures round-trip latency.
+"""
+
+import socket
+import threading
+import time
+import numpy as np
+
+from fpga_protocol import (FRAME_MAGIC, HEADER_SIZE, MAX_DATAGRAM, ECHO_MAGIC,
+                           ECHO_DTYPE, parse_framed_packet, parse_legacy_packet)
+from latency_metrics import LatencyHistogram
+
+# Sequence numbers remembered for duplicate / reorder detection
+SEQUENCE_WINDOW = 1024
+
+
+class FpgaStandIn:
+    """
+    UDP receiver with the FPGA's view of the tracker stream
+
+    Loss and reordering come from the framed sequence numbers; jitter is
+    the RFC 3550 interarrival jitter of arrival times against the camera
+    timestamps carried in each datagram, so camera frame-rate wobble is
+    not counted against the link. A datagram delayed by more than
+    budget_ms relative to that cadence is counted as late.
+    Only the receive thread writes the statistics.
+    """
+
+    def __init__(self, host='0.0.0.0', port=5000, echo=False, budget_ms=3.0):
+        self.address = (host, port)
+        self.echo = echo
+        self.budget_ns = int(budget_ms * 1e6)
+
+        self.sock = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+        self._buffer = bytearray(MAX_DATAGRAM)
+        self._echo = np.zeros(1, dtype=ECHO_DTYPE)
+        self._echo['magic'] = ECHO_MAGIC
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.packets = 0
+        self.framed = 0
+        self.legacy = 0
+        self.bad = 0
+        self.tracks = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.late = 0
+        self.echoes = 0
+        self.jitter_ns = 0.0  # Smoothed RFC 3550 jitter
+        self.interarrival = LatencyHistogram()
+        self.transit_delta = LatencyHistogram()  # |D| per in-order datagram
+        self.last_tracks = None  # TRACK_RECORD_DTYPE records of the newest frame
+        self.started = time.perf_counter_ns()
+
+        self._highest = None  # Highest sequence seen
+        self._seen = np.zeros(SEQUENCE_WINDOW, dtype=bool)
+        self._last_arrival = None
+        self._last_timestamp = None
+
+    # Socket --------------------------------------------------------------
+
+    def open(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind(self.address)
+        self.sock.settimeout(0.2)
+        self.address = self.sock.getsockname()
+        return self.address
+
+    def start(self):
+        """Receive on a background thread"""
+        if self.sock is None:
+            self.open()
+        self.thread = threading.Thread(target=self.run, name='fpga-standin',
+                                       daemon=True)
+        self.thread.start()
+        return self.address
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def run(self):
+        """Receive until stop() (blocking)"""
+        if self.sock is None:
+            self.open()
+        buffer = memoryview(self._buffer)
+        while not self.stop_event.is_set():
+            try:
+                size, sender = self.sock.recvfrom_into(self._buffer)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.handle(buffer[:size], time.perf_counter_ns(), sender)
+
+    # Decoding ------------------------------------------------------------
+
+    def handle(self, data, arrival_ns, sender=None):
+        """Account for one datagram received at arrival_ns"""
+        self.packets += 1
+        try:
+            if len(data) >= HEADER_SIZE and int.from_bytes(data[:4], 'little') == FRAME_MAGIC:
+                header, records = parse_framed_packet(data)
+            else:
+                self.last_tracks = np.array([parse_legacy_packet(data)])
+                self.legacy += 1
+                self.tracks += 1
+                return
+        except ValueError:
+            self.bad += 1
+            return
+
+        self.framed += 1
+        self.tracks += len(records)
+        self.last_tracks = records.copy()
+        sequence = int(header['sequence'])
+        timestamp = int(header['camera_timestamp'])
+
+        if self._track_sequence(sequence):
+            self._track_timing(arrival_ns, timestamp)
+
+        if self.echo and sender is not None:
+            echo = self._echo[0]
+            echo['sequence'] = sequence
+            echo['camera_timestamp'] = timestamp
+            echo['receive_ns'] = arrival_ns
+            self.sock.sendto(self._echo, sender)
+            self.echoes += 1
+
+    def _track_sequence(self, sequence):
+        """Update loss/reorder counts; True if the datagram is the newest yet"""
+        W = SEQUENCE_WINDOW
+        if self._highest is None:
+            self._highest = sequence
+            self._seen[sequence % W] = True
+            return True
+
+        ahead = (sequence - self._highest) & 0xFFFFFFFF
+        if 0 < ahead < 0x80000000:
+            self.lost += ahead - 1
+            # Forget the slots the window slides over
+            if ahead >= W:
+                self._seen[:] = False
+            else:
+                start = (self._highest + 1) % W
+                end = start + ahead
+                self._seen[start:min(end, W)] = False
+                if end > W:
+                    self._seen[:end - W] = False
+            self._seen[sequence % W] = True
+            self._highest = sequence
+            return True
+
+        behind = (self._highest - sequence) & 0xFFFFFFFF
+        if behind < W and self._seen[sequence % W]:
+            self.duplicates += 1
+        else:
+            # A late datagram fills a gap already counted as lost
+            self.reordered += 1
+            if behind < W:
+                self._seen[sequence % W] = True
+                self.lost = max(self.lost - 1, 0)
+        return False
+
+    def _track_timing(self, arrival_ns, timestamp):
+        if self._last_arrival is not None:
+            gap = arrival_ns - self._last_arrival
+            self.interarrival.record(gap)
+            # Transit-time difference between consecutive datagrams
+            delta = gap - (timestamp - self._last_timestamp)
+            self.transit_delta.record(abs(delta))
+            self.jitter_ns += (abs(delta) - self.jitter_ns) / 16.0
+            if delta > self.budget_ns:
+                self.late += 1
+        self._last_arrival = arrival_ns
+        self._last_timestamp = timestamp
+
+    # Reporting -----------------------------------------------------------
+
+    def stats(self):
+        expected = self.framed - self.duplicates + self.lost
+        return {
+            'elapsed': (time.perf_counter_ns() - self.started) / 1e9,
+            'packets': self.packets,
+            'framed': self.framed,
+            'legacy': self.legacy,
+            'bad': self.bad,
+            'tracks': self.tracks,
+            'lost': self.lost,
+            'loss_rate': self.lost / expected if expected else 0.0,
+            'reordered': self.reordered,
+            'duplicates': self.duplicates,
+            'late': self.late,
+            'echoes': self.echoes,
+            'jitter_ms': self.jitter_ns / 1e6,
+            'interarrival': self.interarrival.summary(),
+            'transit_delta': self.transit_delta.summary(),
+        }
+
+
+def format_stats(stats):
+    """One-line summary of FpgaStandIn.stats()"""
+    gap = stats['interarrival']
+    delta = stats['transit_delta']
+    return (f"{stats['elapsed']:8.0f}s | {stats['framed']} framed, {stats['legacy']} legacy, "
+            f"{stats['bad']} bad | lost {stats['lost']} ({stats['loss_rate'] * 100:.3f}%), "
+            f"reordered {stats['reordered']}, dup {stats['duplicates']} | "
+            f"gap p50/p99/max {gap['p50'] / 1e6:.2f}/{gap['p99'] / 1e6:.2f}/{gap['max'] / 1e6:.2f} ms | "
+            f"jitter {stats['jitter_ms']:.3f} ms, |D| p99 {delta['p99'] / 1e6:.3f} ms, "
+            f"late {stats['late']}")
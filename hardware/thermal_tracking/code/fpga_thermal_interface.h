@@ -5,6 +5,10 @@
  * 
  * Protocol: UDP packets at 60Hz containing droplet state information
  * Used for acoustic field steering control
+ *
+ * Legacy format: one DropletData datagram per track
+ * Framed format: one datagram per frame, FramePacketHeader followed by
+ * track_count DropletData records (see code/fpga_protocol.py)
  */
 
 #ifndef FPGA_THERMAL_INTERFACE_H
@@ -19,6 +23,12 @@
 #define MAX_TRACKED_DROPLETS    10
 #define POSITION_TIMEOUT_MS     100   // Lost if no update for 100ms
 
+/* Framed protocol */
+#define THERMAL_FRAME_MAGIC     0x50495244u  // "DRIP" little-endian
+#define THERMAL_FRAME_VERSION   1
+#define THERMAL_HEADER_SIZE     24
+#define THERMAL_CRC_OFFSET      20    // offsetof(FramePacketHeader, crc32)
+
 /* Droplet state data structure - matches Python struct.pack format */
 typedef struct __attribute__((packed)) {
     uint32_t track_id;        // Unique droplet identifier
@@ -30,6 +40,25 @@ typedef struct __attribute__((packed)) {
     float velocity_y;         // Y velocity in mm/s
 } DropletData;
 
+/* Framed datagram header - matches fpga_protocol.HEADER_DTYPE */
+typedef struct __attribute__((packed)) {
+    uint32_t magic;             // THERMAL_FRAME_MAGIC
+    uint16_t version;           // THERMAL_FRAME_VERSION
+    uint16_t track_count;       // DropletData records that follow
+    uint32_t sequence;          // +1 per datagram; gaps mean lost packets
+    uint64_t camera_timestamp;  // Camera clock of the source frame (ns)
+    uint32_t crc32;             // CRC-32 of all other datagram bytes
+} FramePacketHeader;
+
+/* Framed protocol receive statistics */
+typedef struct {
+    uint32_t frames;            // Valid frame packets processed
+    uint32_t rejected;          // Bad magic/version/length/CRC
+    uint32_t lost;              // Sequence numbers skipped
+    uint32_t last_sequence;
+    uint64_t last_camera_timestamp;
+} FrameStats;
+
 /* Tracking state for each droplet */
 typedef struct {
     DropletData data;
@@ -41,6 +70,7 @@ typedef struct {
 /* Global tracking state */
 static DropletTracker droplet_trackers[MAX_TRACKED_DROPLETS];
 static uint8_t num_active_droplets = 0;
+static FrameStats frame_stats;
 
 /**
  * @brief Initialize thermal tracking interface
@@ -48,6 +78,22 @@ static uint8_t num_active_droplets = 0;
 void thermal_interface_init(void) {
     memset(droplet_trackers, 0, sizeof(droplet_trackers));
     num_active_droplets = 0;
+    memset(&frame_stats, 0, sizeof(frame_stats));
+}
+
+/**
+ * @brief CRC-32 (IEEE 802.3, as zlib.crc32), bitwise
+ * @param crc Previous CRC (0 to start)
+ */
+static uint32_t thermal_crc32(uint32_t crc, const uint8_t* data, uint32_t length) {
+    crc = ~crc;
+    for (uint32_t i = 0; i < length; i++) {
+        crc ^= data[i];
+        for (int bit = 0; bit < 8; bit++) {
+            crc = (crc >> 1) ^ (0xEDB88320u & (0u - (crc & 1u)));
+        }
+    }
+    return ~crc;
 }
 
 /**
@@ -91,6 +137,56 @@ void process_thermal_packet(uint8_t* packet, uint32_t timestamp_ms) {
     tracker->stable = (speed < 5.0);  // <5mm/s considered stable
 }
 
+/**
+ * @brief Process a framed datagram holding every track of one frame
+ * @param packet Raw UDP payload
+ * @param length Payload length in bytes
+ * @param timestamp_ms Current system time in milliseconds
+ * @return Number of track records processed, or -1 if the packet was rejected
+ */
+int process_thermal_frame_packet(uint8_t* packet, uint32_t length, uint32_t timestamp_ms) {
+    FramePacketHeader header;
+    
+    if (length < THERMAL_HEADER_SIZE) {
+        frame_stats.rejected++;
+        return -1;
+    }
+    memcpy(&header, packet, sizeof(header));
+    
+    // Validate header, length and CRC
+    if (header.magic != THERMAL_FRAME_MAGIC ||
+        header.version != THERMAL_FRAME_VERSION ||
+        length != THERMAL_HEADER_SIZE + header.track_count * sizeof(DropletData)) {
+        frame_stats.rejected++;
+        return -1;
+    }
+    uint32_t crc = thermal_crc32(0, packet, THERMAL_CRC_OFFSET);
+    crc = thermal_crc32(crc, packet + THERMAL_HEADER_SIZE,
+                        length - THERMAL_HEADER_SIZE);
+    if (crc != header.crc32) {
+        frame_stats.rejected++;
+        return -1;
+    }
+    
+    // Count lost datagrams from sequence gaps (stale/reordered ones are dropped)
+    if (frame_stats.frames > 0) {
+        int32_t gap = (int32_t)(header.sequence - frame_stats.last_sequence);
+        if (gap <= 0) {
+            return 0;
+        }
+        frame_stats.lost += (uint32_t)(gap - 1);
+    }
+    frame_stats.frames++;
+    frame_stats.last_sequence = header.sequence;
+    frame_stats.last_camera_timestamp = header.camera_timestamp;
+    
+    for (uint16_t i = 0; i < header.track_count; i++) {
+        process_thermal_packet(packet + THERMAL_HEADER_SIZE + i * sizeof(DropletData),
+                               timestamp_ms);
+    }
+    return header.track_count;
+}
+
 /**
  * @brief Update tracking timeouts and remove stale tracks
  * @param current_time_ms Current system time in milliseconds
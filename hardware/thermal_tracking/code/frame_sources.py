@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Frame sources for the thermal droplet tracker
+Decouples ThermalDropletTracker from the FLIR A35 so that recorded
+Mono14 footage can be replayed on any Linux box for benchmarking,
+regression testing and reproducing field incidents
+"""
+
+import os
+import time
+import numpy as np
+
+# FLIR A35 sensor geometry (default until a source reports its own)
+A35_WIDTH = 320
+A35_HEIGHT = 256
+
+
+def recording_paths(path):
+    """
+    Return (frames_path, timestamps_path) for a recording
+
+    A recording is a pair of .npy files: the frames as a uint16 array of
+    shape (N, height, width) holding Mono14 counts, and the per-frame camera
+    timestamps as an int64 array of nanoseconds.
+    """
+    root, ext = os.path.splitext(path)
+    if ext != '.npy':
+        root = path
+    return root + '.npy', root + '.timestamps.npy'
+
+
+def save_recording(path, frames, timestamps_ns):
+    """Save Mono14 frames and their camera timestamps as a replayable recording"""
+    frames = np.asarray(frames, dtype=np.uint16)
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    if frames.ndim != 3:
+        raise ValueError("Frames must have shape (N, height, width)")
+    if len(timestamps_ns) != len(frames):
+        raise ValueError(
+            f"Got {len(timestamps_ns)} timestamps for {len(frames)} frames"
+        )
+
+    frames_path, timestamps_path = recording_paths(path)
+    np.save(frames_path, frames)
+    np.save(timestamps_path, timestamps_ns)
+    return frames_path
+
+
+class ReplayImage:
+    """
+    Stand-in for a PySpin ImagePtr backed by a recorded frame
+    Implements the subset of the image API used by the tracker
+    """
+
+    def __init__(self, frame, timestamp_ns, frame_id):
+        self._frame = frame
+        self._timestamp_ns = timestamp_ns
+        self._frame_id = frame_id
+
+    def GetNDArray(self):
+        return self._frame
+
+    def GetTimeStamp(self):
+        return self._timestamp_ns
+
+    def GetFrameID(self):
+        return self._frame_id
+
+    def GetWidth(self):
+        return self._frame.shape[1]
+
+    def GetHeight(self):
+        return self._frame.shape[0]
+
+    def IsIncomplete(self):
+        return False
+
+    def Release(self):
+        pass
+
+
+class FrameSource:
+    """
+    Base class for anything that feeds frames to ThermalDropletTracker
+
+    next_image() returns an object with the PySpin image interface
+    (GetNDArray, GetTimeStamp, IsIncomplete, Release) or None once the
+    source is exhausted.
+    """
+
+    width = A35_WIDTH
+    height = A35_HEIGHT
+
+    def initialize(self):
+        """Prepare the source (open camera, map files, ...)"""
+
+    def begin(self):
+        """Start delivering frames"""
+
+    def next_image(self, timeout_ms=1000):
+        """Return the next frame, or None when no more frames will arrive"""
+        raise NotImplementedError
+
+    def end(self):
+        """Stop delivering frames"""
+
+    def close(self):
+        """Release all resources held by the source"""
+
+
+class SpinnakerFrameSource(FrameSource):
+    """
+    Live frames from a FLIR A35 through the Spinnaker SDK
+    Opens the camera with the given serial number, or the index-th camera
+    found (the first one by default)
+    """
+
+    def __init__(self, serial=None, index=0):
+        import PySpin
+        self.serial = serial
+        self.index = index
+        self.PySpin = PySpin
+        self.system = PySpin.System.GetInstance()
+        self.cam_list = None
+        self.camera = None
+        self.acquiring = False
+
+    def initialize(self):
+        """Initialize FLIR A35 with optimal settings"""
+        PySpin = self.PySpin
+        try:
+            # Get camera list
+            self.cam_list = self.system.GetCameras()
+            if self.cam_list.GetSize() == 0:
+                raise Exception("No FLIR camera detected!")
+
+            if self.serial is not None:
+                self.camera = self.cam_list.GetBySerial(str(self.serial))
+                if not self.camera.IsValid():
+                    raise Exception(f"FLIR camera {self.serial} not found!")
+            elif self.index < self.cam_list.GetSize():
+                self.camera = self.cam_list[self.index]
+            else:
+                raise Exception(f"FLIR camera {self.index} not found "
+                                f"({self.cam_list.GetSize()} detected)")
+            self.camera.Init()
+
+            # Configure for maximum performance
+            nodemap = self.camera.GetNodeMap()
+
+            # Set pixel format to 14-bit for temperature
+            pixel_format = PySpin.CEnumerationPtr(nodemap.GetNode("PixelFormat"))
+            pixel_format.SetIntValue(PySpin.PixelFormat_Mono14)
+
+            # Set acquisition mode to continuous
+            acquisition_mode = PySpin.CEnumerationPtr(
+                nodemap.GetNode("AcquisitionMode")
+            )
+            acquisition_mode.SetIntValue(PySpin.AcquisitionMode_Continuous)
+
+            # Set frame rate to maximum (60 Hz)
+            frame_rate = PySpin.CFloatPtr(nodemap.GetNode("AcquisitionFrameRate"))
+            frame_rate.SetValue(60.0)
+
+            # Sensor geometry as reported by the camera
+            self.width = PySpin.CIntegerPtr(nodemap.GetNode("Width")).GetValue()
+            self.height = PySpin.CIntegerPtr(nodemap.GetNode("Height")).GetValue()
+
+            # Enable timestamp for synchronization
+            timestamp = PySpin.CBooleanPtr(nodemap.GetNode("ChunkModeActive"))
+            timestamp.SetValue(True)
+
+            # Configure temperature linear output mode
+            # This makes pixel values directly proportional to temperature
+            temp_linear = PySpin.CEnumerationPtr(
+                nodemap.GetNode("TemperatureLinearMode")
+            )
+            temp_linear.SetIntValue(1)  # High gain mode
+
+            print(f"Camera initialized: {self.camera.GetUniqueID()}")
+            print(f"Resolution: {self.width}x{self.height} @ {frame_rate.GetValue():g}Hz")
+
+        except PySpin.SpinnakerException as ex:
+            print(f"Error initializing camera: {ex}")
+            raise
+
+    def begin(self):
+        self.camera.BeginAcquisition()
+        self.acquiring = True
+
+    def next_image(self, timeout_ms=1000):
+        # Blocks until a frame is available
+        return self.camera.GetNextImage(timeout_ms)
+
+    def end(self):
+        if self.acquiring:
+            self.camera.EndAcquisition()
+            self.acquiring = False
+
+    def close(self):
+        self.end()
+        if self.camera:
+            self.camera.DeInit()
+            del self.camera
+            self.camera = None
+        if self.cam_list is not None:
+            self.cam_list.Clear()
+            self.cam_list = None
+        self.system.ReleaseInstance()
+
+
+class ReplayFrameSource(FrameSource):
+    """
+    Replays a recorded Mono14 sequence from a memory-mapped file
+
+    speed=1.0 paces frames by their recorded camera timestamps (real time),
+    larger values replay faster and speed=0 delivers frames as fast as the
+    tracker consumes them, for throughput measurements.
+    """
+
+    def __init__(self, path, speed=1.0, loop=False):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+
+        self.frames = None
+        self.timestamps = None
+        self.index = 0
+        self.cycle = 0
+        self._start_host = None
+        self._cycle_span_ns = 0
+
+    def initialize(self):
+        """Memory-map the recording and validate its layout"""
+        frames_path, timestamps_path = recording_paths(self.path)
+        self.frames = np.load(frames_path, mmap_mode='r')
+        self.timestamps = np.load(timestamps_path, mmap_mode='r')
+
+        if self.frames.ndim != 3 or self.frames.dtype != np.uint16:
+            raise ValueError(
+                f"{frames_path}: expected uint16 frames of shape "
+                f"(N, height, width), got {self.frames.dtype} {self.frames.shape}"
+            )
+        if len(self.timestamps) != len(self.frames):
+            raise ValueError(
+                f"{timestamps_path}: {len(self.timestamps)} timestamps for "
+                f"{len(self.frames)} frames"
+            )
+        if len(self.frames) == 0:
+            raise ValueError(f"{frames_path}: recording is empty")
+
+        self.height, self.width = self.frames.shape[1:]
+
+        # Length of one pass, including one nominal frame period so that
+        # looped timestamps stay strictly increasing
+        if len(self.timestamps) > 1:
+            span = int(self.timestamps[-1] - self.timestamps[0])
+            self._cycle_span_ns = span + span // (len(self.timestamps) - 1)
+        else:
+            self._cycle_span_ns = int(1e9 / 60)
+
+        duration = self._cycle_span_ns / 1e9
+        pacing = 'max speed' if not self.speed else f"{self.speed:g}x real time"
+        print(f"Replay source: {frames_path}")
+        print(f"Resolution: {self.width}x{self.height}, "
+              f"{len(self.frames)} frames ({duration:.1f}s) at {pacing}")
+
+    def __len__(self):
+        return 0 if self.frames is None else len(self.frames)
+
+    def begin(self):
+        self.index = 0
+        self.cycle = 0
+        self._start_host = time.perf_counter()
+
+    def next_image(self, timeout_ms=1000):
+        if self._start_host is None:
+            self._start_host = time.perf_counter()
+        if self.index >= len(self.frames):
+            if not self.loop:
+                return None
+            self.index = 0
+            self.cycle += 1
+
+        i = self.index
+        self.index += 1
+
+        timestamp_ns = (int(self.timestamps[i])
+                        + self.cycle * self._cycle_span_ns)
+
+        # Real-time pacing relative to the first recorded timestamp
+        if self.speed:
+            elapsed_ns = timestamp_ns - int(self.timestamps[0])
+            due = self._start_host + elapsed_ns / 1e9 / self.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        frame_id = self.cycle * len(self.frames) + i
+        return ReplayImage(self.frames[i], timestamp_ns, frame_id)
+
+    def close(self):
+        self.frames = None
+        self.timestamps = None
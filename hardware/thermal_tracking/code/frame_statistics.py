@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Streaming per-pixel statistics of thermal frames
+Calibration captures accumulate frames one at a time into preallocated
+buffers, so averaging windows of thousands of frames (needed for stable
+steel and titanium temperatures) run in constant memory
+"""
+
+import numpy as np
+
+
+class PixelStatistics:
+    """
+    Running mean and variance of every pixel
+
+    add() accumulates deviations from the first frame into float32 block
+    sums in place and allocates nothing; every block_frames frames the
+    block is merged into the totals with Chan's parallel update. Keeping
+    the mean relative to the first frame and merging whole blocks keeps
+    each update far above float32 resolution, which a per-frame Welford
+    update of a ~16k count mean falls below after a few thousand frames.
+    The noise map (per-pixel temporal standard deviation) feeds the
+    detector's adaptive thresholds through the sensor calibration.
+    """
+
+    def __init__(self, shape, block_frames=64):
+        self.shape = tuple(shape)
+        self.block_frames = block_frames
+        self.count = 0
+        self._block = 0     # Frames in the block sums, not yet merged
+        self._origin = np.zeros(self.shape, dtype=np.float32)  # First frame
+        self._mean = np.zeros(self.shape, dtype=np.float32)    # Merged mean − origin
+        self._m2 = np.zeros(self.shape, dtype=np.float32)      # Sum of squared deviations
+        self._sum = np.zeros(self.shape, dtype=np.float32)     # Block Σ(frame − origin)
+        self._sq = np.zeros(self.shape, dtype=np.float32)      # Block Σ(frame − origin)²
+        self._delta = np.empty(self.shape, dtype=np.float32)
+
+    def reset(self):
+        self.count = 0
+        self._block = 0
+        for buffer in (self._origin, self._mean, self._m2, self._sum, self._sq):
+            buffer.fill(0)
+
+    def add(self, frame):
+        """Accumulate one frame"""
+        if frame.shape != self.shape:
+            raise ValueError(f"frame is {frame.shape}, statistics are {self.shape}")
+        if self.count == 0:
+            np.copyto(self._origin, frame)
+        self.count += 1
+        self._block += 1
+        np.subtract(frame, self._origin, out=self._delta)
+        self._sum += self._delta
+        self._delta *= self._delta
+        self._sq += self._delta
+        if self._block == self.block_frames:
+            self._merge()
+
+    def _merge(self):
+        """Fold the block sums into the mean and M2 (Chan et al.)"""
+        n_b = self._block
+        if n_b == 0:
+            return
+        n = self.count
+        n_a = n - n_b
+        # Block mean and M2 = Σx² − n·mean²
+        self._sum *= np.float32(1.0 / n_b)
+        np.multiply(self._sum, self._sum, out=self._delta)
+        self._delta *= np.float32(n_b)
+        self._sq -= self._delta
+        self._m2 += self._sq
+        # δ = block mean − mean; mean += δ·n_b/n; M2 += δ²·n_a·n_b/n
+        np.subtract(self._sum, self._mean, out=self._delta)
+        np.multiply(self._delta, np.float32(n_b / n), out=self._sum)
+        self._mean += self._sum
+        self._delta *= self._sum
+        self._delta *= np.float32(n_a)
+        self._m2 += self._delta
+        self._sum.fill(0)
+        self._sq.fill(0)
+        self._block = 0
+
+    @property
+    def mean(self):
+        """Per-pixel mean (counts)"""
+        self._merge()
+        return self._origin + self._mean
+
+    def variance(self):
+        """Per-pixel sample variance (zeros until two frames are in)"""
+        if self.count < 2:
+            return np.zeros(self.shape, dtype=np.float32)
+        self._merge()
+        return np.maximum(self._m2, 0) / np.float32(self.count - 1)
+
+    def noise_map(self):
+        """Per-pixel temporal standard deviation (counts)"""
+        return np.sqrt(self.variance())
+
+    def summary(self):
+        """Frames, median and 99th percentile noise (counts)"""
+        noise = self.noise_map()
+        return {
+            'frames': self.count,
+            'noise_median': float(np.median(noise)),
+            'noise_p99': float(np.percentile(noise, 99)),
+        }
+
+
+def accumulate_recording(path):
+    """PixelStatistics of a recording, streamed from the memory-mapped file"""
+    from frame_sources import ReplayFrameSource
+    source = ReplayFrameSource(path, speed=0)
+    source.initialize()
+    stats = PixelStatistics(source.frames.shape[1:])
+    for frame in source.frames:
+        stats.add(frame)
+    return stats
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Garbage collector control for the tracking loop
+Keeps cyclic garbage collection from pausing a frame: objects that
+survive start-up are frozen out of every collection, the automatic
+collector is disabled, and collections run between frames instead
+"""
+
+import gc
+import time
+
+# GC modes selectable with PROCESSING_CONFIG['gc_mode']
+GC_AUTO = 'auto'  # Python's default collector, may run mid-frame
+GC_IDLE = 'idle'  # Frozen start-up heap, collections only between frames
+GC_MODES = (GC_AUTO, GC_IDLE)
+
+
+class IdleCollector:
+    """
+    Runs the cyclic garbage collector only when the loop calls poll()
+
+    start() collects once, then gc.freeze() moves every live object into
+    the permanent generation (never scanned again) and disables automatic
+    collection. poll() between frames runs the collection Python would
+    have run by now, following the usual generation thresholds, if the
+    loop is idle (no frame waiting); once force_factor times the
+    generation-0 threshold of objects is pending it collects even when
+    busy, so a loop that is never idle cannot grow without bound.
+    """
+
+    def __init__(self, force_factor=10):
+        self.thresholds = gc.get_threshold()
+        self.force_factor = force_factor
+        self.active = False
+        self.collections = [0, 0, 0]
+        self.forced = 0
+        self.last_pause_ns = 0
+        self.max_pause_ns = 0
+
+    def start(self):
+        """Freeze the start-up heap and take over from the automatic collector"""
+        if self.active:
+            return
+        gc.collect()
+        gc.freeze()
+        gc.disable()
+        self.active = True
+
+    def stop(self):
+        """Hand collection back to Python"""
+        if not self.active:
+            return
+        gc.unfreeze()
+        gc.enable()
+        self.active = False
+
+    def poll(self, idle=True):
+        """Collect the generations that are due; returns the pause in ns (0 if none)"""
+        if not self.active:
+            return 0
+        count0, count1, count2 = gc.get_count()
+        threshold0, threshold1, threshold2 = self.thresholds
+        if count0 < threshold0:
+            return 0
+        if not idle:
+            if count0 < self.force_factor * threshold0:
+                return 0
+            self.forced += 1
+        generation = 0
+        if count1 >= threshold1:
+            generation = 2 if count2 >= threshold2 else 1
+        start = time.perf_counter_ns()
+        gc.collect(generation)
+        self.last_pause_ns = time.perf_counter_ns() - start
+        self.max_pause_ns = max(self.max_pause_ns, self.last_pause_ns)
+        self.collections[generation] += 1
+        return self.last_pause_ns
+
+    def stats(self):
+        return {
+            'active': self.active,
+            'frozen': gc.get_freeze_count(),
+            'collections': list(self.collections),
+            'forced': self.forced,
+            'max_pause_ns': self.max_pause_ns,
+        }
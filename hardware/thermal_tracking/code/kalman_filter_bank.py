@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Vectorized Kalman filter bank for multi-droplet tracking
+Holds every track's state and covariance in preallocated arrays so that
+predict and update run as one batched operation per frame
+"""
+
+from collections.abc import Mapping
+import numpy as np
+
+from motion_model import ConstantVelocityModel
+
+# State vector: [x, y, vx, vy, temp]; we measure x, y and temp
+STATE_SIZE = 5
+STATE_FIELDS = ('x', 'y', 'vx', 'vy', 'temp')
+MEASURED = np.array([0, 1, 4])
+
+# One row of a track snapshot
+TRACK_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('x', '<f8'),
+    ('y', '<f8'),
+    ('vx', '<f8'),
+    ('vy', '<f8'),
+    ('temp', '<f8'),
+    ('age', '<i4'),
+    ('missed', '<i4'),
+])
+
+
+def record_state(record):
+    """get_state() dict for one TRACK_DTYPE record (plus z if it has one)"""
+    state = {
+        'x': record['x'],
+        'y': record['y'],
+        'vx': record['vx'],
+        'vy': record['vy'],
+        'temp': record['temp'],
+        'age': int(record['age'])
+    }
+    if 'z' in record.dtype.names:
+        state['z'] = record['z']
+    return state
+
+
+class TrackHandle:
+    """
+    Read-only view of one track in a KalmanFilterBank
+    Provides the get_state() interface of the former per-track filter
+    """
+
+    __slots__ = ('bank', 'track_id')
+
+    def __init__(self, bank, track_id):
+        self.bank = bank
+        self.track_id = track_id
+
+    @property
+    def missed_frames(self):
+        return int(self.bank.missed[self.bank.slot_of(self.track_id)])
+
+    @property
+    def age(self):
+        return int(self.bank.age[self.bank.slot_of(self.track_id)])
+
+    def get_state(self):
+        """Get current state estimate"""
+        return self.bank.get_state(self.track_id)
+
+
+class SnapshotTrack:
+    """One track of a TrackSnapshot, with the get_state() interface"""
+
+    __slots__ = ('record',)
+
+    def __init__(self, record):
+        self.record = record
+
+    @property
+    def missed_frames(self):
+        return int(self.record['missed'])
+
+    @property
+    def age(self):
+        return int(self.record['age'])
+
+    def get_state(self):
+        """Get state estimate at snapshot time"""
+        return record_state(self.record)
+
+
+class TrackSnapshot(Mapping):
+    """
+    Immutable copy of the track table, safe to hand to other threads
+    records is a TRACK_DTYPE array (or a superset such as the fused 3D
+    table of camera_fusion); the mapping interface matches the bank
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self._index = None
+
+    def __getitem__(self, track_id):
+        if self._index is None:
+            self._index = {tid: i for i, tid in enumerate(self.records['id'].tolist())}
+        return SnapshotTrack(self.records[self._index[track_id]])
+
+    def __iter__(self):
+        return iter(self.records['id'].tolist())
+
+    def __len__(self):
+        return len(self.records)
+
+    def confirmed(self, min_age):
+        """Snapshot of the tracks updated at least min_age times"""
+        if min_age <= 0:
+            return self
+        return TrackSnapshot(self.records[self.records['age'] >= min_age])
+
+    def predicted(self, dt, model=None):
+        """
+        New snapshot with states extrapolated dt seconds ahead, along the
+        bank's motion model if given (otherwise in a straight line)
+        """
+        records = self.records.copy()
+        if model is None:
+            records['x'] += records['vx'] * dt
+            records['y'] += records['vy'] * dt
+        else:
+            F, b = model.transition(dt)
+            state = np.column_stack([records[k] for k in STATE_FIELDS]) @ F.T + b
+            for i, k in enumerate(STATE_FIELDS):
+                records[k] = state[:, i]
+        if 'z' in records.dtype.names:
+            records['z'] += records['vz'] * dt
+        return TrackSnapshot(records)
+
+
+class KalmanFilterBank(Mapping):
+    """
+    Kalman filters for all tracked droplets, struct-of-arrays layout
+
+    Active tracks occupy slots 0..len-1 of the state (N×5) and covariance
+    (N×5×5) arrays; removing a track moves the last slot into the gap.
+    The bank is a read-only mapping of track ID to TrackHandle, so callers
+    can keep iterating tracks.items() and calling get_state().
+
+    The transition comes from a motion model (motion_model.py) for the
+    step set with set_dt(); process noise is specified per nominal frame
+    of dt seconds and scales with the actual step.
+    """
+
+    def __init__(self, capacity=32, dt=1/60.0, process_noise=0.1,
+                 velocity_noise=0.01, measurement_noise=0.5, temp_noise=5.0,
+                 initial_covariance=10.0, initial_velocity_covariance=1e4,
+                 initial_velocity=(0.0, 0.0), motion_model=None):
+        self.dt = dt
+        self.model = motion_model if motion_model is not None else ConstantVelocityModel()
+
+        self.step = None
+        self.set_noise(process_noise, velocity_noise, measurement_noise, temp_noise)
+
+        # New tracks start at initial_velocity (at rest by default) with a
+        # wide velocity prior, so the first few updates pull the velocity in
+        # quickly
+        self.initial_covariance = initial_covariance
+        self.initial_velocity_covariance = initial_velocity_covariance
+        self.initial_velocity = tuple(initial_velocity)
+
+        self.set_dt(dt)
+
+        self.count = 0
+        self._slots = {}
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        """(Re)allocate track storage, preserving active tracks"""
+        n = self.count
+        state = np.zeros((capacity, STATE_SIZE))
+        P = np.zeros((capacity, STATE_SIZE, STATE_SIZE))
+        ids = np.zeros(capacity, dtype=np.int64)
+        missed = np.zeros(capacity, dtype=np.int32)
+        age = np.zeros(capacity, dtype=np.int32)
+        if n:
+            state[:n] = self.state[:n]
+            P[:n] = self.P[:n]
+            ids[:n] = self.ids[:n]
+            missed[:n] = self.missed[:n]
+            age[:n] = self.age[:n]
+        self.state, self.P, self.ids = state, P, ids
+        self.missed, self.age = missed, age
+
+        # Scratch buffers for predict()
+        self._state_tmp = np.zeros_like(state)
+        self._P_tmp = np.zeros_like(P)
+        self.capacity = capacity
+
+    # Mapping interface -------------------------------------------------
+
+    def __getitem__(self, track_id):
+        if track_id not in self._slots:
+            raise KeyError(track_id)
+        return TrackHandle(self, track_id)
+
+    def __iter__(self):
+        return iter(self.ids[:self.count].tolist())
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, track_id):
+        return track_id in self._slots
+
+    # Track management --------------------------------------------------
+
+    def slot_of(self, track_id):
+        return self._slots[track_id]
+
+    def track_ids(self):
+        """IDs of active tracks in slot order"""
+        return self.ids[:self.count]
+
+    def positions(self):
+        """Predicted/estimated (x, y) of active tracks in slot order"""
+        return self.state[:self.count, :2]
+
+    def confirmed(self, min_age):
+        """Boolean mask (slot order) of tracks updated at least min_age times"""
+        return self.age[:self.count] >= min_age
+
+    def position_covariance(self):
+        """Innovation covariance of the (x, y) measurement for active tracks"""
+        return self.P[:self.count, :2, :2] + self.R[:2, :2]
+
+    def predicted_positions(self):
+        """
+        One-step-ahead (x, y) and innovation covariance for active tracks
+        Same result as predict() followed by positions() and
+        position_covariance(), without advancing the filters
+        """
+        n = self.count
+        F = self.F[:2]
+        xy = self.state[:n] @ self.FT[:, :2] + self.b[:2]
+        cov = F @ self.P[:n] @ F.T + self.Q[:2, :2] + self.R[:2, :2]
+        return xy, cov
+
+    def add(self, track_id, detection):
+        """Start a new track from a detection"""
+        if self.count == self.capacity:
+            self._allocate(self.capacity * 2)
+        slot = self.count
+        vx, vy = self.initial_velocity
+        self.state[slot] = (detection['x'], detection['y'], vx, vy,
+                            detection['temp'])
+        self.P[slot] = np.eye(STATE_SIZE) * self.initial_covariance
+        self.P[slot, 2, 2] = self.P[slot, 3, 3] = self.initial_velocity_covariance
+        self.ids[slot] = track_id
+        self.missed[slot] = 0
+        self.age[slot] = 0
+        self._slots[track_id] = slot
+        self.count += 1
+
+    def remove(self, track_id):
+        """Drop a track, moving the last active slot into its place"""
+        slot = self._slots.pop(track_id)
+        last = self.count - 1
+        if slot != last:
+            self.state[slot] = self.state[last]
+            self.P[slot] = self.P[last]
+            self.ids[slot] = self.ids[last]
+            self.missed[slot] = self.missed[last]
+            self.age[slot] = self.age[last]
+            self._slots[int(self.ids[slot])] = slot
+        self.count = last
+
+    def clear(self):
+        self._slots.clear()
+        self.count = 0
+
+    # Filtering ---------------------------------------------------------
+
+    def set_dt(self, dt):
+        """Time step (s) of the next predict() and predicted_positions()"""
+        if dt == self.step:
+            return
+        self.step = dt
+        self.F, self.b = self.model.transition(dt)
+        self.FT = np.ascontiguousarray(self.F.T)
+        self.Q = self.Q_frame * (dt / self.dt)
+
+    def set_noise(self, process_noise, velocity_noise, measurement_noise, temp_noise):
+        """
+        Replace the process and measurement noise
+        Active tracks keep their states and covariances
+        """
+        # Process noise covariance per nominal frame
+        self.Q_frame = np.eye(STATE_SIZE) * process_noise
+        self.Q_frame[2, 2] = velocity_noise  # Less noise in velocity
+        self.Q_frame[3, 3] = velocity_noise
+
+        # Measurement noise covariance (x, y, temp)
+        self.R = np.diag([measurement_noise, measurement_noise, temp_noise])
+
+        if self.step is not None:
+            self.Q = self.Q_frame * (self.step / self.dt)
+
+    def noise(self):
+        """Process and measurement noise as passed to the constructor"""
+        return {
+            'process_noise': float(self.Q_frame[0, 0]),
+            'velocity_noise': float(self.Q_frame[2, 2]),
+            'measurement_noise': float(self.R[0, 0]),
+            'temp_noise': float(self.R[2, 2]),
+        }
+
+    def set_motion_model(self, model):
+        """Switch motion model; the next set_dt() rebuilds the transition"""
+        self.model = model
+        step, self.step = self.step, None
+        if step is not None:
+            self.set_dt(step)
+
+    def rescale(self, ratio):
+        """
+        Scale positions and velocities of active tracks (new calibration)
+        Covariances scale by ratio² in those components; temperature is kept
+        """
+        if ratio == 1.0:
+            return
+        n = self.count
+        scale = np.ones(STATE_SIZE)
+        scale[:4] = ratio
+        self.state[:n] *= scale
+        self.P[:n] *= np.outer(scale, scale)
+
+    def predict(self):
+        """Predict next state for all tracks"""
+        n = self.count
+        if n == 0:
+            return
+        state = self.state[:n]
+        P = self.P[:n]
+        np.matmul(state, self.FT, out=self._state_tmp[:n])
+        np.add(self._state_tmp[:n], self.b, out=state)
+        np.matmul(self.F, P, out=self._P_tmp[:n])
+        np.matmul(self._P_tmp[:n], self.FT, out=P)
+        P += self.Q
+
+    def update(self, slots, measurements):
+        """
+        Update the tracks in the given slots with (x, y, temp) measurements
+        slots: int array (M,), measurements: array (M, 3)
+        """
+        if len(slots) == 0:
+            return
+        slots = np.asarray(slots)
+        z = np.asarray(measurements, dtype=float)
+
+        P = self.P[slots]
+        PHt = P[:, :, MEASURED]                 # P H^T      (M×5×3)
+        S = PHt[:, MEASURED, :] + self.R        # H P H^T + R (M×3×3)
+
+        # Kalman gain K = P H^T S^-1, solved rather than inverted
+        K = np.linalg.solve(S, PHt.transpose(0, 2, 1)).transpose(0, 2, 1)
+
+        # Update state
+        y = z - self.state[slots][:, MEASURED]
+        self.state[slots] += np.matmul(K, y[:, :, None])[:, :, 0]
+
+        # Update covariance: (I - K H) P = P - K (H P)
+        self.P[slots] = P - np.matmul(K, PHt.transpose(0, 2, 1))
+
+        self.missed[slots] = 0
+        self.age[slots] += 1
+
+    def get_state(self, track_id):
+        """Get current state estimate"""
+        slot = self._slots[track_id]
+        x, y, vx, vy, temp = self.state[slot]
+        return {
+            'x': x,
+            'y': y,
+            'vx': vx,
+            'vy': vy,
+            'temp': temp,
+            'age': int(self.age[slot])
+        }
+
+    def snapshot(self):
+        """Copy the active tracks into a TrackSnapshot"""
+        n = self.count
+        records = np.empty(n, dtype=TRACK_DTYPE)
+        records['id'] = self.ids[:n]
+        records['x'] = self.state[:n, 0]
+        records['y'] = self.state[:n, 1]
+        records['vx'] = self.state[:n, 2]
+        records['vy'] = self.state[:n, 3]
+        records['temp'] = self.state[:n, 4]
+        records['age'] = self.age[:n]
+        records['missed'] = self.missed[:n]
+        return TrackSnapshot(records)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Per-frame latency instrumentation for the tracking pipeline
+Stage timings are kept in fixed-bin histograms written by a single thread
+each, and exported as Prometheus text over HTTP or to a file
+"""
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# Pipeline stages, in order; 'gc' is a garbage collection between frames,
+# 'total' is camera timestamp → packet sent and 'rtt' is packet sent →
+# timestamp echo received (FPGA stand-in only)
+STAGES = ('grab', 'queue', 'detect', 'associate', 'filter', 'record', 'gc', 'send',
+          'total', 'rtt')
+
+# Histogram resolution: 2**SUB_BITS linear sub-bins per power of two,
+# i.e. values are binned to within 1/2**(SUB_BITS-1) (about 3%)
+SUB_BITS = 6
+_HALF = 1 << (SUB_BITS - 1)
+MAX_EXPONENT = 40 - SUB_BITS  # Values up to 2**40 ns (~18 minutes)
+NUM_BINS = (MAX_EXPONENT + 1) * _HALF + _HALF
+
+
+def bin_index(value_ns):
+    """Histogram bin of a non-negative integer value"""
+    exponent = value_ns.bit_length() - SUB_BITS
+    if exponent <= 0:
+        return value_ns
+    if exponent > MAX_EXPONENT:
+        return NUM_BINS - 1
+    return exponent * _HALF + (value_ns >> exponent)
+
+
+def bin_lower_bounds():
+    """Smallest value of every bin (ns)"""
+    index = np.arange(NUM_BINS)
+    exponent = np.maximum(index // _HALF - 1, 0)
+    offset = np.where(index < 2 * _HALF, index, index - exponent * _HALF)
+    return offset << exponent
+
+
+_LOWER = bin_lower_bounds()
+_UPPER = np.append(_LOWER[1:], _LOWER[-1] * 2)
+
+
+class LatencyHistogram:
+    """
+    Fixed-bin log-linear histogram of durations in nanoseconds
+    record() must only be called from one thread. Readers copy the bin
+    counts without locking; a read racing a write can miss that one sample.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(NUM_BINS, dtype=np.int64)
+        self.count = 0
+        self.max = 0
+        self.max_frame = -1  # Frame ID of the worst sample
+
+    def record(self, value_ns, frame_id=-1):
+        value_ns = max(int(value_ns), 0)
+        self.counts[bin_index(value_ns)] += 1
+        self.count += 1
+        if value_ns > self.max:
+            self.max = value_ns
+            self.max_frame = frame_id
+
+    def percentile(self, q, counts=None):
+        """Upper bound (ns) of the bin holding the q-th percentile"""
+        if counts is None:
+            counts = self.counts.copy()
+        total = counts.sum()
+        if total == 0:
+            return 0
+        rank = np.searchsorted(np.cumsum(counts), q / 100.0 * total)
+        return int(min(_UPPER[min(rank, NUM_BINS - 1)], self.max))
+
+    def count_above(self, value_ns):
+        """Samples in bins starting at or above value_ns (bin resolution)"""
+        return int(self.counts[_LOWER >= value_ns].sum())
+
+    def summary(self):
+        """p50/p99/max (ns) and sample count"""
+        counts = self.counts.copy()
+        return {
+            'count': int(counts.sum()),
+            'p50': self.percentile(50, counts),
+            'p99': self.percentile(99, counts),
+            'max': self.max,
+            'max_frame': self.max_frame,
+        }
+
+    def reset(self):
+        self.counts[:] = 0
+        self.count = 0
+        self.max = 0
+        self.max_frame = -1
+
+
+class LatencyMonitor:
+    """
+    Stage latency histograms for the tracking pipeline
+
+    Durations come from time.perf_counter_ns(). 'grab' and 'total' start
+    at the camera timestamp mapped to the host clock by the tracker's
+    ClockOffsetEstimator, i.e. relative to the least-delayed frame's
+    transport latency rather than the absolute exposure time.
+    """
+
+    def __init__(self, stages=STAGES):
+        self.histograms = {stage: LatencyHistogram() for stage in stages}
+
+    def record(self, stage, value_ns, frame_id=-1):
+        self.histograms[stage].record(value_ns, frame_id)
+
+    def summary(self):
+        return {stage: hist.summary() for stage, hist in self.histograms.items()}
+
+    def reset(self):
+        for hist in self.histograms.values():
+            hist.reset()
+
+
+class MetricsExporter:
+    """
+    Prometheus text exposition of pipeline latency and counters
+    Serve it on a local HTTP port (serve) or write it to a file that a
+    node-exporter textfile collector can scrape (write)
+    """
+
+    def __init__(self, pipeline, prefix='thermal_tracking'):
+        self.pipeline = pipeline
+        self.prefix = prefix
+        self.server = None
+
+    def render(self):
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_stage_latency_seconds Per-frame stage latency",
+            f"# TYPE {p}_stage_latency_seconds summary",
+        ]
+        for stage, s in self.pipeline.latency.summary().items():
+            for quantile, key in (('0.5', 'p50'), ('0.99', 'p99'), ('1', 'max')):
+                lines.append(f'{p}_stage_latency_seconds{{stage="{stage}",'
+                             f'quantile="{quantile}"}} {s[key] / 1e9:.9f}')
+            lines.append(f'{p}_stage_latency_seconds_count{{stage="{stage}"}} {s["count"]}')
+
+        stats = self.pipeline.stats()
+        for key in ('captured', 'incomplete', 'processed', 'sent', 'errors',
+                    'frames_dropped', 'frames_skipped', 'frames_late', 'display_shed',
+                    'record_shed', 'sweeps_deferred', 'snapshots_dropped', 'echoes'):
+            lines.append(f"# TYPE {p}_{key}_total counter")
+            lines.append(f"{p}_{key}_total {stats[key]}")
+        for key in ('frame_queue_depth', 'frame_queue_max', 'send_queue_depth', 'shed_level'):
+            lines.append(f"# TYPE {p}_{key} gauge")
+            lines.append(f"{p}_{key} {stats[key]}")
+
+        # Clock synchronization and latency compensation
+        tracker = self.pipeline.tracker
+        camera = tracker.camera_clock.stats()
+        fpga = tracker.fpga_clock.stats()
+        for key, value in (('camera_clock_drift_ppm', camera['drift_ppm']),
+                           ('fpga_clock_offset_seconds', fpga['offset_ns'] / 1e9),
+                           ('fpga_one_way_delay_seconds', fpga['one_way_ns'] / 1e9),
+                           ('actuation_lead_seconds', tracker.last_lead_ns / 1e9)):
+            lines.append(f"# TYPE {p}_{key} gauge")
+            lines.append(f"{p}_{key} {value:.9g}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Atomically replace path with the current metrics"""
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve /metrics on a background thread"""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Keep scrapes out of the console
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  name='thermal-metrics', daemon=True)
+        thread.start()
+        return self.server.server_address
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
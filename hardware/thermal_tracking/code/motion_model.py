@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Motion models for the Kalman filter bank
+A model turns a time step into the linear transition of the track state
+[x, y, vx, vy, temp]: state' = F state + b, so the bank can predict with
+the real interval between camera timestamps instead of a fixed 1/60 s
+"""
+
+import numpy as np
+
+STATE_SIZE = 5
+
+
+class ConstantVelocityModel:
+    """Straight-line motion; unmodelled acceleration is left to process noise"""
+
+    name = 'constant_velocity'
+
+    def transition(self, dt):
+        """(F, b) for a step of dt seconds"""
+        F = np.eye(STATE_SIZE)
+        F[0, 2] = dt
+        F[1, 3] = dt
+        return F, np.zeros(STATE_SIZE)
+
+    def describe(self):
+        return self.name
+
+
+class BallisticModel:
+    """
+    Free fall with linear drag: dv/dt = g - k v, integrated exactly
+    gravity is in image axes (mm/s²; +y is down the image for a level
+    camera) and drag is k in 1/s. With k = 0 this is constant
+    acceleration; k > 0 bends velocities towards the terminal g / k.
+    """
+
+    name = 'ballistic'
+
+    def __init__(self, gravity=(0.0, 9810.0), drag=0.0):
+        self.gravity = np.asarray(gravity, dtype=float)
+        self.drag = float(drag)
+
+    def transition(self, dt):
+        k = self.drag
+        if k > 0:
+            decay = np.exp(-k * dt)  # Velocity kept after dt
+            reach = (1.0 - decay) / k  # Distance per unit initial velocity
+            shift = (dt - reach) / k  # Distance per unit acceleration
+        else:
+            decay, reach, shift = 1.0, dt, 0.5 * dt * dt
+        F = np.eye(STATE_SIZE)
+        F[0, 2] = F[1, 3] = reach
+        F[2, 2] = F[3, 3] = decay
+        b = np.zeros(STATE_SIZE)
+        b[0:2] = self.gravity * shift
+        b[2:4] = self.gravity * reach
+        return F, b
+
+    def describe(self):
+        gx, gy = self.gravity
+        return f"{self.name} (g = {gx:g}, {gy:g} mm/s², drag {self.drag:g}/s)"
+
+
+MOTION_MODELS = (ConstantVelocityModel.name, BallisticModel.name)
+
+
+def motion_model_from_config(config):
+    """Motion model selected by a KALMAN_CONFIG-style dict"""
+    name = config.get('motion_model', ConstantVelocityModel.name)
+    if name == ConstantVelocityModel.name:
+        return ConstantVelocityModel()
+    if name == BallisticModel.name:
+        return BallisticModel(config.get('gravity_mm_s2', (0.0, 9810.0)),
+                              config.get('drag_per_s', 0.0))
+    raise ValueError(f"Unknown motion model '{name}' (expected one of {MOTION_MODELS})")
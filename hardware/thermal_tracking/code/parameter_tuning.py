@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Offline tuning of tracking parameters
+Runs the tracking core over recordings with ground truth (synthetic
+scenes or labelled footage), scores each parameter setting on track
+continuity, ID switches, position error and compute time, and searches
+the parameter space (grid or model-based) on a process pool
+"""
+
+import os
+import json
+import math
+import time
+import itertools
+import multiprocessing
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from control_server import PARAMETERS, validate_parameters, apply_parameters
+from frame_sources import FrameSource, recording_paths
+from synthetic_scene import truth_path
+
+# Ranked parameter file format
+TUNING_FORMAT = 1
+
+METRICS = ('continuity', 'id_switches', 'position_error_mm', 'false_tracks',
+           'compute_p50_ms', 'compute_p99_ms')
+
+
+# Search space ---------------------------------------------------------------
+#
+# A space maps parameter names (control_server.PARAMETERS, which include
+# the KALMAN_CONFIG noise and lifecycle keys) to (low, high) for a uniform
+# range, (low, high, 'log') for a log-uniform range, or a list of values.
+
+def check_space(space):
+    """Validate a search space; raises ValueError"""
+    if not space:
+        raise ValueError("empty search space")
+    for name, spec in space.items():
+        if isinstance(spec, list):
+            values = spec
+        else:
+            if len(spec) not in (2, 3) or (len(spec) == 3 and spec[2] != 'log'):
+                raise ValueError(f"{name}: expected (low, high[, 'log']) or a list")
+            if not spec[0] < spec[1]:
+                raise ValueError(f"{name}: low must be below high")
+            if len(spec) == 3 and spec[0] <= 0:
+                raise ValueError(f"{name}: log range must be positive")
+            values = spec[:2]
+        for value in values:
+            validate_parameters({name: value})
+
+
+def from_unit(space, u):
+    """Parameters for a point u in the unit cube (one axis per parameter)"""
+    params = {}
+    for (name, spec), x in zip(space.items(), u):
+        if isinstance(spec, list):
+            params[name] = spec[min(int(x * len(spec)), len(spec) - 1)]
+            continue
+        low, high = spec[0], spec[1]
+        if len(spec) == 3:
+            value = math.exp(math.log(low) + x * (math.log(high) - math.log(low)))
+        else:
+            value = low + x * (high - low)
+        if PARAMETERS[name][0] is int:
+            value = int(round(value))
+        params[name] = value
+    return params
+
+
+def to_unit(space, params):
+    """Inverse of from_unit"""
+    u = []
+    for name, spec in space.items():
+        value = params[name]
+        if isinstance(spec, list):
+            u.append((spec.index(value) + 0.5) / len(spec))
+        elif len(spec) == 3:
+            u.append((math.log(value) - math.log(spec[0]))
+                     / (math.log(spec[1]) - math.log(spec[0])))
+        else:
+            u.append((value - spec[0]) / (spec[1] - spec[0]))
+    return np.clip(u, 0.0, 1.0)
+
+
+def grid(space, points=3):
+    """Every combination of `points` values per range (lists as given)"""
+    axes = []
+    for name, spec in space.items():
+        if isinstance(spec, list):
+            axes.append(spec)
+            continue
+        if len(spec) == 3:
+            values = np.geomspace(spec[0], spec[1], points)
+        else:
+            values = np.linspace(spec[0], spec[1], points)
+        if PARAMETERS[name][0] is int:
+            values = sorted(set(int(round(v)) for v in values))
+        else:
+            values = [float(v) for v in values]
+        axes.append(values)
+    return [dict(zip(space, combination)) for combination in itertools.product(*axes)]
+
+
+def suggest(space, history, count, rng, gamma=0.25, candidates=64):
+    """
+    Next `count` settings to evaluate given [(params, score), ...]
+
+    Tree-structured Parzen estimator style: the evaluated settings are
+    split into the best gamma fraction and the rest, candidates are drawn
+    around the good ones, and those most likely under the good density
+    relative to the bad one are chosen. Random until there is a history.
+    """
+    d = len(space)
+    seen = {json.dumps(params, sort_keys=True) for params, _ in history}
+    if len(history) < max(10, 2 * d):
+        points = rng.random((count * 4, d))
+    else:
+        u = np.array([to_unit(space, params) for params, _ in history])
+        order = np.argsort([-score for _, score in history])
+        n_good = max(1, int(math.ceil(gamma * len(history))))
+        good, bad = u[order[:n_good]], u[order[n_good:]]
+        bandwidth = max(0.05, len(history) ** (-1.0 / (d + 4)) * 0.5)
+
+        centres = good[rng.integers(len(good), size=count * candidates)]
+        points = np.clip(centres + rng.normal(0.0, bandwidth, centres.shape), 0.0, 1.0)
+
+        def density(x, samples):
+            d2 = ((x[:, None, :] - samples[None, :, :]) ** 2).sum(axis=2)
+            return np.exp(-0.5 * d2 / bandwidth ** 2).mean(axis=1) + 1e-12
+
+        points = points[np.argsort(-density(points, good) / density(points, bad))]
+
+    chosen = []
+    for x in points:
+        params = from_unit(space, x)
+        key = json.dumps(params, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            chosen.append(params)
+            if len(chosen) == count:
+                break
+    return chosen
+
+
+# Evaluation -----------------------------------------------------------------
+
+def load_sequence(sequence):
+    """(frames, timestamps, truth) of a sequence spec, memory-mapped"""
+    frames_path, timestamps_path = recording_paths(sequence['path'])
+    truth_file = truth_path(sequence['path'])
+    if not os.path.exists(truth_file):
+        raise ValueError(f"no ground truth for {sequence['path']} ({truth_file})")
+    return (np.load(frames_path, mmap_mode='r'), np.load(timestamps_path, mmap_mode='r'),
+            np.load(truth_file))
+
+
+def track_sequence(params, sequence, match_px=4.0, warmup=10):
+    """
+    Run the tracker with params over one sequence and count against truth
+
+    Confirmed tracks (the ones sent to the FPGA) are matched one-to-one to
+    ground-truth droplets within match_px pixels every frame. Returns raw
+    counts, which score() turns into rates over all sequences.
+    """
+    from thermal_droplet_tracker import ThermalDropletTracker
+
+    frames, timestamps, truth = load_sequence(sequence)
+    tracker = ThermalDropletTracker(frame_source=FrameSource())
+    tracker.pixel_to_mm = sequence['pixel_to_mm']
+    tracker.configure_kalman(sequence['kalman'])
+    apply_parameters(tracker, params)
+
+    height, width = frames.shape[1:]
+    first = int(truth['frame'][0])
+    bounds = np.searchsorted(truth['frame'], np.arange(first, first + len(frames) + 1))
+    compute_ns = np.zeros(len(frames), dtype=np.int64)
+    last_track = {}     # Truth ID → track ID it was last matched to
+    counts = dict.fromkeys(('truth', 'matched', 'switches', 'false', 'frames'), 0)
+    squared_error = 0.0
+    truth_ids = set()
+
+    try:
+        for i, frame in enumerate(frames):
+            t0 = time.perf_counter_ns()
+            tracker.track_frame(frame, int(timestamps[i]))
+            compute_ns[i] = time.perf_counter_ns() - t0
+
+            bank = tracker.trackers
+            confirmed = bank.confirmed(tracker.min_track_age)
+            track_ids = bank.track_ids()[confirmed]
+            tracks_px = tracker.mm_to_pixel(bank.positions()[confirmed])
+
+            # Truth positions are continuous, with pixel i spanning [i, i+1)
+            rows = truth[bounds[i]:bounds[i + 1]]
+            truth_px = np.column_stack([rows['x'], rows['y']]) - 0.5
+            r = rows['radius']
+            visible = ((rows['x'] - r >= 0) & (rows['x'] + r <= width)
+                       & (rows['y'] - r >= 0) & (rows['y'] + r <= height))
+
+            matched_truth = np.zeros(len(rows), dtype=bool)
+            matched_tracks = np.zeros(len(track_ids), dtype=bool)
+            if len(rows) and len(track_ids):
+                dist = np.hypot(*(truth_px[:, None, :] - tracks_px[None, :, :]).transpose(2, 0, 1))
+                ti, ki = linear_sum_assignment(dist)
+                keep = dist[ti, ki] <= match_px
+                for t, k in zip(ti[keep].tolist(), ki[keep].tolist()):
+                    matched_truth[t] = matched_tracks[k] = True
+                    if not visible[t]:
+                        continue
+                    truth_id, track_id = int(rows['id'][t]), int(track_ids[k])
+                    if last_track.get(truth_id, track_id) != track_id:
+                        counts['switches'] += 1
+                    last_track[truth_id] = track_id
+                    squared_error += (dist[t, k] * tracker.pixel_to_mm) ** 2
+
+            counts['truth'] += int(visible.sum())
+            counts['matched'] += int((matched_truth & visible).sum())
+            # Tracks coasting outside the image have no truth left to match
+            inside = ((tracks_px[:, 0] >= 0) & (tracks_px[:, 0] < width)
+                      & (tracks_px[:, 1] >= 0) & (tracks_px[:, 1] < height))
+            counts['false'] += int((~matched_tracks & inside).sum())
+            truth_ids.update(rows['id'][visible].tolist())
+    finally:
+        tracker.cleanup()
+
+    counts['frames'] = len(frames)
+    counts['truth_tracks'] = len(truth_ids)
+    counts['squared_error_mm2'] = squared_error
+    counts['compute_ns'] = compute_ns[min(warmup, len(frames) - 1):]
+    return counts
+
+
+def score(counts, weights):
+    """Metrics and weighted score (higher is better) from summed counts"""
+    compute_ms = counts['compute_ns'] / 1e6
+    metrics = {
+        # Visible droplet-frames covered by a confirmed track
+        'continuity': counts['matched'] / max(counts['truth'], 1),
+        # Track ID changes per ground-truth droplet
+        'id_switches': counts['switches'] / max(counts['truth_tracks'], 1),
+        'position_error_mm': math.sqrt(counts['squared_error_mm2'] / max(counts['matched'], 1)),
+        # Confirmed track-frames with no droplet under them
+        'false_tracks': counts['false'] / max(counts['matched'] + counts['false'], 1),
+        'compute_p50_ms': float(np.percentile(compute_ms, 50)),
+        'compute_p99_ms': float(np.percentile(compute_ms, 99)),
+    }
+    total = (weights['continuity'] * metrics['continuity']
+             - weights['id_switches'] * metrics['id_switches']
+             - weights['position_error_mm'] * metrics['position_error_mm']
+             - weights['false_tracks'] * metrics['false_tracks']
+             - weights['compute_ms'] * metrics['compute_p99_ms'])
+    return metrics, total
+
+
+_worker = {}
+
+
+def init_worker(sequences, weights, match_px, warmup):
+    """Pool initializer: keep the evaluation settings in the worker"""
+    try:
+        import cv2
+        cv2.setNumThreads(1)  # One core per worker process
+    except ImportError:
+        pass
+    _worker.update(sequences=sequences, weights=weights, match_px=match_px, warmup=warmup)
+
+
+def evaluate(params):
+    """Score one setting over every sequence (runs in a pool worker)"""
+    total = None
+    for sequence in _worker['sequences']:
+        counts = track_sequence(params, sequence, _worker['match_px'], _worker['warmup'])
+        if total is None:
+            total = counts
+        else:
+            for key, value in counts.items():
+                total[key] = (np.concatenate([total[key], value])
+                              if key == 'compute_ns' else total[key] + value)
+    metrics, value = score(total, _worker['weights'])
+    return {'score': value, 'metrics': metrics, 'parameters': params}
+
+
+def tune(space, sequences, weights, search='bayes', trials=64, grid_points=3,
+         workers=None, match_px=4.0, warmup=10, seed=0, progress=None):
+    """
+    Evaluate settings of space on a process pool; results best first
+    search='grid' evaluates every grid point, 'bayes' `trials` settings
+    proposed by suggest() in batches of one per worker
+    """
+    check_space(space)
+    workers = workers or os.cpu_count() or 1
+    rng = np.random.default_rng(seed)
+    results = []
+
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=init_worker,
+                      initargs=(sequences, weights, match_px, warmup)) as pool:
+        if search == 'grid':
+            for result in pool.imap_unordered(evaluate, grid(space, grid_points)):
+                results.append(result)
+                if progress:
+                    progress(result, len(results))
+        else:
+            while len(results) < trials:
+                history = [(r['parameters'], r['score']) for r in results]
+                batch = suggest(space, history, min(workers, trials - len(results)), rng)
+                if not batch:
+                    break  # Space exhausted (lists only)
+                for result in pool.imap_unordered(evaluate, batch):
+                    results.append(result)
+                    if progress:
+                        progress(result, len(results))
+
+    results.sort(key=lambda r: -r['score'])
+    for rank, result in enumerate(results, 1):
+        result['rank'] = rank
+    return results
+
+
+# Parameter files ------------------------------------------------------------
+
+def save_ranking(path, results, **info):
+    """Write ranked results; the tracker loads them with load_tuned_parameters()"""
+    data = dict(format=TUNING_FORMAT, created=time.strftime('%Y-%m-%d %H:%M:%S'),
+                **info)
+    data['results'] = [{'rank': r['rank'], 'score': r['score'], 'metrics': r['metrics'],
+                        'parameters': r['parameters']} for r in results]
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def load_tuned_parameters(path, rank=1):
+    """
+    Validated parameters of one rank of a tuning file
+    Names are control_server.PARAMETERS (the KALMAN_CONFIG keys for the
+    filter noise and track lifecycle), so they apply with apply_parameters()
+    or update a KALMAN_CONFIG dict for configure_kalman()
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if data.get('format') != TUNING_FORMAT:
+        raise ValueError(f"{path}: unsupported tuning file format {data.get('format')}")
+    for result in data['results']:
+        if result['rank'] == rank:
+            return validate_parameters(result['parameters'])
+    raise ValueError(f"{path}: no rank {rank} ({len(data['results'])} results)")
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Prediction-guided region-of-interest detection
+Once droplets are tracked, only the pixels around each track's predicted
+position and the entry band under the crucible outlets are thresholded
+and labelled, with periodic full-frame sweeps to catch everything else
+"""
+
+import numpy as np
+import cv2
+
+# Why a frame was detected with a full-frame sweep instead of ROIs
+SWEEP_REASONS = (
+    'scheduled',   # sweep_interval frames since the last sweep
+    'no_tracks',   # No tracks (in view) to predict from
+    'hot_region',  # Strided check found a large hot area outside the ROIs
+    'coverage',    # ROIs cover too much of the frame to be worth it
+    'edge',        # A blob was cut by a region edge
+)
+
+
+class RoiDetector:
+    """
+    Detects droplets in windows around Kalman-predicted track positions
+
+    Each window is centred on the track's one-step-ahead prediction and
+    extends sigma_scale standard deviations of its innovation covariance
+    plus a margin (pixels) for the droplet itself. Windows and the entry
+    band (the top entry_band rows, where droplets fall into view) are marked
+    on a grid of cell×cell pixel blocks, and each connected group of marked
+    cells becomes one region. The regions are packed side by side into a
+    mosaic buffer, which is thresholded and labelled in a single pass.
+
+    Every cell-th pixel of every cell-th row is also compared with the
+    threshold, and the marked cells are grown by hot_margin cells around
+    each hot sample. Hot samples outside the windows and band (a droplet
+    off its prediction, or one too small to be detected yet) are thus
+    examined locally; more than max_hot_cells of them is an unexpected hot
+    region and triggers a full-frame sweep.
+
+    While defer_sweeps is set (the pipeline is shedding load) scheduled
+    sweeps wait, up to one more sweep_interval; sweeps for the other
+    reasons still run.
+    """
+
+    def __init__(self, tracker, sweep_interval=30, entry_band=16,
+                 sigma_scale=3.0, margin=6, max_half_size=48, cell=4,
+                 hot_margin=2, max_hot_cells=8, max_coverage=0.5):
+        self.tracker = tracker
+        self.sweep_interval = sweep_interval  # Frames between full sweeps
+        self.entry_band = entry_band          # Rows (pixels)
+        self.sigma_scale = sigma_scale
+        self.margin = margin                  # Pixels
+        self.max_half_size = max_half_size    # Pixels
+        self.cell = cell                      # Pixels
+        self.hot_margin = hot_margin          # Cells grown around hot samples
+        self.max_hot_cells = max_hot_cells
+        size = 2 * hot_margin + 1
+        self._grow_kernel = np.ones((size, size), np.uint8)
+        self._open_kernel = np.ones((3, 3), np.uint8)
+        self.max_coverage = max_coverage      # Fraction of frame
+        self._cells = None
+        self._mosaic = None
+        self.since_sweep = 0
+        self.defer_sweeps = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.frames = 0
+        self.roi_frames = 0
+        self.sweeps = dict.fromkeys(SWEEP_REASONS, 0)
+        self.hits = 0
+        self.misses = 0
+        self.stray_hot = 0
+        self.sweep_outside = 0
+        self.deferred = 0
+        self.pixels_processed = 0
+        self.pixels_total = 0
+
+    def stats(self):
+        """
+        ROI hit/miss statistics
+        A hit is a tracked droplet found inside its predicted window.
+        stray_hot counts ROI frames that had to grow around hot samples
+        outside the windows. sweep_outside counts detections a full sweep
+        found outside every window: droplets ROI detection missed until
+        the sweep, the main input for tuning sweep_interval. deferred
+        counts frames a due scheduled sweep was put off under load.
+        """
+        predicted = self.hits + self.misses
+        return {
+            'frames': self.frames,
+            'roi_frames': self.roi_frames,
+            'full_sweeps': sum(self.sweeps.values()),
+            'sweep_reasons': dict(self.sweeps),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / predicted if predicted else 0.0,
+            'stray_hot': self.stray_hot,
+            'sweep_outside': self.sweep_outside,
+            'deferred': self.deferred,
+            'pixel_fraction': (self.pixels_processed / self.pixels_total
+                               if self.pixels_total else 0.0),
+        }
+
+    def windows(self):
+        """Pixel windows (x0, y0, x1, y1) around predicted track positions"""
+        tracker = self.tracker
+        xy, cov = tracker.trackers.predicted_positions()
+        centre = tracker.mm_to_pixel(xy)
+        half = np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+        half *= self.sigma_scale / tracker.pixel_to_mm
+        half += self.margin
+        np.minimum(half, self.max_half_size, out=half)
+        bounds = np.concatenate([centre - half, centre + half + 1], axis=1)
+        return np.floor(bounds).astype(np.intp)
+
+    def mark_cells(self, windows, shape):
+        """Boolean cell grid covering the entry band and the windows"""
+        c = self.cell
+        grid = (-(-shape[0] // c), -(-shape[1] // c))
+        if self._cells is None or self._cells.shape != grid:
+            self._cells = np.zeros(grid, dtype=bool)
+        cells = self._cells
+        cells.fill(False)
+        cells[:-(-self.entry_band // c)] = True
+
+        lo = np.maximum(windows[:, :2] // c, 0)
+        hi = np.maximum(-(-windows[:, 2:] // c), 0)
+        for (x0, y0), (x1, y1) in zip(lo.tolist(), hi.tolist()):
+            cells[y0:y1, x0:x1] = True
+        return cells
+
+    def detect(self, thermal_frame):
+        """Detect droplets, falling back to a full-frame sweep when needed"""
+        tracker = self.tracker
+        self.frames += 1
+        self.pixels_total += thermal_frame.size
+        self.since_sweep += 1
+
+        if len(tracker.trackers) == 0:
+            return self._sweep(thermal_frame, 'no_tracks', None)
+
+        windows = self.windows()
+        if self.since_sweep >= self.sweep_interval:
+            if not self.defer_sweeps or self.since_sweep >= 2 * self.sweep_interval:
+                return self._sweep(thermal_frame, 'scheduled', windows)
+            self.deferred += 1
+
+        cells = self.mark_cells(windows, thermal_frame.shape)
+        if not cells.any():
+            return self._sweep(thermal_frame, 'no_tracks', windows)
+
+        # Strided hot-pixel check; stray samples lie outside every ROI
+        c = self.cell
+        threshold = tracker.pixel_thresholds()
+        if isinstance(threshold, np.ndarray):
+            threshold = threshold[::c, ::c]
+        hot = thermal_frame[::c, ::c] >= threshold
+        num_stray = np.count_nonzero(hot & ~cells)
+        if num_stray > self.max_hot_cells:
+            return self._sweep(thermal_frame, 'hot_region', windows)
+        if num_stray:
+            self.stray_hot += 1
+
+        # Grow the ROIs around every hot sample, so droplets off their
+        # prediction or straddling a window or band edge are not cut
+        cells |= cv2.dilate(hot.view(np.uint8), self._grow_kernel).view(bool)
+
+        if np.count_nonzero(cells) > self.max_coverage * cells.size:
+            return self._sweep(thermal_frame, 'coverage', windows)
+
+        detections = self._detect_regions(thermal_frame, cells)
+        if detections is None:
+            return self._sweep(thermal_frame, 'edge', windows)
+
+        self.roi_frames += 1
+        self._count_hits(windows, detections)
+        return detections
+
+    def regions(self, cells, shape):
+        """Pixel rectangles (x0, y0, x1, y1) of connected marked cells, and the cell labels"""
+        c = self.cell
+        _, labels, boxes, _ = cv2.connectedComponentsWithStats(
+            cells.view(np.uint8), connectivity=8, ltype=cv2.CV_32S
+        )
+        boxes = boxes[1:, :4] * c
+        boxes[:, 2:] += boxes[:, :2]
+        np.minimum(boxes[:, 2:], (shape[1], shape[0]), out=boxes[:, 2:])
+        return boxes, labels
+
+    def pack(self, rects, width):
+        """
+        Shelf-pack region rectangles into a mosaic of the given width
+        Regions are separated by one empty row/column so blobs cannot join
+        across them. Returns (mosaic x, mosaic y) per region and the
+        mosaic height.
+        """
+        sizes = rects[:, 2:] - rects[:, :2]
+        placed = np.zeros((len(rects), 2), dtype=np.intp)
+        shelf_y = shelf_h = x = 0
+        for i in np.argsort(-sizes[:, 1], kind='stable').tolist():
+            w, h = sizes[i].tolist()
+            if x and x + w > width:
+                shelf_y += shelf_h + 1
+                shelf_h = x = 0
+            placed[i] = (x, shelf_y)
+            x += w + 1
+            shelf_h = max(shelf_h, h)
+        return placed, shelf_y + shelf_h
+
+    def _detect_regions(self, thermal_frame, cells):
+        """
+        Detect inside every region with one labelling pass over a mosaic
+        Each region is thresholded and opened with two pixels of frame
+        context, so its mask matches full-frame detection, then copied
+        into the mosaic. Returns None if the regions do not fit the mosaic
+        or a blob touches a region edge inside the frame (its statistics
+        would be computed from a truncated blob)
+        """
+        tracker = self.tracker
+        height, width = thermal_frame.shape
+        rects, _ = self.regions(cells, thermal_frame.shape)
+        placed, mosaic_height = self.pack(rects, width)
+        if mosaic_height > height:
+            return None
+
+        if self._mosaic is None or self._mosaic.shape != thermal_frame.shape:
+            self._mosaic = np.zeros(thermal_frame.shape, dtype=thermal_frame.dtype)
+            self._mosaic_mask = np.zeros(thermal_frame.shape, dtype=np.uint8)
+            self._mosaic_index = np.zeros(thermal_frame.shape, dtype=np.intp)
+            self._frame_index = np.arange(thermal_frame.size).reshape(thermal_frame.shape)
+        mosaic = self._mosaic[:mosaic_height]
+        # Frame pixel of each mosaic pixel, for per-pixel sensor correction
+        index = self._mosaic_index[:mosaic_height] if tracker.sensor is not None else None
+        binary = self._mosaic_mask[:mosaic_height]
+        binary.fill(0)
+
+        threshold = tracker.pixel_thresholds()
+        per_pixel = isinstance(threshold, np.ndarray)
+        kernel = self._open_kernel
+        for (x0, y0, x1, y1), (mx, my) in zip(rects.tolist(), placed.tolist()):
+            cx0, cy0 = max(x0 - 2, 0), max(y0 - 2, 0)
+            around = np.s_[cy0:min(y1 + 2, height), cx0:min(x1 + 2, width)]
+            context = np.greater_equal(
+                thermal_frame[around],
+                threshold[around] if per_pixel else threshold
+            )
+            opened = cv2.morphologyEx(context.view(np.uint8), cv2.MORPH_OPEN, kernel)
+            h, w = y1 - y0, x1 - x0
+            binary[my:my + h, mx:mx + w] = opened[y0 - cy0:y1 - cy0, x0 - cx0:x1 - cx0]
+            mosaic[my:my + h, mx:mx + w] = thermal_frame[y0:y1, x0:x1]
+            if index is not None:
+                index[my:my + h, mx:mx + w] = self._frame_index[y0:y1, x0:x1]
+            self.pixels_processed += h * w
+
+        detections = tracker.extract_blobs(binary, mosaic, index)
+        if len(detections) == 0:
+            return detections
+        sizes = rects[:, 2:] - rects[:, :2]
+
+        # Region of each blob, from its bounding box corner in the mosaic
+        bx0, by0 = detections['bbox_x'], detections['bbox_y']
+        inside = ((bx0[:, None] >= placed[:, 0]) & (by0[:, None] >= placed[:, 1])
+                  & (bx0[:, None] < placed[:, 0] + sizes[:, 0])
+                  & (by0[:, None] < placed[:, 1] + sizes[:, 1]))
+        region = np.argmax(inside, axis=1)
+        lo = placed[region]
+        hi = lo + sizes[region]
+        origin = rects[region, :2]
+        cut = (((bx0 == lo[:, 0]) & (origin[:, 0] > 0))
+               | ((by0 == lo[:, 1]) & (origin[:, 1] > 0))
+               | ((bx0 + detections['bbox_w'] == hi[:, 0]) & (rects[region, 2] < width))
+               | ((by0 + detections['bbox_h'] == hi[:, 1]) & (rects[region, 3] < height)))
+        if np.any(cut):
+            return None
+
+        # Mosaic → frame coordinates
+        shift = origin - lo
+        detections['pixel_x'] += shift[:, 0]
+        detections['pixel_y'] += shift[:, 1]
+        detections['bbox_x'] += shift[:, 0]
+        detections['bbox_y'] += shift[:, 1]
+        detections['x'], detections['y'] = tracker.pixel_to_position(
+            detections['pixel_x'], detections['pixel_y']
+        )
+
+        # Bounding rectangles of neighbouring regions can overlap, and a blob
+        # inside several of them is found (uncut) in each; keep the copy from
+        # the first region whose rectangle holds the whole blob
+        bx0, by0 = detections['bbox_x'], detections['bbox_y']
+        bx1, by1 = bx0 + detections['bbox_w'], by0 + detections['bbox_h']
+        holds = ((bx0[:, None] >= rects[:, 0]) & (by0[:, None] >= rects[:, 1])
+                 & (bx1[:, None] <= rects[:, 2]) & (by1[:, None] <= rects[:, 3]))
+        return detections[np.argmax(holds, axis=1) == region]
+
+    def _sweep(self, thermal_frame, reason, windows):
+        """Full-frame detection, scoring the windows it would have used"""
+        self.sweeps[reason] += 1
+        self.since_sweep = 0
+        self.pixels_processed += thermal_frame.size
+        detections = self.tracker.detect_full_frame(thermal_frame)
+        if windows is not None:
+            inside = self._count_hits(windows, detections)
+            self.sweep_outside += int(len(detections) - np.count_nonzero(inside))
+        return detections
+
+    def _count_hits(self, windows, detections):
+        """Update hit/miss counts; returns which detections lie in a window"""
+        px = detections['pixel_x']
+        py = detections['pixel_y']
+        inside = ((px >= windows[:, 0:1]) & (px < windows[:, 2:3])
+                  & (py >= windows[:, 1:2]) & (py < windows[:, 3:4]))
+        found = int(np.count_nonzero(inside.any(axis=1)))
+        self.hits += found
+        self.misses += len(windows) - found
+        return inside.any(axis=0)
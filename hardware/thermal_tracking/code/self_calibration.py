@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Online pixel-to-mm calibration from falling droplets
+Droplets in free fall accelerate at g, so the acceleration of confirmed
+tracks in pixels/s² measures the image scale (and the direction of
+gravity in the image, the camera tilt) while production runs. A camera
+that was bumped is recalibrated without stopping for a heated target.
+"""
+
+import math
+import threading
+import numpy as np
+
+from motion_model import BallisticModel
+
+# Standard gravity (mm/s²)
+GRAVITY_MM_S2 = 9810.0
+
+# One detection matched to a track (raw pixel centroid)
+OBSERVATION_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('t', '<f8'),   # Tracker time (s, sum of frame intervals)
+    ('px', '<f8'),
+    ('py', '<f8'),
+])
+
+# Result of one fit over the track history
+ESTIMATE_DTYPE = np.dtype([
+    ('pixel_to_mm', '<f8'),
+    ('spread', '<f8'),        # Relative standard deviation of the track scales
+    ('tilt_deg', '<f8'),      # Gravity direction from image +y, towards +x
+    ('tracks', '<i4'),        # Tracks used
+    ('rejected', '<i4'),      # Tracks fitted but rejected as outliers
+])
+
+
+def fit_track_acceleration(t, px, py, drag=0.0):
+    """
+    Least-squares (ax, ay) in pixels/s² and RMS residual (pixels) of one track
+    Positions follow the ballistic model, p(t) = p0 + v0 reach(t) +
+    a shift(t), which is linear in p0, v0 and a for a known drag.
+    """
+    tau = t - t[0]
+    if drag > 0:
+        reach = -np.expm1(-drag * tau) / drag
+        shift = (tau - reach) / drag
+    else:
+        reach, shift = tau, 0.5 * tau * tau
+    basis = np.column_stack([np.ones_like(tau), reach, shift])
+    points = np.column_stack([px, py])
+    coeffs, _, rank, _ = np.linalg.lstsq(basis, points, rcond=None)
+    if rank < 3:
+        return None, np.inf
+    residual = points - basis @ coeffs
+    return coeffs[2], float(np.sqrt(np.mean(np.sum(residual ** 2, axis=1))))
+
+
+class SelfCalibrator:
+    """
+    Background estimator of pixel_to_mm (and tilt) from confirmed tracks
+
+    observe() runs on the processing thread and copies the raw pixel
+    centroids matched to tracks into a preallocated ring. A worker thread
+    fits every `interval` seconds: each track with at least min_points
+    matches (so a confirmed track) over min_duration seconds gets its
+    acceleration, tracks that do not fall freely (large residuals, odd
+    direction or magnitude, e.g. acoustically steered droplets) are
+    rejected, and the remaining tracks' scales g / |a| are averaged. An
+    estimate agreeing across min_tracks tracks and differing from the
+    running scale by more than min_change is published as one object; the
+    processing thread adopts it between frames in apply(), rescaling the
+    live tracks so that every frame sees a single calibration.
+    """
+
+    def __init__(self, tracker, capacity=8192, interval=10.0, min_points=8,
+                 min_duration=0.1, max_residual_px=0.5, min_tracks=10,
+                 max_spread=0.03, min_change=0.005, max_change=0.25,
+                 max_tilt_spread_deg=5.0, estimate_tilt=False,
+                 min_tilt_change_deg=0.5, gravity_mm_s2=GRAVITY_MM_S2):
+        self.tracker = tracker
+        self.interval = interval
+        self.min_points = min_points
+        self.min_duration = min_duration
+        self.max_residual_px = max_residual_px
+        self.min_tracks = min_tracks
+        self.max_spread = max_spread
+        self.min_change = min_change        # Relative change worth publishing
+        self.max_change = max_change        # Larger changes are not trusted
+        self.max_tilt_spread_deg = max_tilt_spread_deg
+        self.estimate_tilt = estimate_tilt  # Also turn the ballistic gravity vector
+        self.min_tilt_change_deg = min_tilt_change_deg
+        self.gravity_mm_s2 = gravity_mm_s2
+
+        self.history = np.zeros(capacity, dtype=OBSERVATION_DTYPE)
+        self.observed = 0  # Observations written (ring position = observed % capacity)
+        self._lock = threading.Lock()
+
+        self.last_estimate = None   # Most recent fit (ESTIMATE_DTYPE record)
+        self.pending = None         # Estimate waiting for apply()
+        self.fits = 0
+        self.published = 0
+        self.applied = 0
+        self._stop = threading.Event()
+        self.thread = None
+
+    # Processing thread ---------------------------------------------------
+
+    def observe(self, t, track_ids, px, py):
+        """Add the pixel centroids matched to tracks at time t"""
+        n = len(track_ids)
+        if n == 0:
+            return
+        capacity = len(self.history)
+        with self._lock:
+            start = self.observed % capacity
+            end = min(start + n, capacity)
+            rows = self.history[start:end]
+            rows['id'] = track_ids[:end - start]
+            rows['t'] = t
+            rows['px'] = px[:end - start]
+            rows['py'] = py[:end - start]
+            if end - start < n:
+                rest = self.history[:n - (end - start)]
+                rest['id'] = track_ids[end - start:]
+                rest['t'] = t
+                rest['px'] = px[end - start:]
+                rest['py'] = py[end - start:]
+            self.observed += n
+
+    def apply(self):
+        """Adopt a published estimate (call between frames); True if applied"""
+        estimate = self.pending
+        if estimate is None:
+            return False
+        self.pending = None
+        tracker = self.tracker
+        scale = float(estimate['pixel_to_mm'])
+        tracker.trackers.rescale(scale / tracker.pixel_to_mm)
+        tracker.pixel_to_mm = scale
+        model = tracker.trackers.model
+        if self.estimate_tilt and isinstance(model, BallisticModel):
+            tilt = math.radians(float(estimate['tilt_deg']))
+            g = float(np.hypot(*model.gravity))
+            tracker.trackers.set_motion_model(BallisticModel(
+                (g * math.sin(tilt), g * math.cos(tilt)), model.drag))
+        self.applied += 1
+        return True
+
+    # Worker thread -------------------------------------------------------
+
+    def start(self):
+        """Fit in the background every interval seconds"""
+        if self.thread is not None:
+            return
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._run, name='self-calibration',
+                                       daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.update()
+            except Exception as e:
+                print(f"Self-calibration error: {e}")
+
+    def snapshot(self):
+        """Copy of the observations in the ring, oldest first"""
+        capacity = len(self.history)
+        with self._lock:
+            if self.observed <= capacity:
+                return self.history[:self.observed].copy()
+            start = self.observed % capacity
+            return np.concatenate([self.history[start:], self.history[:start]])
+
+    def update(self):
+        """Fit the current history and publish the estimate if it is trusted"""
+        estimate = self.estimate(self.snapshot())
+        self.fits += 1
+        if estimate is None:
+            return None
+        self.last_estimate = estimate
+        current = self.tracker.pixel_to_mm
+        change = abs(estimate['pixel_to_mm'] / current - 1.0)
+        model = self.tracker.trackers.model
+        tilt_change = 0.0
+        if self.estimate_tilt and isinstance(model, BallisticModel):
+            gx, gy = model.gravity
+            tilt_change = abs(estimate['tilt_deg'] - math.degrees(math.atan2(gx, gy)))
+        if (estimate['tracks'] >= self.min_tracks
+                and estimate['spread'] <= self.max_spread
+                and change <= self.max_change
+                and (change >= self.min_change
+                     or tilt_change >= self.min_tilt_change_deg)):
+            self.pending = estimate
+            self.published += 1
+        return estimate
+
+    def estimate(self, observations):
+        """ESTIMATE_DTYPE record from an observation array, None if no track qualifies"""
+        if len(observations) == 0:
+            return None
+        model = self.tracker.trackers.model
+        drag = model.drag if isinstance(model, BallisticModel) else 0.0
+
+        order = np.lexsort((observations['t'], observations['id']))
+        observations = observations[order]
+        ids = observations['id']
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        ends = np.r_[starts[1:], len(ids)]
+
+        accelerations = []
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            if end - start < self.min_points:
+                continue
+            track = observations[start:end]
+            if track['t'][-1] - track['t'][0] < self.min_duration:
+                continue
+            a, rms = fit_track_acceleration(track['t'], track['px'], track['py'], drag)
+            if a is not None and rms <= self.max_residual_px:
+                accelerations.append(a)
+        if not accelerations:
+            return None
+
+        a = np.array(accelerations)
+        scales = self.gravity_mm_s2 / np.hypot(a[:, 0], a[:, 1])
+        tilts = np.degrees(np.arctan2(a[:, 0], a[:, 1]))
+
+        # Reject tracks off the median direction or magnitude (steered droplets)
+        median = np.median(scales)
+        mad = np.median(np.abs(scales - median)) * 1.4826
+        keep = np.abs(tilts - np.median(tilts)) <= self.max_tilt_spread_deg
+        keep &= np.abs(scales - median) <= max(3 * mad, 1e-3 * median)
+
+        estimate = np.zeros((), dtype=ESTIMATE_DTYPE)
+        estimate['tracks'] = int(keep.sum())
+        estimate['rejected'] = len(scales) - int(keep.sum())
+        estimate['pixel_to_mm'] = scales[keep].mean()
+        estimate['spread'] = (scales[keep].std() / scales[keep].mean()
+                              if keep.sum() > 1 else np.inf)
+        estimate['tilt_deg'] = tilts[keep].mean()
+        return estimate
+
+    def stats(self):
+        estimate = self.last_estimate
+        return {
+            'observations': self.observed,
+            'fits': self.fits,
+            'published': self.published,
+            'applied': self.applied,
+            'pixel_to_mm': None if estimate is None else float(estimate['pixel_to_mm']),
+            'spread': None if estimate is None else float(estimate['spread']),
+            'tilt_deg': None if estimate is None else float(estimate['tilt_deg']),
+            'tracks': 0 if estimate is None else int(estimate['tracks']),
+            'rejected': 0 if estimate is None else int(estimate['rejected']),
+        }
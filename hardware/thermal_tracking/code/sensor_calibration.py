@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Sensor calibration model: lens distortion, non-uniformity and emissivity
+Everything is precomputed into lookup grids stored as .npy files and
+memory-mapped, and only blob pixels and centroids are corrected, so a
+frame costs a few gathers per blob instead of a full-frame remap. Each
+calibration is an immutable version directory; publishing a new version
+switches the CURRENT pointer, which a running tracker picks up between
+frames.
+"""
+
+import os
+import json
+import time
+import threading
+import numpy as np
+
+from thermal_droplet_tracker import SENSOR_COUNTS
+
+# Version directory layout
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+CURRENT = 'CURRENT'
+
+# Second radiation constant (µm·K) and the A35 band centre (7.5-13 µm)
+PLANCK_C2 = 14388.0
+BAND_CENTER_UM = 10.0
+
+
+def version_name(version):
+    return f"v{version:04d}"
+
+
+def planck_radiance(temp_kelvin, wavelength_um=BAND_CENTER_UM):
+    """Relative spectral radiance 1 / (exp(c2 / λT) - 1), negligible below 50 K"""
+    return 1.0 / np.expm1(PLANCK_C2 / (wavelength_um * np.maximum(temp_kelvin, 50.0)))
+
+
+def emissivity_lut(apparent_lut, emissivity, reflected_temp=25.0,
+                   wavelength_um=BAND_CENTER_UM):
+    """
+    Count → object temperature (°C) for a surface of the given emissivity
+    apparent_lut holds the camera's blackbody temperatures per count. The
+    radiance seen is ε L(T_object) + (1 - ε) L(T_reflected); solving for
+    T_object at the band centre keeps the table monotonic, so thresholds
+    still come from a binary search.
+    """
+    apparent = planck_radiance(np.asarray(apparent_lut, dtype=float) + 273.15, wavelength_um)
+    reflected = planck_radiance(reflected_temp + 273.15, wavelength_um)
+    radiance = (apparent - (1.0 - emissivity) * reflected) / emissivity
+    radiance = np.maximum(radiance, 1e-30)
+    kelvin = PLANCK_C2 / (wavelength_um * np.log1p(1.0 / radiance))
+    return (kelvin - 273.15).astype(np.float32)
+
+
+def distortion_grids(camera_matrix, dist_coeffs, shape):
+    """
+    (undistort_x, undistort_y, distort_x, distort_y) pixel grids of shape
+    (height, width): where each raw pixel lands after removing the lens
+    distortion, and where each ideal pixel is seen on the sensor
+    """
+    import cv2
+    height, width = shape
+    K = np.asarray(camera_matrix, dtype=np.float64)
+    dist = np.asarray(dist_coeffs, dtype=np.float64)
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float64)
+    points = np.column_stack([xs.ravel(), ys.ravel()])[:, None, :]
+
+    ideal = cv2.undistortPoints(points, K, dist, P=K)[:, 0, :]
+    rays = np.column_stack([(points[:, 0, 0] - K[0, 2]) / K[0, 0],
+                            (points[:, 0, 1] - K[1, 2]) / K[1, 1],
+                            np.ones(len(points))])
+    seen, _ = cv2.projectPoints(rays, np.zeros(3), np.zeros(3), K, dist)
+    seen = seen[:, 0, :]
+    grids = (ideal[:, 0], ideal[:, 1], seen[:, 0], seen[:, 1])
+    return tuple(g.reshape(height, width).astype(np.float32) for g in grids)
+
+
+def sample_grid(grid, x, y):
+    """Bilinear interpolation of a (height, width) grid at pixel positions"""
+    height, width = grid.shape
+    x = np.clip(np.asarray(x, dtype=float), 0, width - 1)
+    y = np.clip(np.asarray(y, dtype=float), 0, height - 1)
+    x0 = np.minimum(x.astype(np.intp), width - 2)
+    y0 = np.minimum(y.astype(np.intp), height - 2)
+    fx, fy = x - x0, y - y0
+    top = grid[y0, x0] * (1 - fx) + grid[y0, x0 + 1] * fx
+    bottom = grid[y0 + 1, x0] * (1 - fx) + grid[y0 + 1, x0 + 1] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+class SensorCalibration:
+    """
+    One loaded calibration version (read-only, memory-mapped grids)
+
+    Any part may be missing: without distortion grids centroids are used
+    as measured, without NUC maps counts are used raw, and materials
+    without a table use the tracker's blackbody conversion.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != FORMAT_VERSION:
+            raise ValueError(f"{path}: calibration format {self.manifest.get('format')}, "
+                             f"expected {FORMAT_VERSION}")
+        self.version = self.manifest['version']
+        width, height = self.manifest['resolution']
+        self.shape = (height, width)
+
+        def grid(name):
+            file = self.manifest['files'].get(name)
+            if file is None:
+                return None
+            array = np.load(os.path.join(path, file), mmap_mode='r')
+            expected = (SENSOR_COUNTS,) if name.startswith('lut_') else self.shape
+            if array.shape != expected:
+                raise ValueError(f"{path}: {name} is {array.shape}, expected {expected}")
+            return array
+
+        self.undistort_x = grid('undistort_x')
+        self.undistort_y = grid('undistort_y')
+        self.distort_x = grid('distort_x')
+        self.distort_y = grid('distort_y')
+        self.nuc_gain = grid('nuc_gain')
+        self.nuc_offset = grid('nuc_offset')
+        self.noise = grid('noise')  # Per-pixel temporal noise (raw counts)
+        self.emissivity = self.manifest.get('emissivity', {})
+        self.luts = {material: grid(f'lut_{material}') for material in self.emissivity
+                     if f'lut_{material}' in self.manifest['files']}
+
+    @property
+    def has_distortion(self):
+        return self.undistort_x is not None
+
+    @property
+    def has_nuc(self):
+        return self.nuc_gain is not None
+
+    def undistort(self, px, py):
+        """Raw sub-pixel positions → distortion-free pixel positions"""
+        if not self.has_distortion:
+            return px, py
+        return sample_grid(self.undistort_x, px, py), sample_grid(self.undistort_y, px, py)
+
+    def distort(self, px, py):
+        """Distortion-free pixel positions → where they appear on the sensor"""
+        if not self.has_distortion:
+            return px, py
+        return sample_grid(self.distort_x, px, py), sample_grid(self.distort_y, px, py)
+
+    def correct_counts(self, counts, pixels):
+        """Non-uniformity corrected counts of the given flat pixel indices"""
+        if not self.has_nuc:
+            return counts
+        corrected = counts * self.nuc_gain.ravel()[pixels] + self.nuc_offset.ravel()[pixels]
+        np.rint(corrected, out=corrected)
+        np.clip(corrected, 0, SENSOR_COUNTS - 1, out=corrected)
+        return corrected.astype(np.uint16)
+
+    def count_thresholds(self, threshold, sigma=0.0):
+        """
+        Per-pixel raw-count thresholds for a corrected-count threshold
+        With NUC maps a raw count passes where its corrected count reaches
+        threshold; with a noise map and sigma > 0 each pixel must also
+        clear sigma times its own noise above it.
+        """
+        target = np.full(self.shape, float(threshold), dtype=np.float32)
+        if sigma > 0 and self.noise is not None:
+            margin = sigma * np.asarray(self.noise, dtype=np.float32)
+            if self.has_nuc:
+                margin *= self.nuc_gain
+            target += margin
+        if self.has_nuc:
+            target -= self.nuc_offset
+            target /= self.nuc_gain
+        np.ceil(target, out=target)
+        np.clip(target, 0, SENSOR_COUNTS - 1, out=target)
+        return target.astype(np.uint16)
+
+    def temperature_lut(self, material):
+        """Count → temperature table for a material, None if not calibrated"""
+        lut = self.luts.get(material)
+        return None if lut is None else np.asarray(lut)
+
+    def describe(self):
+        parts = []
+        if self.has_distortion:
+            parts.append('distortion')
+        if self.has_nuc:
+            parts.append('NUC')
+        if self.noise is not None:
+            parts.append(f"noise {float(np.median(self.noise)):.1f} counts")
+        if self.luts:
+            parts.append('emissivity ' + ', '.join(
+                f"{m} {self.emissivity[m]:g}" for m in self.luts))
+        return (f"{version_name(self.version)} ({self.manifest.get('created', '?')}): "
+                + (', '.join(parts) or 'empty'))
+
+
+def save_calibration(root, resolution, camera_matrix=None, dist_coeffs=None,
+                     nuc_gain=None, nuc_offset=None, noise_map=None, apparent_lut=None,
+                     emissivity=None, reflected_temp=25.0, notes='', publish=True):
+    """
+    Write a new calibration version under root and return its directory
+    The version is the next unused number; files are written before the
+    manifest, and CURRENT is switched by an atomic rename, so readers never
+    see a partial calibration.
+    """
+    os.makedirs(root, exist_ok=True)
+    versions = [int(name[1:]) for name in os.listdir(root)
+                if name.startswith('v') and name[1:].isdigit()]
+    version = max(versions, default=0) + 1
+    path = os.path.join(root, version_name(version))
+    os.makedirs(path)
+    width, height = resolution
+
+    files = {}
+
+    def write(name, array, dtype=np.float32):
+        files[name] = f'{name}.npy'
+        np.save(os.path.join(path, files[name]), np.asarray(array, dtype=dtype))
+
+    if camera_matrix is not None:
+        grids = distortion_grids(camera_matrix, dist_coeffs, (height, width))
+        for name, grid in zip(('undistort_x', 'undistort_y', 'distort_x', 'distort_y'), grids):
+            write(name, grid)
+    if nuc_gain is not None:
+        write('nuc_gain', nuc_gain)
+        write('nuc_offset', nuc_offset)
+    if noise_map is not None:
+        write('noise', noise_map)
+    emissivity = dict(emissivity or {})
+    if emissivity:
+        if apparent_lut is None:
+            raise ValueError("emissivity tables need the camera's count → temperature table")
+        for material, value in emissivity.items():
+            write(f'lut_{material}', emissivity_lut(apparent_lut, value, reflected_temp))
+
+    manifest = {
+        'format': FORMAT_VERSION,
+        'version': version,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'camera_model': 'FLIR A35',
+        'resolution': [width, height],
+        'camera_matrix': None if camera_matrix is None else np.asarray(camera_matrix).tolist(),
+        'dist_coeffs': None if dist_coeffs is None else np.ravel(dist_coeffs).tolist(),
+        'emissivity': emissivity,
+        'reflected_temp_c': reflected_temp,
+        'wavelength_um': BAND_CENTER_UM,
+        'notes': notes,
+        'files': files,
+    }
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    if publish:
+        publish_version(root, version)
+    return path
+
+
+def publish_version(root, version):
+    """Point CURRENT at a version (atomic rename)"""
+    temp = os.path.join(root, CURRENT + '.tmp')
+    with open(temp, 'w') as f:
+        f.write(version_name(version) + '\n')
+    os.replace(temp, os.path.join(root, CURRENT))
+
+
+def current_version(root):
+    """Directory name CURRENT points at, None if there is none"""
+    try:
+        with open(os.path.join(root, CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class SensorCalibrationStore:
+    """
+    Versioned calibrations under root, reloaded while the tracker runs
+
+    A watcher thread checks CURRENT every poll_interval seconds and loads a
+    new version off the processing thread; apply() (processing thread,
+    between frames) hands it to the tracker. reload() checks immediately.
+    A version that fails to load or does not match the frame size is
+    reported and the running calibration is kept.
+    """
+
+    def __init__(self, root='calibration/sensor', poll_interval=1.0):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.loaded = None     # Directory name of the last version loaded
+        self.pending = None    # SensorCalibration waiting for apply()
+        self.reloads = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.thread = None
+
+    def reload(self):
+        """Load the CURRENT version if it changed; returns it (or None)"""
+        with self._lock:
+            name = current_version(self.root)
+            if name is None or name == self.loaded:
+                return None
+            try:
+                calibration = SensorCalibration(os.path.join(self.root, name))
+            except (OSError, ValueError, KeyError) as e:
+                self.errors += 1
+                print(f"Sensor calibration {name} not loaded: {e}")
+                self.loaded = name  # Do not retry until CURRENT changes
+                return None
+            self.loaded = name
+            self.pending = calibration
+            self.reloads += 1
+            return calibration
+
+    def apply(self, tracker):
+        """Hand a newly loaded version to the tracker (call between frames)"""
+        calibration = self.pending
+        if calibration is None:
+            return False
+        self.pending = None
+        if calibration.shape != tuple(tracker.frame_shape):
+            self.errors += 1
+            print(f"Sensor calibration {version_name(calibration.version)} is for "
+                  f"{calibration.shape[1]}x{calibration.shape[0]}, frames are "
+                  f"{tracker.frame_shape[1]}x{tracker.frame_shape[0]}; not applied")
+            return False
+        tracker.set_sensor_calibration(calibration)
+        return True
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._run, name='sensor-calibration',
+                                       daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            self.reload()
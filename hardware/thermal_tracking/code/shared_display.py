@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Shared-memory hand-off from the tracker to the visualizer process
+The processing thread publishes the latest frame, detections and track
+table into a double buffer; the display process reads whatever is newest
+at its own (decimated) rate. Neither side ever waits for the other. The
+count → temperature lookup table the detector uses is shared the same
+way, so the display follows calibration reloads and material changes.
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+from kalman_filter_bank import TRACK_DTYPE
+
+# Per-slot header; sequence is odd while the writer is filling the slot
+SLOT_HEADER_DTYPE = np.dtype([
+    ('sequence', '<u8'),
+    ('frame_id', '<i8'),
+    ('camera_timestamp', '<u8'),
+    ('track_count', '<u4'),
+    ('detection_count', '<u4'),
+])
+
+# Detection markers drawn on the thermal image
+MARKER_DTYPE = np.dtype([
+    ('pixel_x', '<f4'),
+    ('pixel_y', '<f4'),
+])
+
+# Raw 14-bit counts covered by the temperature lookup table
+LUT_SIZE = 1 << 14
+
+# Control block: [front slot, frames published, LUT generation (odd while written)]
+_CONTROL_SIZE = 3 * 8
+
+
+def _align(size, to=64):
+    return (size + to - 1) // to * to
+
+
+class DisplayBuffer:
+    """
+    Double-buffered frame + track table in POSIX shared memory
+
+    publish() (one writer thread) fills the back slot and flips it to the
+    front; read() copies the front slot and uses the slot's sequence
+    number as a seqlock to discard the rare copy that raced a write.
+    """
+
+    def __init__(self, shape, max_tracks=64, max_detections=64, name=None):
+        self.shape = tuple(shape)
+        lut_bytes = _align(LUT_SIZE * 4)
+        self.max_tracks = max_tracks
+        self.max_detections = max_detections
+
+        frame_bytes = _align(int(np.prod(self.shape)) * 2)
+        self._slot_layout = (
+            ('header', _align(SLOT_HEADER_DTYPE.itemsize)),
+            ('frame', frame_bytes),
+            ('tracks', _align(max_tracks * TRACK_DTYPE.itemsize)),
+            ('markers', _align(max_detections * MARKER_DTYPE.itemsize)),
+        )
+        slot_size = sum(size for _, size in self._slot_layout)
+        size = _align(_CONTROL_SIZE) + lut_bytes + 2 * slot_size
+
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.name = self.shm.name
+
+        buf = self.shm.buf
+        self.control = np.ndarray(3, dtype=np.int64, buffer=buf)
+        offset = _align(_CONTROL_SIZE)
+        self.lut = np.ndarray(LUT_SIZE, np.float32, buf[offset:offset + lut_bytes])
+        offset += lut_bytes
+        self.slots = []
+        for _ in range(2):
+            views = {}
+            for field, field_size in self._slot_layout:
+                views[field] = buf[offset:offset + field_size]
+                offset += field_size
+            self.slots.append({
+                'header': np.ndarray(1, SLOT_HEADER_DTYPE, views['header']),
+                'frame': np.ndarray(self.shape, np.uint16, views['frame']),
+                'tracks': np.ndarray(max_tracks, TRACK_DTYPE, views['tracks']),
+                'markers': np.ndarray(max_detections, MARKER_DTYPE, views['markers']),
+            })
+        if self.owner:
+            self.control[:] = (0, 0, 0)
+
+    @classmethod
+    def attach(cls, name, shape, max_tracks=64, max_detections=64):
+        """Open an existing buffer (display process side)"""
+        return cls(shape, max_tracks, max_detections, name=name)
+
+    def publish(self, frame, detections, tracks, frame_id, camera_timestamp=0):
+        """Write the newest frame and tracks (single writer, never blocks)"""
+        back = 1 - int(self.control[0])
+        slot = self.slots[back]
+        header = slot['header']
+        header['sequence'] += 1  # Odd: slot being written
+
+        np.copyto(slot['frame'], frame)
+        records = tracks.records[:self.max_tracks]
+        slot['tracks'][:len(records)] = records
+
+        markers = slot['markers']
+        n = min(len(detections), self.max_detections)
+        if isinstance(detections, np.ndarray):
+            markers['pixel_x'][:n] = detections['pixel_x'][:n]
+            markers['pixel_y'][:n] = detections['pixel_y'][:n]
+        else:
+            for i, det in enumerate(detections[:n]):
+                markers[i] = (det['pixel_x'], det['pixel_y'])
+
+        header['frame_id'] = frame_id
+        header['camera_timestamp'] = camera_timestamp
+        header['track_count'] = len(records)
+        header['detection_count'] = n
+        header['sequence'] += 1  # Even: slot complete
+
+        self.control[0] = back
+        self.control[1] += 1
+
+    def publish_lut(self, lut):
+        """Replace the temperature lookup table (same writer as publish())"""
+        self.control[2] += 1  # Odd: table being written
+        np.copyto(self.lut, lut)
+        self.control[2] += 1
+
+    def read_lut(self, last_generation=0):
+        """
+        Copy of the lookup table plus its generation, or None if it did not
+        change since last_generation or the copy raced the writer
+        """
+        generation = int(self.control[2])
+        if generation == last_generation or generation & 1:
+            return None
+        lut = self.lut.copy()
+        if int(self.control[2]) != generation:
+            return None
+        return lut, generation
+
+    def read(self, last_published=0):
+        """
+        Copy of the newest frame as a result dict plus its publish count,
+        or None if nothing new was published since last_published or the
+        copy raced the writer
+        """
+        published = int(self.control[1])
+        if published == last_published:
+            return None
+        slot = self.slots[int(self.control[0])]
+        header = slot['header']
+        sequence = int(header['sequence'][0])
+        if sequence & 1:
+            return None
+
+        meta = header[0].copy()
+        frame = slot['frame'].copy()
+        tracks = slot['tracks'][:meta['track_count']].copy()
+        markers = slot['markers'][:meta['detection_count']].copy()
+
+        if int(header['sequence'][0]) != sequence:
+            return None
+        return {
+            'frame': frame,
+            'detections': markers,
+            'tracks': tracks,
+            'frame_id': int(meta['frame_id']),
+            'camera_timestamp': int(meta['camera_timestamp']),
+        }, published
+
+    def close(self):
+        self.control = None
+        self.lut = None
+        self.slots = []
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _display_main(name, shape, max_tracks, max_detections,
+                  rate, save_every, save_dir, stop_event):
+    # Imported here so the tracker process never loads matplotlib
+    from thermal_visualizer import run_display
+    run_display(name, shape, max_tracks, max_detections,
+                rate, save_every, save_dir, stop_event)
+
+
+class DisplayProcess:
+    """
+    Runs ThermalVisualizer in a separate process fed by a DisplayBuffer
+    The tracker side only calls publish(); rendering, blitting and saving
+    frames happen in the child, off the GIL of the tracking threads.
+    """
+
+    def __init__(self, tracker, rate=15.0, save_every=0, save_dir='logs',
+                 max_tracks=64, max_detections=64):
+        source = tracker.frame_source
+        self.tracker = tracker
+        self.buffer = DisplayBuffer((source.height, source.width),
+                                    max_tracks, max_detections)
+        self._lut = None
+        self._publish_lut()
+        context = multiprocessing.get_context('spawn')
+        self.stop_event = context.Event()
+        self.process = context.Process(
+            target=_display_main,
+            args=(self.buffer.name, self.buffer.shape, max_tracks, max_detections,
+                  rate, save_every, save_dir, self.stop_event),
+            name='thermal-display',
+            daemon=True
+        )
+
+    def start(self):
+        self.process.start()
+
+    def _publish_lut(self):
+        """Share the tracker's lookup table if it was replaced (reload, material)"""
+        lut = self.tracker.temperature_lut
+        if lut is not self._lut:
+            self.buffer.publish_lut(lut)
+            self._lut = lut
+
+    def publish(self, frame, detections, tracks, frame_id, camera_timestamp=0):
+        self._publish_lut()
+        self.buffer.publish(frame, detections, tracks, frame_id, camera_timestamp)
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.process.pid is not None:
+            self.process.join(2.0)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.buffer.close()
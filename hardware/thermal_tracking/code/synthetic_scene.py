@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Synthetic thermal scenes of falling droplets
+Renders FLIR A35 style Mono14 frames with ground-truth tracks so the
+tracker can be benchmarked and regression-tested without hardware
+"""
+
+import json
+import time
+import numpy as np
+
+from frame_sources import FrameSource, ReplayImage, save_recording, recording_paths
+from frame_sources import A35_WIDTH, A35_HEIGHT
+
+# Ground truth record for one droplet in one frame (pixel units)
+TRUTH_DTYPE = np.dtype([
+    ('frame', '<u4'),
+    ('id', '<u4'),
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('vx', '<f4'),
+    ('vy', '<f4'),
+    ('temp', '<f4'),
+    ('radius', '<f4'),
+])
+
+
+def temperature_to_counts(temp_celsius):
+    """Inverse of ThermalDropletTracker.pixel_to_temperature (A35 linear mode)"""
+    return np.asarray(temp_celsius) / 0.04 + 8192
+
+
+class SyntheticDropletScene:
+    """
+    Generator for falling hot droplets in a 320x256 Mono14 thermal view
+
+    Droplets are released under evenly spaced crucible outlets at the top of
+    the image, fall with a configurable velocity (plus optional gravity in
+    pixels/frame²) and are replaced when they leave the frame, so the number
+    of droplets in view stays at num_droplets. With merge_distance > 0 two
+    droplets closer than that distance coalesce into one.
+    """
+
+    def __init__(self, num_droplets=5, droplet_temp=220.0, temp_spread=10.0,
+                 background_temp=25.0, radius=3.0, radius_spread=0.5,
+                 velocity=(0.0, 3.0), velocity_spread=(0.3, 0.5),
+                 gravity=0.0, noise=2.0, merge_distance=0.0,
+                 num_outlets=None, width=A35_WIDTH, height=A35_HEIGHT,
+                 frame_rate=60.0, seed=0):
+        self.num_droplets = num_droplets
+        self.droplet_temp = droplet_temp
+        self.temp_spread = temp_spread
+        self.background_temp = background_temp
+        self.radius = radius
+        self.radius_spread = radius_spread
+        self.velocity = velocity
+        self.velocity_spread = velocity_spread
+        self.gravity = gravity
+        self.noise = noise  # Sensor noise (counts, 1 sigma)
+        self.merge_distance = merge_distance
+        self.width = width
+        self.height = height
+        self.frame_rate = frame_rate
+
+        if num_outlets is None:
+            num_outlets = max(1, min(num_droplets, 25))
+        spacing = width / num_outlets
+        self.outlets = (np.arange(num_outlets) + 0.5) * spacing
+
+        self.rng = np.random.default_rng(seed)
+        self.frame_index = 0
+        self.next_id = 0
+        self.merges = 0
+
+        # Live droplet table
+        self.ids = np.zeros(0, dtype=np.uint32)
+        self.pos = np.zeros((0, 2))
+        self.vel = np.zeros((0, 2))
+        self.temps = np.zeros(0)
+        self.radii = np.zeros(0)
+
+        self._background = float(temperature_to_counts(background_temp))
+        self._spawn(num_droplets, spread_vertically=True)
+
+    def _spawn(self, count, spread_vertically=False):
+        """Release count new droplets under random outlets"""
+        if count <= 0:
+            return
+        rng = self.rng
+        x = self.outlets[rng.integers(len(self.outlets), size=count)]
+        x = x + rng.normal(0.0, 1.0, count)
+        if spread_vertically:
+            # Initial droplets are already distributed along the fall path
+            y = rng.uniform(0, self.height, count)
+        else:
+            y = -rng.uniform(0, 2 * self.radius + 1, count)
+
+        vel = np.column_stack([
+            rng.normal(self.velocity[0], self.velocity_spread[0], count),
+            np.abs(rng.normal(self.velocity[1], self.velocity_spread[1], count)),
+        ])
+
+        self.ids = np.concatenate([
+            self.ids,
+            np.arange(self.next_id, self.next_id + count, dtype=np.uint32)
+        ])
+        self.next_id += count
+        self.pos = np.vstack([self.pos, np.column_stack([x, y])])
+        self.vel = np.vstack([self.vel, vel])
+        self.temps = np.concatenate([
+            self.temps, rng.normal(self.droplet_temp, self.temp_spread, count)
+        ])
+        self.radii = np.concatenate([
+            self.radii,
+            np.clip(rng.normal(self.radius, self.radius_spread, count), 1.0, None)
+        ])
+
+    def _keep(self, mask):
+        self.ids = self.ids[mask]
+        self.pos = self.pos[mask]
+        self.vel = self.vel[mask]
+        self.temps = self.temps[mask]
+        self.radii = self.radii[mask]
+
+    def _merge(self):
+        """Coalesce droplets closer than merge_distance (volume-weighted)"""
+        n = len(self.ids)
+        if self.merge_distance <= 0 or n < 2:
+            return
+        diff = self.pos[:, None, :] - self.pos[None, :, :]
+        close = np.einsum('ijk,ijk->ij', diff, diff) < self.merge_distance ** 2
+        np.fill_diagonal(close, False)
+
+        keep = np.ones(n, dtype=bool)
+        for i, j in zip(*np.nonzero(np.triu(close))):
+            if not (keep[i] and keep[j]):
+                continue
+            vi, vj = self.radii[i] ** 3, self.radii[j] ** 3
+            w = vi / (vi + vj)
+            self.pos[i] = w * self.pos[i] + (1 - w) * self.pos[j]
+            self.vel[i] = w * self.vel[i] + (1 - w) * self.vel[j]
+            self.temps[i] = w * self.temps[i] + (1 - w) * self.temps[j]
+            self.radii[i] = (vi + vj) ** (1.0 / 3.0)
+            keep[j] = False
+            self.merges += 1
+        self._keep(keep)
+
+    def step(self):
+        """Advance the scene by one frame"""
+        self.vel[:, 1] += self.gravity
+        self.pos += self.vel
+        self._merge()
+
+        # Replace droplets that left the field of view
+        inside = ((self.pos[:, 1] - self.radii < self.height)
+                  & (self.pos[:, 0] + self.radii > 0)
+                  & (self.pos[:, 0] - self.radii < self.width))
+        self._keep(inside)
+        self._spawn(self.num_droplets - len(self.ids))
+        self.frame_index += 1
+
+    def render(self):
+        """Render the current scene as a Mono14 frame"""
+        frame = np.full((self.height, self.width), self._background)
+        peaks = temperature_to_counts(self.temps) - self._background
+
+        for (x, y), r, peak in zip(self.pos, self.radii, peaks):
+            x0 = max(int(x - r - 2), 0)
+            x1 = min(int(x + r + 3), self.width)
+            y0 = max(int(y - r - 2), 0)
+            y1 = min(int(y + r + 3), self.height)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            yy, xx = np.mgrid[y0:y1, x0:x1]
+            dist = np.sqrt((xx + 0.5 - x) ** 2 + (yy + 0.5 - y) ** 2)
+            # Flat-top disc with a one-pixel soft edge
+            coverage = np.clip(r + 0.5 - dist, 0.0, 1.0)
+            window = frame[y0:y1, x0:x1]
+            np.maximum(window, self._background + peak * coverage, out=window)
+
+        if self.noise > 0:
+            frame += self.rng.normal(0.0, self.noise, frame.shape)
+        return np.clip(np.rint(frame), 0, 16383).astype(np.uint16)
+
+    def truth(self):
+        """Ground truth for the current frame as a TRUTH_DTYPE array"""
+        records = np.zeros(len(self.ids), dtype=TRUTH_DTYPE)
+        records['frame'] = self.frame_index
+        records['id'] = self.ids
+        records['x'] = self.pos[:, 0]
+        records['y'] = self.pos[:, 1]
+        records['vx'] = self.vel[:, 0]
+        records['vy'] = self.vel[:, 1]
+        records['temp'] = self.temps
+        records['radius'] = self.radii
+        return records
+
+    def timestamp_ns(self):
+        return int(round(self.frame_index * 1e9 / self.frame_rate))
+
+    def generate(self, num_frames):
+        """
+        Render num_frames frames
+        Returns (frames, timestamps_ns, truth) where truth is a TRUTH_DTYPE
+        array covering every droplet in every frame
+        """
+        frames = np.empty((num_frames, self.height, self.width), dtype=np.uint16)
+        timestamps = np.empty(num_frames, dtype=np.int64)
+        truth = []
+        for i in range(num_frames):
+            frames[i] = self.render()
+            timestamps[i] = self.timestamp_ns()
+            truth.append(self.truth())
+            self.step()
+        return frames, timestamps, np.concatenate(truth)
+
+    def save(self, path, num_frames):
+        """Write num_frames as a replayable recording plus <name>.truth.npy and <name>.scene.json"""
+        frames, timestamps, truth = self.generate(num_frames)
+        frames_path = save_recording(path, frames, timestamps)
+        np.save(truth_path(path), truth)
+        with open(scene_path(path), 'w') as f:
+            json.dump({'frame_rate': self.frame_rate, 'gravity': self.gravity,
+                       'velocity': list(self.velocity)}, f, indent=2)
+        return frames_path
+
+
+def truth_path(path):
+    """Path of the ground-truth file that accompanies a recording"""
+    frames_path, _ = recording_paths(path)
+    return frames_path[:-len('.npy')] + '.truth.npy'
+
+
+def scene_path(path):
+    """Path of the scene settings that accompany a synthetic recording"""
+    frames_path, _ = recording_paths(path)
+    return frames_path[:-len('.npy')] + '.scene.json'
+
+
+def scene_motion(path, pixel_to_mm):
+    """
+    KALMAN_CONFIG keys matching the motion of a saved synthetic scene, or
+    None for other recordings. Scene gravity (pixels/frame²) becomes
+    mm/s² at pixel_to_mm; a scene without gravity is constant velocity
+    """
+    try:
+        with open(scene_path(path)) as f:
+            scene = json.load(f)
+    except FileNotFoundError:
+        return None
+    gravity = scene['gravity'] * pixel_to_mm * scene['frame_rate'] ** 2
+    return {
+        'motion_model': 'ballistic' if gravity else 'constant_velocity',
+        'gravity_mm_s2': (0.0, gravity),
+        'drag_per_s': 0.0,
+    }
+
+
+class SyntheticFrameSource(FrameSource):
+    """
+    Frame source that renders a SyntheticDropletScene on the fly
+    speed=0 delivers frames as fast as they are rendered; speed=1.0 paces
+    them at the scene frame rate, like ReplayFrameSource
+    """
+
+    def __init__(self, scene, num_frames=None, speed=0.0):
+        self.scene = scene
+        self.num_frames = num_frames
+        self.speed = speed
+        self.width = scene.width
+        self.height = scene.height
+        self.delivered = 0
+        self._start_host = None
+
+    def begin(self):
+        self._start_host = time.perf_counter()
+
+    def next_image(self, timeout_ms=1000):
+        if self.num_frames is not None and self.delivered >= self.num_frames:
+            return None
+        if self.speed:
+            if self._start_host is None:
+                self._start_host = time.perf_counter()
+            due = self._start_host + self.delivered / self.scene.frame_rate / self.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        image = ReplayImage(
+            self.scene.render(),
+            self.scene.timestamp_ns(),
+            self.scene.frame_index
+        )
+        self.scene.step()
+        self.delivered += 1
+        return image
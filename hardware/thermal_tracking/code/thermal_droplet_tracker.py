@@ -5,15 +5,60 @@ Tracks multiple droplets with position and temperature using FLIR A35
 Primary sensor for the DRIP acoustic manufacturing system
 """
 
-import PySpin
 import numpy as np
 import cv2
+import select
 import socket
 import struct
 import time
 from collections import deque
 from threading import Thread, Lock
-from scipy.optimize import linear_sum_assignment
+
+from frame_sources import SpinnakerFrameSource
+from kalman_filter_bank import KalmanFilterBank, TrackSnapshot
+from motion_model import motion_model_from_config
+from association import associate
+from roi_detection import RoiDetector
+from fpga_protocol import FramedPacketBuilder, PROTOCOL_LEGACY, PROTOCOL_FRAMED, PROTOCOLS
+from fpga_protocol import ECHO_SIZE, parse_echo_packet
+from clock_sync import ClockOffsetEstimator, EchoClockEstimator
+
+# Framed datagrams whose send time is kept for matching timestamp echoes
+ECHO_HISTORY = 256
+
+# Camera timestamp gaps outside (0, MAX_FRAME_INTERVAL] s fall back to the
+# nominal frame interval (camera clock reset, acquisition restart)
+MAX_FRAME_INTERVAL = 1.0
+
+# Number of distinct 14-bit Mono14 counts
+SENSOR_COUNTS = 1 << 14
+
+# Structuring element of the opening that removes single hot pixels
+OPEN_KERNEL = np.ones((3, 3), np.uint8)
+
+# Detection record produced by the 'components' backend
+DETECTION_DTYPE = np.dtype([
+    ('x', '<f8'),          # mm
+    ('y', '<f8'),          # mm
+    ('temp', '<f8'),       # °C (peak)
+    ('peak_temp', '<f8'),  # °C
+    ('mean_temp', '<f8'),  # °C
+    ('area', '<i4'),       # pixels
+    ('pixel_x', '<f8'),
+    ('pixel_y', '<f8'),
+    ('bbox_x', '<i4'),
+    ('bbox_y', '<i4'),
+    ('bbox_w', '<i4'),
+    ('bbox_h', '<i4'),
+])
+
+def detection_columns(detections):
+    """(x, y) positions and temperatures of detections as arrays"""
+    if isinstance(detections, np.ndarray):
+        return np.column_stack([detections['x'], detections['y']]), detections['temp']
+    xy = np.array([(det['x'], det['y']) for det in detections], dtype=float)
+    temp = np.array([det['temp'] for det in detections], dtype=float)
+    return xy, temp
 
 class ThermalDropletTracker:
     """
@@ -21,73 +66,148 @@ class ThermalDropletTracker:
     Tracks multiple droplets with position and temperature
     """
     
-    def __init__(self, fpga_ip="192.168.1.50", fpga_port=5000):
-        # Camera parameters
+    def __init__(self, fpga_ip="192.168.1.50", fpga_port=5000, frame_source=None):
+        # Frame source: live FLIR A35 unless a replay source is supplied
+        if frame_source is None:
+            frame_source = SpinnakerFrameSource()
+        self.frame_source = frame_source
         self.camera = None
-        self.system = PySpin.System.GetInstance()
         
         # Tracking parameters
         self.min_temp_celsius = 600  # Minimum temp to track
         self.max_droplets = 10  # Maximum simultaneous droplets
         self.pixel_to_mm = 0.5  # Calibration factor
+        # Image geometry from the frame source, refreshed from the frames;
+        # positions are relative to image_center (pixel x, y), which is the
+        # frame centre unless a calibration sets it
+        self.frame_shape = (frame_source.height, frame_source.width)
+        self.image_center = None
+        self._center = np.array((frame_source.width / 2, frame_source.height / 2))
+        # Sensor calibration (sensor_calibration.SensorCalibration): lens
+        # distortion, non-uniformity and per-material emissivity, applied
+        # to blob pixels and centroids only; the store reloads new versions
+        self.sensor = None
+        self.material = None  # Alloy being printed (emissivity table), None = blackbody
+        self.calibration_store = None
+        # Adaptive thresholds: a pixel must also clear this many times its
+        # own temporal noise (sensor calibration noise map; 0 = off)
+        self.noise_threshold_sigma = 0.0
+        self._threshold_map = None
+        self._threshold_map_key = None
         
-        # Kalman filter for each tracked droplet
-        self.trackers = {}
+        # Detection: 'raw' thresholds 14-bit counts, 'legacy' thresholds an
+        # 8-bit cast of the temperature frame
+        self.detection_mode = 'raw'
+        # Blob extraction: 'components' (one native pass, structured array)
+        # or 'contours' (per-contour moments, list of dicts)
+        self.detection_backend = 'components'
+        self._hot_mask = None
+        self._threshold_key = None
+        self.update_temperature_lut()
+        # Per-frame work buffers reused across frames (see scratch())
+        self._scratch = {}
+        self._frame_result = {'frame': None, 'detections': None, 'tracks': None}
+        
+        # Prediction-guided ROI detection (components backend only); the
+        # detector holds sweep interval, window sizing and hit/miss stats
+        self.roi_detection = False
+        self.roi = RoiDetector(self)
+        # Full-frame detection split over a worker pool (TiledDetector,
+        # raw components detection only); None = one pass on this thread
+        self.tiler = None
+        
+        # Association gating ('euclidean' in mm, or 'mahalanobis' chi-square)
+        self.association_metric = 'euclidean'
+        self.association_gate_mm = 10.0  # Max distance threshold (mm)
+        self.mahalanobis_gate = 9.21  # Chi-square, 2 DOF, 99%
+        
+        # Kalman filter bank holding every tracked droplet
+        self.trackers = KalmanFilterBank()
         self.next_id = 0
+        # Track lifecycle: a track is tentative until it has been updated
+        # min_track_age times (only confirmed tracks go to the FPGA); a
+        # tentative track is dropped at its first miss, a confirmed one
+        # after max_missed_frames consecutive misses
+        self.min_track_age = 3
+        self.max_missed_frames = 5
+        self._last_timestamp = None  # Camera timestamp of the previous frame
+        self.track_time = 0.0  # Sum of frame intervals (s)
+        # Online scale calibration from free-falling tracks (SelfCalibrator);
+        # fed the matched detections of every track, applied between frames
+        self.calibrator = None
+        # Offline analysis: gets the raw centroid of every track, from its
+        # first detection on (observe(t, track_ids, px, py), like calibrator)
+        self.track_log = None
         
         # FPGA communication
         self.fpga_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.fpga_address = (fpga_ip, fpga_port)
+        # 'legacy': one datagram per track (current firmware); 'framed': one
+        # datagram per frame with sequence, camera timestamp and CRC
+        self.fpga_protocol = PROTOCOL_LEGACY
+        self.fpga_sequence = 0
+        self._packet_builder = FramedPacketBuilder(self.max_droplets)
+        # perf_counter_ns() send time of recent framed datagrams, indexed by
+        # sequence % ECHO_HISTORY (round-trip latency from the stand-in echo)
+        self._sent_ns = np.zeros(ECHO_HISTORY, dtype=np.int64)
+        
+        # Clock synchronization: camera chunk timestamps → host monotonic
+        # clock, host → FPGA clock (from timestamp echoes)
+        self.camera_clock = ClockOffsetEstimator()
+        self.fpga_clock = EchoClockEstimator()
+        # Latency compensation: send states predicted to the expected
+        # actuation time (exposure + pipeline + link + FPGA delay)
+        self.latency_compensation = False
+        self.link_delay_ns = 100_000  # One-way link delay until echoes measure it
+        self.actuation_delay_ns = 500_000  # FPGA receive → transducer update
+        self.last_lead_ns = 0  # Prediction horizon of the last packet
+        
+        # Black-box recorder of recent frames and tracks (FlightRecorder)
+        self.recorder = None
+        # Parameter changes from the control socket (ControlServer),
+        # adopted between frames
+        self.control = None
         
         # Performance monitoring
         self.frame_times = deque(maxlen=60)
+        # Stage durations of the last tracked frame (ns)
+        self.stage_ns = {'detect': 0, 'associate': 0, 'filter': 0}
         self.lock = Lock()
         
+    def configure_kalman(self, config):
+        """Rebuild the filter bank and track lifecycle from a KALMAN_CONFIG dict"""
+        self.trackers = KalmanFilterBank(
+            dt=config['dt'],
+            process_noise=config['process_noise'],
+            velocity_noise=config['velocity_noise'],
+            measurement_noise=config['measurement_noise'],
+            temp_noise=config['temp_noise'],
+            initial_velocity_covariance=config.get('initial_velocity_covariance', 1e4),
+            initial_velocity=config.get('initial_velocity_mm_s', (0.0, 0.0)),
+            motion_model=motion_model_from_config(config)
+        )
+        self.min_track_age = config['min_track_age']
+        self.max_missed_frames = config['max_missed_frames']
+        self._last_timestamp = None
+    
     def initialize_camera(self):
-        """Initialize FLIR A35 with optimal settings"""
-        try:
-            # Get camera list
-            cam_list = self.system.GetCameras()
-            if cam_list.GetSize() == 0:
-                raise Exception("No FLIR camera detected!")
-            
-            self.camera = cam_list[0]
-            self.camera.Init()
-            
-            # Configure for maximum performance
-            nodemap = self.camera.GetNodeMap()
-            
-            # Set pixel format to 14-bit for temperature
-            pixel_format = PySpin.CEnumerationPtr(nodemap.GetNode("PixelFormat"))
-            pixel_format.SetIntValue(PySpin.PixelFormat_Mono14)
-            
-            # Set acquisition mode to continuous
-            acquisition_mode = PySpin.CEnumerationPtr(
-                nodemap.GetNode("AcquisitionMode")
-            )
-            acquisition_mode.SetIntValue(PySpin.AcquisitionMode_Continuous)
-            
-            # Set frame rate to maximum (60 Hz)
-            frame_rate = PySpin.CFloatPtr(nodemap.GetNode("AcquisitionFrameRate"))
-            frame_rate.SetValue(60.0)
-            
-            # Enable timestamp for synchronization
-            timestamp = PySpin.CBooleanPtr(nodemap.GetNode("ChunkModeActive"))
-            timestamp.SetValue(True)
-            
-            # Configure temperature linear output mode
-            # This makes pixel values directly proportional to temperature
-            temp_linear = PySpin.CEnumerationPtr(
-                nodemap.GetNode("TemperatureLinearMode")
-            )
-            temp_linear.SetIntValue(1)  # High gain mode
-            
-            print(f"Camera initialized: {self.camera.GetUniqueID()}")
-            print(f"Resolution: 320x256 @ 60Hz")
-            
-        except PySpin.SpinnakerException as ex:
-            print(f"Error initializing camera: {ex}")
-            raise
+        """Initialize the frame source (FLIR A35 unless replaying)"""
+        self.frame_source.initialize()
+        self.camera = getattr(self.frame_source, 'camera', None)
+        self.set_frame_shape((self.frame_source.height, self.frame_source.width))
+    
+    def set_frame_shape(self, shape):
+        """Adopt the (height, width) of incoming frames"""
+        self.frame_shape = tuple(shape)
+        self.set_image_center(self.image_center)
+    
+    def set_image_center(self, center):
+        """Pixel (x, y) that maps to position (0, 0); None = frame centre"""
+        self.image_center = None if center is None else tuple(center)
+        if center is None:
+            height, width = self.frame_shape
+            center = (width / 2, height / 2)
+        self._center = np.array(center, dtype=float)
     
     def pixel_to_temperature(self, pixel_value):
         """Convert 14-bit pixel value to temperature in Celsius"""
@@ -95,25 +215,141 @@ class ThermalDropletTracker:
         # Adjust formula based on calibration
         return (pixel_value - 8192) * 0.04
     
+    def update_temperature_lut(self):
+        """
+        Rebuild the raw-count → temperature lookup table: the sensor
+        calibration's emissivity table for the current material, otherwise
+        pixel_to_temperature (blackbody)
+        """
+        lut = None
+        if self.sensor is not None and self.material is not None:
+            lut = self.sensor.temperature_lut(self.material)
+        if lut is None:
+            lut = self.pixel_to_temperature(np.arange(SENSOR_COUNTS)).astype(np.float32)
+        self.temperature_lut = lut
+    
+    def set_material(self, material):
+        """Select the emissivity table of the alloy being printed (None = blackbody)"""
+        self.material = material
+        self.update_temperature_lut()
+    
+    def set_sensor_calibration(self, sensor):
+        """Adopt a SensorCalibration (None = uncorrected sensor)"""
+        self.sensor = sensor
+        self.update_temperature_lut()
+    
+    def count_threshold(self):
+        """
+        Smallest raw count whose temperature is at least min_temp_celsius
+        Clamped to the top count, so saturated pixels always count as hot
+        """
+        key = (self.min_temp_celsius, id(self.temperature_lut))
+        if key != self._threshold_key:
+            threshold = np.searchsorted(self.temperature_lut, self.min_temp_celsius)
+            self._count_threshold = min(int(threshold), SENSOR_COUNTS - 1)
+            self._threshold_key = key
+        return self._count_threshold
+    
+    def pixel_thresholds(self):
+        """
+        Hot-pixel threshold in raw counts: count_threshold(), or a per-pixel
+        map when the sensor calibration has NUC maps (the threshold then
+        applies to corrected counts) or a noise map for adaptive thresholds
+        """
+        threshold = self.count_threshold()
+        sensor = self.sensor
+        if sensor is None or not (sensor.has_nuc or (sensor.noise is not None
+                                                     and self.noise_threshold_sigma > 0)):
+            return threshold
+        key = (threshold, id(sensor), self.noise_threshold_sigma)
+        if key != self._threshold_map_key:
+            self._threshold_map = sensor.count_thresholds(threshold, self.noise_threshold_sigma)
+            self._threshold_map_key = key
+        return self._threshold_map
+    
+    def scratch(self, name, shape, dtype):
+        """
+        Work buffer reused across frames: a contiguous view of the leading
+        elements of a flat array that only grows, so steady-state frames
+        (and ROI mosaics of varying height) allocate no pixel buffers
+        """
+        size = int(np.prod(shape))
+        buffer = self._scratch.get(name)
+        if buffer is None or buffer.dtype != dtype or len(buffer) < size:
+            buffer = self._scratch[name] = np.empty(size, dtype=dtype)
+        return buffer[:size].reshape(shape)
+    
+    def threshold_frame(self, thermal_frame):
+        """Binary (0/1) mask of hot pixels"""
+        if self.detection_mode == 'legacy':
+            # Temperature frame cast to 8-bit (wraps above 255 °C)
+            temp_frame = self.pixel_to_temperature(thermal_frame)
+            _, binary = cv2.threshold(
+                temp_frame.astype(np.uint8),
+                self.min_temp_celsius / 4,  # Scale for 8-bit
+                255,
+                cv2.THRESH_BINARY
+            )
+            return binary, temp_frame
+        
+        # Raw-count domain: compare 14-bit counts directly
+        if self._hot_mask is None or self._hot_mask.shape != thermal_frame.shape:
+            self._hot_mask = np.zeros(thermal_frame.shape, dtype=bool)
+        np.greater_equal(thermal_frame, self.pixel_thresholds(), out=self._hot_mask)
+        return self._hot_mask.view(np.uint8), None
+    
+    def pixel_to_position(self, px, py):
+        """
+        Sensor pixel coordinates to (x, y) in mm relative to the image
+        centre, removing lens distortion if the sensor is calibrated
+        """
+        if self.sensor is not None:
+            px, py = self.sensor.undistort(px, py)
+        cx, cy = self._center
+        return (px - cx) * self.pixel_to_mm, (py - cy) * self.pixel_to_mm
+    
+    def mm_to_pixel(self, xy_mm):
+        """Inverse of pixel_to_position for (N, 2) positions"""
+        pixels = np.asarray(xy_mm) / self.pixel_to_mm + self._center
+        if self.sensor is not None and self.sensor.has_distortion:
+            px, py = self.sensor.distort(pixels[..., 0], pixels[..., 1])
+            pixels = np.stack([px, py], axis=-1)
+        return pixels
+    
+    def blob_counts(self, counts, pixels):
+        """Counts of blob pixels (flat frame indices), non-uniformity corrected"""
+        if self.sensor is None:
+            return counts
+        return self.sensor.correct_counts(counts, pixels)
+    
     def detect_droplets(self, thermal_frame):
         """
         Detect hot droplets using blob detection
-        Returns list of (x, y, temperature, area) tuples
+        Returns detections with x, y (mm), temp, area and pixel_x/pixel_y:
+        a DETECTION_DTYPE array for the 'components' backend, or a list of
+        dicts for the 'contours' backend
         """
-        # Convert to temperature
-        temp_frame = self.pixel_to_temperature(thermal_frame)
+        if thermal_frame.shape != self.frame_shape:
+            self.set_frame_shape(thermal_frame.shape)
+        if self.roi_detection and self.detection_backend == 'components':
+            return self.roi.detect(thermal_frame)
+        return self.detect_full_frame(thermal_frame)
+    
+    def detect_full_frame(self, thermal_frame):
+        """Blob detection over every pixel of the frame"""
+        if (self.tiler is not None and self.detection_backend == 'components'
+                and self.detection_mode == 'raw'):
+            return self.tiler.detect(thermal_frame)
         
         # Threshold for hot objects
-        _, binary = cv2.threshold(
-            temp_frame.astype(np.uint8),
-            self.min_temp_celsius / 4,  # Scale for 8-bit
-            255,
-            cv2.THRESH_BINARY
-        )
+        binary, temp_frame = self.threshold_frame(thermal_frame)
         
         # Morphological operations to clean up
-        kernel = np.ones((3, 3), np.uint8)
-        binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
+        binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, OPEN_KERNEL,
+                                  dst=self.scratch('opened', binary.shape, np.uint8))
+        
+        if self.detection_backend == 'components':
+            return self.extract_blobs(binary, thermal_frame)
         
         # Find contours
         contours, _ = cv2.findContours(
@@ -132,12 +368,14 @@ class ThermalDropletTracker:
                     cx = M["m10"] / M["m00"]
                     cy = M["m01"] / M["m00"]
                     
-                    # Get temperature at centroid
-                    temp = temp_frame[int(cy), int(cx)]
+                    # Get temperature at centroid (LUT lookup in raw mode)
+                    if temp_frame is None:
+                        temp = self.temperature_lut[thermal_frame[int(cy), int(cx)]]
+                    else:
+                        temp = temp_frame[int(cy), int(cx)]
                     
                     # Convert to mm coordinates
-                    x_mm = (cx - 160) * self.pixel_to_mm
-                    y_mm = (cy - 128) * self.pixel_to_mm
+                    x_mm, y_mm = self.pixel_to_position(cx, cy)
                     
                     detections.append({
                         'x': x_mm,
@@ -150,73 +388,199 @@ class ThermalDropletTracker:
         
         return detections
     
+    def extract_blobs(self, binary, thermal_frame, frame_index=None):
+        """
+        Blob statistics from one connected-components labelling pass
+        Area, bounding box and centroid come from vectorized reductions over
+        the blob pixels. Centroids are weighted by counts above the detection
+        threshold; temperatures come from the LUT for blob pixels only.
+        frame_index maps pixels of a mosaic to flat frame indices (for the
+        sensor calibration's per-pixel maps)
+        """
+        num_labels, labels = cv2.connectedComponents(
+            binary, labels=self.scratch('labels', binary.shape, np.int32),
+            connectivity=8, ltype=cv2.CV_32S
+        )
+        detections = np.zeros(0, dtype=DETECTION_DTYPE)
+        if num_labels <= 1:
+            return detections
+        
+        # Blob pixels in raster order (label 0 is background)
+        blob_mask = self.scratch('blob_mask', binary.shape, bool)
+        pixels = np.flatnonzero(np.not_equal(binary, 0, out=blob_mask))
+        label = labels.ravel()[pixels]
+        
+        # Minimum size filter, relabelling kept blobs 0..num_blobs-1
+        area = np.bincount(label, minlength=num_labels)
+        keep = np.flatnonzero(area[1:] > 10) + 1
+        num_blobs = len(keep)
+        if num_blobs == 0:
+            return detections
+        blob_of = np.full(num_labels, -1, dtype=np.intp)
+        blob_of[keep] = np.arange(num_blobs)
+        blob = blob_of[label]
+        inside = blob >= 0
+        pixels, blob = pixels[inside], blob[inside]
+        area = area[keep]
+        counts = thermal_frame.ravel()[pixels]
+        if self.sensor is not None:
+            counts = self.blob_counts(counts, pixels if frame_index is None
+                                      else frame_index.ravel()[pixels])
+        ys, xs = np.divmod(pixels, labels.shape[1])
+        
+        # Intensity-weighted sub-pixel centroids
+        weights = counts - (self.count_threshold() - 1.0)
+        np.maximum(weights, 1.0, out=weights)
+        total = np.bincount(blob, weights, num_blobs)
+        cx = np.bincount(blob, weights * xs, num_blobs) / total
+        cy = np.bincount(blob, weights * ys, num_blobs) / total
+        
+        # Per-blob reductions over pixels grouped by blob
+        order = np.argsort(blob, kind='stable')
+        starts = np.searchsorted(blob[order], np.arange(num_blobs))
+        xs, ys = xs[order], ys[order]
+        left = np.minimum.reduceat(xs, starts)
+        top = np.minimum.reduceat(ys, starts)
+        
+        # Peak and mean blob temperatures
+        temps = self.temperature_lut[np.minimum(counts, SENSOR_COUNTS - 1)]
+        peak = np.maximum.reduceat(temps[order], starts)
+        mean = np.bincount(blob, temps, num_blobs) / area
+        
+        detections = np.zeros(num_blobs, dtype=DETECTION_DTYPE)
+        detections['x'], detections['y'] = self.pixel_to_position(cx, cy)
+        detections['temp'] = peak
+        detections['peak_temp'] = peak
+        detections['mean_temp'] = mean
+        detections['area'] = area
+        detections['pixel_x'] = cx
+        detections['pixel_y'] = cy
+        detections['bbox_x'] = left
+        detections['bbox_y'] = top
+        detections['bbox_w'] = np.maximum.reduceat(xs, starts) - left + 1
+        detections['bbox_h'] = np.maximum.reduceat(ys, starts) - top + 1
+        return detections
+    
     def update_kalman_trackers(self, detections):
         """
         Update Kalman filters for each tracked droplet
-        Uses Hungarian algorithm for detection-to-track association
+        Uses gated, cluster-wise assignment for detection-to-track association
         """
-        # Predict step for all trackers
-        predictions = {}
-        for track_id, kf in self.trackers.items():
-            predictions[track_id] = kf.predict()
+        # Predict step for all trackers (one batched operation)
+        self.trackers.predict()
+        self.stage_ns['associate'] = 0
         
         if len(detections) > 0 and len(self.trackers) > 0:
-            # Build cost matrix for assignment
-            cost_matrix = np.zeros((len(self.trackers), len(detections)))
-            track_ids = list(self.trackers.keys())
+            n = len(self.trackers)
+            track_ids = self.trackers.track_ids().copy()
+            det_xy, det_temp = detection_columns(detections)
             
-            for i, track_id in enumerate(track_ids):
-                pred = predictions[track_id]
-                for j, det in enumerate(detections):
-                    # Euclidean distance as cost
-                    cost = np.sqrt(
-                        (pred['x'] - det['x'])**2 + 
-                        (pred['y'] - det['y'])**2
-                    )
-                    cost_matrix[i, j] = cost
+            if self.association_metric == 'mahalanobis':
+                track_cov = self.trackers.position_covariance()
+                gate = self.mahalanobis_gate
+            else:
+                track_cov = None
+                gate = self.association_gate_mm
             
-            # Hungarian algorithm for optimal assignment
-            row_ind, col_ind = linear_sum_assignment(cost_matrix)
+            t0 = time.perf_counter_ns()
+            matched_rows, matched_cols = associate(
+                self.trackers.positions(), det_xy, gate, track_cov
+            )
+            self.stage_ns['associate'] = time.perf_counter_ns() - t0
             
-            # Update matched trackers
-            matched_tracks = set()
-            matched_detections = set()
+            # Update matched trackers in one batch (slot i == row i)
+            self.trackers.update(matched_rows, np.column_stack([
+                det_xy[matched_cols], det_temp[matched_cols]
+            ]))
+            if ((self.calibrator is not None or self.track_log is not None)
+                    and isinstance(detections, np.ndarray)):
+                px, py = self.matched_pixels(detections, matched_cols)
+                if self.calibrator is not None:
+                    self.calibrator.observe(self.track_time, track_ids[matched_rows], px, py)
+                if self.track_log is not None:
+                    self.track_log.observe(self.track_time, track_ids[matched_rows], px, py)
             
-            for i, j in zip(row_ind, col_ind):
-                if cost_matrix[i, j] < 10:  # Max distance threshold (mm)
-                    track_id = track_ids[i]
-                    self.trackers[track_id].update(detections[j])
-                    matched_tracks.add(track_id)
-                    matched_detections.add(j)
+            # Age unmatched trackers
+            unmatched = np.ones(n, dtype=bool)
+            unmatched[matched_rows] = False
+            lost_tracks = self.age_unmatched(unmatched, track_ids)
             
             # Create new trackers for unmatched detections
-            for j, det in enumerate(detections):
-                if j not in matched_detections:
-                    self.trackers[self.next_id] = KalmanDropletFilter(det)
-                    self.next_id += 1
+            new = np.ones(len(detections), dtype=bool)
+            new[matched_cols] = False
+            self.start_tracks(detections, np.flatnonzero(new))
             
             # Remove lost trackers
-            lost_tracks = [
-                tid for tid in track_ids 
-                if tid not in matched_tracks
-            ]
             for tid in lost_tracks:
-                if self.trackers[tid].missed_frames > 5:
-                    del self.trackers[tid]
-                else:
-                    self.trackers[tid].missed_frames += 1
+                self.trackers.remove(tid)
         
         elif len(detections) > 0:
             # No existing trackers, create new ones
-            for det in detections:
-                self.trackers[self.next_id] = KalmanDropletFilter(det)
-                self.next_id += 1
+            self.start_tracks(detections, np.arange(len(detections)))
+        
+        elif len(self.trackers) > 0:
+            # Nothing detected: every track missed this frame
+            unmatched = np.ones(len(self.trackers), dtype=bool)
+            track_ids = self.trackers.track_ids().copy()
+            for tid in self.age_unmatched(unmatched, track_ids):
+                self.trackers.remove(tid)
+    
+    def matched_pixels(self, detections, cols):
+        """Raw pixel centroids of detections (undistorted if calibrated)"""
+        px = detections['pixel_x'][cols]
+        py = detections['pixel_y'][cols]
+        if self.sensor is not None:
+            px, py = self.sensor.undistort(px, py)
+        return px, py
     
-    def send_to_fpga(self, tracked_droplets):
+    def start_tracks(self, detections, cols):
+        """Start a track for each of the given detections"""
+        first_id = self.next_id
+        for j in cols.tolist():
+            self.trackers.add(self.next_id, detections[j])
+            self.next_id += 1
+        if self.track_log is not None and isinstance(detections, np.ndarray) and len(cols):
+            px, py = self.matched_pixels(detections, cols)
+            self.track_log.observe(self.track_time, np.arange(first_id, self.next_id), px, py)
+    
+    def age_unmatched(self, unmatched, track_ids):
+        """
+        Count a miss for unmatched tracks (slot-order mask); returns the IDs
+        of tracks to remove: tentative ones that missed, and confirmed ones
+        missed more than max_missed_frames times in a row
+        """
+        missed = self.trackers.missed[:len(unmatched)]
+        lost = unmatched & ((missed >= self.max_missed_frames)
+                            | ~self.trackers.confirmed(self.min_track_age))
+        missed[unmatched & ~lost] += 1
+        return track_ids[lost].tolist()
+    
+    def send_to_fpga(self, tracked_droplets, camera_timestamp=0):
         """
         Send droplet positions and temps to FPGA for acoustic control
-        Protocol: [ID, X, Y, Z, Temp, Vx, Vy] as float32
+        Protocol: [ID, X, Y, Z, Temp, Vx, Vy] as float32, one datagram per
+        track ('legacy') or all tracks of a frame in one datagram behind a
+        header with sequence number and camera timestamp ('framed').
+        Tentative tracks are never sent. With latency_compensation the
+        states are first predicted forward to the expected actuation time.
         """
+        tracked_droplets = self.confirmed_tracks(tracked_droplets)
+        if self.latency_compensation:
+            tracked_droplets = self.predict_to_actuation(tracked_droplets, camera_timestamp)
+        
+        if self.fpga_protocol == PROTOCOL_FRAMED:
+            packet = self._packet_builder.build(
+                tracked_droplets, self.fpga_sequence, camera_timestamp
+            )
+            self._sent_ns[self.fpga_sequence % ECHO_HISTORY] = time.perf_counter_ns()
+            self.fpga_sequence += 1
+            self.fpga_socket.sendto(packet, self.fpga_address)
+            return
+        if self.fpga_protocol != PROTOCOL_LEGACY:
+            raise ValueError(
+                f"Unknown FPGA protocol '{self.fpga_protocol}' (expected one of {PROTOCOLS})"
+            )
+        
         for track_id, tracker in tracked_droplets.items():
             state = tracker.get_state()
             
@@ -227,7 +591,7 @@ class ThermalDropletTracker:
                 track_id,
                 state['x'],
                 state['y'],
-                0.0,  # Z from acoustic model
+                state.get('z', 0.0),  # Z from acoustic model unless fused 3D
                 state['temp'],
                 state['vx'],
                 state['vy']
@@ -236,56 +600,171 @@ class ThermalDropletTracker:
             # Send UDP packet to FPGA
             self.fpga_socket.sendto(data, self.fpga_address)
     
+    def confirmed_tracks(self, tracks):
+        """The confirmed tracks of a filter bank, snapshot or track mapping"""
+        if isinstance(tracks, KalmanFilterBank):
+            tracks = tracks.snapshot()
+        if isinstance(tracks, TrackSnapshot):
+            return tracks.confirmed(self.min_track_age)
+        return {tid: track for tid, track in tracks.items()
+                if track.age >= self.min_track_age}
+    
+    def actuation_lead_ns(self, camera_timestamp, now_ns=None):
+        """Time (ns) from a frame's exposure to its expected actuation on the FPGA"""
+        if now_ns is None:
+            now_ns = time.perf_counter_ns()
+        exposure = self.camera_clock.to_host(camera_timestamp)
+        age = 0 if exposure is None else max(now_ns - exposure, 0)
+        link = self.fpga_clock.one_way_ns(self.link_delay_ns)
+        return age + link + self.actuation_delay_ns
+    
+    def predict_to_actuation(self, tracks, camera_timestamp):
+        """Snapshot of tracks extrapolated to the expected actuation time"""
+        if isinstance(tracks, KalmanFilterBank):
+            tracks = tracks.snapshot()
+        elif not isinstance(tracks, TrackSnapshot):
+            return tracks  # Plain track mapping: nothing to extrapolate with
+        self.last_lead_ns = self.actuation_lead_ns(camera_timestamp)
+        return tracks.predicted(self.last_lead_ns / 1e9, self.trackers.model)
+    
+    def receive_echo(self, timeout=0.1):
+        """
+        Wait for a timestamp echo of a framed datagram (FPGA stand-in only)
+        Returns (sequence, round_trip_ns), or None on timeout or when the
+        echoed datagram is too old to match; raises ValueError for
+        anything that is not an echo
+        """
+        ready, _, _ = select.select([self.fpga_socket], [], [], timeout)
+        if not ready:
+            return None
+        data = self.fpga_socket.recv(ECHO_SIZE + 1)
+        arrived = time.perf_counter_ns()
+        echo = parse_echo_packet(data)
+        sequence = int(echo['sequence'])
+        if (self.fpga_sequence - 1 - sequence) & 0xFFFFFFFF >= ECHO_HISTORY:
+            return None
+        sent = int(self._sent_ns[sequence % ECHO_HISTORY])
+        self.fpga_clock.update(sent, int(echo['receive_ns']), arrived)
+        return sequence, arrived - sent
+    
+    def frame_interval(self, camera_timestamp):
+        """Seconds since the previous frame from camera timestamps (ns)"""
+        dt = self.trackers.dt
+        if camera_timestamp is not None:
+            if self._last_timestamp is not None:
+                elapsed = (int(camera_timestamp) - self._last_timestamp) / 1e9
+                if 0 < elapsed <= MAX_FRAME_INTERVAL:
+                    dt = elapsed
+            self._last_timestamp = int(camera_timestamp)
+        return dt
+    
+    def track_frame(self, frame, camera_timestamp=None):
+        """
+        Detect droplets in a frame and update the tracks
+        Tracks are predicted over the real interval since the previous
+        frame when camera timestamps are given, otherwise the nominal dt
+        """
+        # New calibrations and parameters take effect before anything of this frame
+        if self.calibration_store is not None:
+            self.calibration_store.apply(self)
+        if self.calibrator is not None:
+            self.calibrator.apply()
+        if self.control is not None:
+            self.control.apply()
+        
+        # Predictions (ROI windows, association) use the real frame interval
+        dt = self.frame_interval(camera_timestamp)
+        self.trackers.set_dt(dt)
+        self.track_time += dt
+        
+        # Detect droplets
+        t0 = time.perf_counter_ns()
+        detections = self.detect_droplets(frame)
+        t1 = time.perf_counter_ns()
+        
+        # Update tracking
+        self.update_kalman_trackers(detections)
+        t2 = time.perf_counter_ns()
+        
+        # Filter time is everything in the update except association
+        self.stage_ns['detect'] = t1 - t0
+        self.stage_ns['filter'] = t2 - t1 - self.stage_ns['associate']
+        return detections
+    
     def process_frame(self, image_result):
         """Process single frame - called at 60Hz"""
         try:
+            self.camera_clock.update(image_result.GetTimeStamp(), time.perf_counter_ns())
+            
             # Convert to numpy array
             frame = image_result.GetNDArray()
             
-            # Detect droplets
-            detections = self.detect_droplets(frame)
-            
-            # Update tracking
-            self.update_kalman_trackers(detections)
+            # Detect droplets and update tracking
+            detections = self.track_frame(frame, image_result.GetTimeStamp())
+            if self.recorder is not None:
+                self.recorder.record(frame, self.trackers.snapshot(), image_result.GetFrameID(),
+                                     image_result.GetTimeStamp(), len(detections))
             
             # Send to FPGA
-            self.send_to_fpga(self.trackers)
+            self.send_to_fpga(self.trackers, image_result.GetTimeStamp())
             
             # Performance monitoring
             self.frame_times.append(time.time())
             
-            # Return for visualization
-            return {
-                'frame': frame,
-                'detections': detections,
-                'tracks': self.trackers
-            }
+            # Return for visualization (one dict, refilled every frame)
+            result = self._frame_result
+            result['frame'] = frame
+            result['detections'] = detections
+            result['tracks'] = self.trackers
+            return result
             
         except Exception as e:
             print(f"Frame processing error: {e}")
             return None
     
-    def run_continuous(self):
-        """Main tracking loop - runs at camera frame rate"""
+    def run_continuous(self, collector=None):
+        """
+        Main tracking loop - runs at camera frame rate
+        With a collector (gc_control.IdleCollector) garbage collection only
+        runs after frames that left at least half a frame period idle
+        """
+        frame_count = 0
+        start_time = time.perf_counter()
+        idle_ns = int(self.trackers.dt * 1e9) // 2
         try:
             # Start acquisition
-            self.camera.BeginAcquisition()
+            if collector is not None:
+                collector.start()
+            self.frame_source.begin()
             print("Starting thermal tracking at 60Hz...")
             
             while True:
                 # Get next frame (blocks until available)
-                image_result = self.camera.GetNextImage(1000)
+                image_result = self.frame_source.next_image(1000)
+                
+                if image_result is None:
+                    print("\nFrame source exhausted")
+                    break
                 
                 if image_result.IsIncomplete():
                     print("Image incomplete, skipping...")
+                    image_result.Release()
+                    if self.recorder is not None:
+                        self.recorder.note_incomplete()
                     continue
                 
                 # Process frame
+                frame_start = time.perf_counter_ns()
                 result = self.process_frame(image_result)
+                frame_count += 1
                 
                 # Release frame
                 image_result.Release()
                 
+                # Collect garbage while waiting for the next frame
+                if collector is not None:
+                    collector.poll(idle=time.perf_counter_ns() - frame_start < idle_ns)
+                
                 # Calculate and display FPS
                 if len(self.frame_times) > 1:
                     fps = len(self.frame_times) / (
@@ -297,110 +776,19 @@ class ThermalDropletTracker:
         except KeyboardInterrupt:
             print("\nStopping thermal tracking...")
         finally:
-            self.camera.EndAcquisition()
+            elapsed = time.perf_counter() - start_time
+            if frame_count and elapsed > 0:
+                print(f"Processed {frame_count} frames in {elapsed:.2f}s "
+                      f"({frame_count / elapsed:.1f} frames/s)")
+            if collector is not None:
+                collector.stop()
+            self.frame_source.end()
             self.cleanup()
     
     def cleanup(self):
         """Clean up resources"""
-        if self.camera:
-            self.camera.DeInit()
-            del self.camera
-        self.system.ReleaseInstance()
+        self.frame_source.close()
+        self.camera = None
         self.fpga_socket.close()
-
-
-class KalmanDropletFilter:
-    """
-    Kalman filter for tracking individual droplet
-    State: [x, y, vx, vy, temp]
-    """
-    
-    def __init__(self, initial_detection):
-        # State vector: [x, y, vx, vy, temp]
-        self.state = np.array([
-            initial_detection['x'],
-            initial_detection['y'],
-            0.0,  # Initial velocity x
-            0.0,  # Initial velocity y
-            initial_detection['temp']
-        ])
-        
-        # State transition matrix (constant velocity model)
-        self.dt = 1/60.0  # 60Hz frame rate
-        self.F = np.array([
-            [1, 0, self.dt, 0, 0],
-            [0, 1, 0, self.dt, 0],
-            [0, 0, 1, 0, 0],
-            [0, 0, 0, 1, 0],
-            [0, 0, 0, 0, 1]  # Temperature changes slowly
-        ])
-        
-        # Measurement matrix (we measure x, y, temp)
-        self.H = np.array([
-            [1, 0, 0, 0, 0],
-            [0, 1, 0, 0, 0],
-            [0, 0, 0, 0, 1]
-        ])
-        
-        # Process noise covariance
-        self.Q = np.eye(5) * 0.1
-        self.Q[2, 2] = 0.01  # Less noise in velocity
-        self.Q[3, 3] = 0.01
-        
-        # Measurement noise covariance
-        self.R = np.eye(3)
-        self.R[0, 0] = 0.5  # Position uncertainty (mm)
-        self.R[1, 1] = 0.5
-        self.R[2, 2] = 5.0  # Temperature uncertainty (°C)
-        
-        # Initial covariance
-        self.P = np.eye(5) * 10
-        
-        self.missed_frames = 0
-        self.age = 0
-    
-    def predict(self):
-        """Predict next state"""
-        self.state = self.F @ self.state
-        self.P = self.F @ self.P @ self.F.T + self.Q
-        return {
-            'x': self.state[0],
-            'y': self.state[1],
-            'vx': self.state[2],
-            'vy': self.state[3],
-            'temp': self.state[4]
-        }
-    
-    def update(self, detection):
-        """Update with new measurement"""
-        z = np.array([
-            detection['x'],
-            detection['y'],
-            detection['temp']
-        ])
-        
-        # Kalman gain
-        S = self.H @ self.P @ self.H.T + self.R
-        K = self.P @ self.H.T @ np.linalg.inv(S)
-        
-        # Update state
-        y = z - self.H @ self.state
-        self.state = self.state + K @ y
-        
-        # Update covariance
-        I = np.eye(5)
-        self.P = (I - K @ self.H) @ self.P
-        
-        self.missed_frames = 0
-        self.age += 1
-    
-    def get_state(self):
-        """Get current state estimate"""
-        return {
-            'x': self.state[0],
-            'y': self.state[1],
-            'vx': self.state[2],
-            'vy': self.state[3],
-            'temp': self.state[4],
-            'age': self.age
-        }
\ No newline at end of file
+        if self.tiler is not None:
+            self.tiler.close()
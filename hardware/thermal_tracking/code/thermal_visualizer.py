@@ -1,36 +1,60 @@
 #!/usr/bin/env python3
 """
 Real-time visualization of thermal tracking
-Shows thermal image and droplet positions/velocities
+Shows thermal image and droplet positions/velocities. Runs in its own
+process (shared_display.DisplayProcess) so drawing never competes with
+the tracking threads.
 """
 
-import cv2
+import os
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.patches import Circle
-import matplotlib.animation as animation
+from matplotlib.collections import LineCollection
+
+from kalman_filter_bank import TrackSnapshot
+from shared_display import DisplayBuffer
+
+# Velocity arrows show this much travel (s)
+VELOCITY_SCALE = 0.1
+
 
 class ThermalVisualizer:
-    """Real-time visualization of thermal tracking"""
-    
-    def __init__(self, tracker):
-        self.tracker = tracker
-        
+    """
+    Real-time visualization of thermal tracking
+
+    All artists are created once and updated in place; each update
+    restores the cached static background and blits only the animated
+    artists, so a redraw costs a few milliseconds at any track count.
+    """
+
+    def __init__(self, shape, temperature_lut, max_tracks=64):
+        self.temperature_lut = temperature_lut
+        self.max_tracks = max_tracks
+
         # Set up matplotlib for real-time display
         plt.ion()
         self.fig, (self.ax1, self.ax2) = plt.subplots(1, 2, figsize=(12, 5))
-        
+
         # Thermal image display
         self.thermal_img = self.ax1.imshow(
-            np.zeros((256, 320)),
+            np.zeros(shape),
             cmap='hot',
             vmin=0,
-            vmax=1600
+            vmax=1600,
+            animated=True
         )
         self.ax1.set_title("Thermal View")
         self.ax1.set_xlabel("X (pixels)")
         self.ax1.set_ylabel("Y (pixels)")
-        
+
+        # Detection markers on the thermal image
+        self.detection_markers, = self.ax1.plot(
+            [], [], 'o', markersize=10, markerfacecolor='none',
+            markeredgecolor='green', markeredgewidth=2, animated=True
+        )
+
         # Position plot
         self.ax2.set_xlim(-50, 50)
         self.ax2.set_ylim(-50, 50)
@@ -39,81 +63,90 @@ class ThermalVisualizer:
         self.ax2.set_xlabel("X (mm)")
         self.ax2.set_ylabel("Y (mm)")
         self.ax2.grid(True)
-        
-        self.position_plots = {}
-    
-    def update_display(self, result):
+
+        self.track_markers, = self.ax2.plot([], [], 'ro', markersize=10, animated=True)
+        self.velocity_lines = LineCollection([], colors='blue', animated=True)
+        self.ax2.add_collection(self.velocity_lines)
+        self.labels = [
+            self.ax2.text(0, 0, '', fontsize=8, visible=False, animated=True)
+            for _ in range(max_tracks)
+        ]
+        self.status = self.ax2.text(0.02, 0.98, '', transform=self.ax2.transAxes,
+                                    verticalalignment='top', animated=True)
+
+        self.animated = [self.thermal_img, self.detection_markers, self.track_markers,
+                         self.velocity_lines, self.status] + self.labels
+        self.background = None
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+        plt.show(block=False)
+        self.fig.canvas.draw()
+
+    def _on_draw(self, event):
+        """Cache the static background after every full redraw (e.g. resize)"""
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        for artist in self.animated:
+            artist.axes.draw_artist(artist)
+
+    def is_open(self):
+        return plt.fignum_exists(self.fig.number)
+
+    def flush_events(self):
+        self.fig.canvas.flush_events()
+
+    def update_display(self, result, frame_rate=0.0):
         """Update visualization with latest tracking data"""
         if result is None:
             return
-        
+
         # Update thermal image
-        temp_frame = self.tracker.pixel_to_temperature(result['frame'])
-        self.thermal_img.set_data(temp_frame)
-        
-        # Clear previous patches
-        for patch in self.ax1.patches[:]:
-            patch.remove()
-        
-        # Draw detection boxes on thermal image
-        for det in result['detections']:
-            circle = Circle(
-                (det['pixel_x'], det['pixel_y']),
-                radius=5,
-                fill=False,
-                color='green',
-                linewidth=2
-            )
-            self.ax1.add_patch(circle)
-        
-        # Update position plot
-        self.ax2.clear()
-        self.ax2.set_xlim(-50, 50)
-        self.ax2.set_ylim(-50, 50)
-        self.ax2.set_aspect('equal')
-        self.ax2.grid(True)
-        
-        for track_id, tracker in result['tracks'].items():
-            state = tracker.get_state()
-            
-            # Plot position
-            self.ax2.plot(state['x'], state['y'], 'ro', markersize=10)
-            
-            # Add velocity vector
-            self.ax2.arrow(
-                state['x'], state['y'],
-                state['vx'] * 10, state['vy'] * 10,
-                head_width=2,
-                head_length=1,
-                fc='blue',
-                ec='blue'
-            )
-            
-            # Add text label
-            self.ax2.text(
-                state['x'] + 2, state['y'] + 2,
-                f"ID:{track_id}\nT:{state['temp']:.0f}°C",
-                fontsize=8
-            )
-        
-        self.ax2.set_title(f"Tracking {len(result['tracks'])} droplets")
-        
-        plt.pause(0.001)
+        self.thermal_img.set_data(self.temperature_lut[result['frame']])
+
+        # Detection circles on thermal image
+        detections = result['detections']
+        self.detection_markers.set_data(detections['pixel_x'], detections['pixel_y'])
+
+        # Track positions, velocity vectors and labels
+        tracks = result['tracks'][:self.max_tracks]
+        x, y = tracks['x'], tracks['y']
+        self.track_markers.set_data(x, y)
+        ends = np.column_stack([x + tracks['vx'] * VELOCITY_SCALE,
+                                y + tracks['vy'] * VELOCITY_SCALE])
+        self.velocity_lines.set_segments(np.stack([np.column_stack([x, y]), ends], axis=1))
+        for label, track in zip(self.labels, tracks):
+            label.set_position((track['x'] + 2, track['y'] + 2))
+            label.set_text(f"ID:{track['id']}\nT:{track['temp']:.0f}°C")
+            label.set_visible(True)
+        for label in self.labels[len(tracks):]:
+            label.set_visible(False)
+
+        self.status.set_text(f"Tracking {len(tracks)} droplets | frame {result['frame_id']}"
+                             f" | {frame_rate:.1f} Hz")
+
+        canvas = self.fig.canvas
+        if self.background is None:
+            canvas.draw()
+        canvas.restore_region(self.background)
+        self._draw_animated()
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
 
-    def save_frame(self, result, filename):
+    def save_frame(self, result, filename, frame_rate=0.0):
         """Save current visualization to file"""
         if result is None:
             return
-            
+
         # Create composite image
         fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(12, 10))
-        
+
         # Thermal image
-        temp_frame = self.tracker.pixel_to_temperature(result['frame'])
+        temp_frame = self.temperature_lut[result['frame']]
         im1 = ax1.imshow(temp_frame, cmap='hot', vmin=0, vmax=1600)
         ax1.set_title("Thermal View")
         plt.colorbar(im1, ax=ax1, label='Temperature (°C)')
-        
+
         # Add detection circles
         for det in result['detections']:
             circle = Circle(
@@ -124,7 +157,7 @@ class ThermalVisualizer:
                 linewidth=2
             )
             ax1.add_patch(circle)
-        
+
         # Position plot
         ax2.set_xlim(-50, 50)
         ax2.set_ylim(-50, 50)
@@ -133,13 +166,14 @@ class ThermalVisualizer:
         ax2.set_title("Droplet Positions (mm)")
         ax2.set_xlabel("X (mm)")
         ax2.set_ylabel("Y (mm)")
-        
-        for track_id, tracker in result['tracks'].items():
+
+        tracks = TrackSnapshot(result['tracks'])
+        for track_id, tracker in tracks.items():
             state = tracker.get_state()
             ax2.plot(state['x'], state['y'], 'ro', markersize=10)
             ax2.arrow(
                 state['x'], state['y'],
-                state['vx'] * 10, state['vy'] * 10,
+                state['vx'] * VELOCITY_SCALE, state['vy'] * VELOCITY_SCALE,
                 head_width=2,
                 head_length=1,
                 fc='blue',
@@ -150,34 +184,92 @@ class ThermalVisualizer:
                 f"ID:{track_id}",
                 fontsize=8
             )
-        
+
         # Temperature histogram
         ax3.hist(temp_frame.flatten(), bins=50, range=(0, 1600))
         ax3.set_xlabel("Temperature (°C)")
         ax3.set_ylabel("Pixel Count")
         ax3.set_title("Temperature Distribution")
-        
+
         # Tracking statistics
         ax4.axis('off')
         stats_text = f"Frame Statistics:\n\n"
         stats_text += f"Detections: {len(result['detections'])}\n"
-        stats_text += f"Active Tracks: {len(result['tracks'])}\n"
-        stats_text += f"Frame Rate: {len(self.tracker.frame_times):.1f} Hz\n\n"
-        
-        if len(result['tracks']) > 0:
+        stats_text += f"Active Tracks: {len(tracks)}\n"
+        stats_text += f"Frame Rate: {frame_rate:.1f} Hz\n\n"
+
+        if len(tracks) > 0:
             stats_text += "Tracked Droplets:\n"
-            for track_id, tracker in result['tracks'].items():
+            for track_id, tracker in tracks.items():
                 state = tracker.get_state()
                 stats_text += f"\nID {track_id}:\n"
                 stats_text += f"  Position: ({state['x']:.1f}, {state['y']:.1f}) mm\n"
                 stats_text += f"  Velocity: ({state['vx']:.1f}, {state['vy']:.1f}) mm/s\n"
                 stats_text += f"  Temperature: {state['temp']:.0f}°C\n"
                 stats_text += f"  Age: {state['age']} frames\n"
-        
-        ax4.text(0.1, 0.9, stats_text, transform=ax4.transAxes, 
+
+        ax4.text(0.1, 0.9, stats_text, transform=ax4.transAxes,
                  verticalalignment='top', fontfamily='monospace')
         ax4.set_title("Tracking Statistics")
-        
+
         plt.tight_layout()
         plt.savefig(filename, dpi=150)
-        plt.close(fig)
\ No newline at end of file
+        plt.close(fig)
+
+
+def run_display(name, shape, max_tracks, max_detections,
+                rate=15.0, save_every=0, save_dir='logs', stop_event=None):
+    """
+    Display process main loop
+    Redraws from the shared DisplayBuffer at most `rate` times per second
+    and saves a composite every `save_every` frames (0 = never), using
+    the temperature lookup table the tracker currently detects with
+    """
+    buffer = DisplayBuffer.attach(name, shape, max_tracks, max_detections)
+    item = buffer.read_lut()
+    while item is None:  # Only while racing a table update
+        time.sleep(0.001)
+        item = buffer.read_lut()
+    temperature_lut, lut_generation = item
+    visualizer = ThermalVisualizer(shape, temperature_lut, max_tracks)
+    period = 1.0 / rate
+    last_published = 0
+    last_saved = None
+    last_frame = None  # (frame_id, camera_timestamp) for the frame rate
+    frame_rate = 0.0
+    try:
+        next_draw = time.perf_counter()
+        while visualizer.is_open() and not (stop_event and stop_event.is_set()):
+            item = buffer.read_lut(lut_generation)
+            if item is not None:
+                visualizer.temperature_lut, lut_generation = item
+            item = buffer.read(last_published)
+            if item is not None:
+                result, last_published = item
+                frame_id = result['frame_id']
+                if last_frame is not None and result['camera_timestamp'] > last_frame[1]:
+                    frame_rate = ((frame_id - last_frame[0]) * 1e9
+                                  / (result['camera_timestamp'] - last_frame[1]))
+                last_frame = (frame_id, result['camera_timestamp'])
+                visualizer.update_display(result, frame_rate)
+
+                # Save frames if requested
+                if save_every > 0 and (last_saved is None
+                                       or frame_id - last_saved >= save_every):
+                    filename = os.path.join(save_dir, f"thermal_frame_{frame_id:06d}.png")
+                    visualizer.save_frame(result, filename, frame_rate)
+                    last_saved = frame_id
+            else:
+                visualizer.flush_events()
+
+            next_draw += period
+            delay = next_draw - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_draw = time.perf_counter()
+    except KeyboardInterrupt:
+        pass  # Ctrl+C reaches the whole process group; the tracker shuts down
+    finally:
+        plt.close('all')
+        buffer.close()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Tiled full-frame detection for high-resolution thermal sensors
+The frame is split into tiles that are thresholded, opened and labelled
+on a thread pool (OpenCV and NumPy release the GIL for the heavy work),
+and blobs cut by tile seams are merged before their statistics are final
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+
+from thermal_droplet_tracker import DETECTION_DTYPE, SENSOR_COUNTS
+
+# Pixels of neighbouring tiles read for the 3×3 opening (its reach is 2)
+CONTEXT = 2
+
+# Per-blob partial sums of one tile, merged across seams by summing (or
+# taking the min/max of) the parts of each blob
+_SUMS = ('area', 'weight', 'weight_x', 'weight_y', 'temp_sum')
+_MINS = ('first', 'left', 'top')
+_MAXS = ('right', 'bottom', 'peak')
+
+
+def tile_bounds(length, count):
+    """Edges of count near-equal spans covering 0..length"""
+    return np.linspace(0, length, count + 1).round().astype(int).tolist()
+
+
+class TiledDetector:
+    """
+    Full-frame detection split into rows × cols tiles on a worker pool
+
+    Each tile thresholds its pixels plus CONTEXT pixels of the neighbouring
+    tiles, so the opened mask inside the tile is exactly the full-frame
+    mask, then labels only its own pixels and reduces them to partial blob
+    sums. Labels touching across a seam (8-connected, corners included)
+    are joined with a union-find and their sums combined, so detections
+    match ThermalDropletTracker.extract_blobs on the whole frame: the
+    area filter, centroids, bounding boxes and temperatures apply to the
+    merged blob. Detections are ordered by their first pixel in raster
+    order.
+
+    On a 320×256 A35 frame one pass is faster; tiles pay off for larger
+    sensors with a core per worker.
+    """
+
+    def __init__(self, tracker, tiles=(2, 2), workers=None):
+        self.tracker = tracker
+        self.rows, self.cols = tiles
+        self.workers = workers or self.rows * self.cols
+        self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix='thermal-tile')
+        self._shape = None
+        self._kernel = np.ones((3, 3), np.uint8)
+        self.seam_merges = 0  # Blob parts joined across seams
+
+    def close(self):
+        self.pool.shutdown()
+
+    def _layout(self, shape):
+        """Tile rectangles (x0, y0, x1, y1) in raster order, with mask buffers"""
+        height, width = shape
+        ys = tile_bounds(height, self.rows)
+        xs = tile_bounds(width, self.cols)
+        self.tiles = [(xs[c], ys[r], xs[c + 1], ys[r + 1])
+                      for r in range(self.rows) for c in range(self.cols)]
+        self._masks = [np.zeros((min(y1 + CONTEXT, height) - max(y0 - CONTEXT, 0),
+                                 min(x1 + CONTEXT, width) - max(x0 - CONTEXT, 0)), bool)
+                       for x0, y0, x1, y1 in self.tiles]
+        self._shape = shape
+
+    def detect(self, thermal_frame):
+        """Detections for the whole frame, as from detect_full_frame"""
+        if thermal_frame.shape != self._shape:
+            self._layout(thermal_frame.shape)
+        threshold = self.tracker.count_threshold()
+        pixel_thresholds = self.tracker.pixel_thresholds()
+        parts = list(self.pool.map(
+            lambda i: self._tile_blobs(thermal_frame, i, threshold, pixel_thresholds),
+            range(len(self.tiles))
+        ))
+        return self._merge(parts)
+
+    def _tile_blobs(self, thermal_frame, i, threshold, pixel_thresholds):
+        """
+        Labels and partial blob sums of tile i (frame coordinates)
+        pixel_thresholds is the tracker's hot-pixel threshold (scalar or
+        per-pixel map); threshold the scalar one centroid weights start at
+        """
+        height, width = thermal_frame.shape
+        x0, y0, x1, y1 = self.tiles[i]
+        cx0, cy0 = max(x0 - CONTEXT, 0), max(y0 - CONTEXT, 0)
+        mask = self._masks[i]
+        context = np.s_[cy0:min(y1 + CONTEXT, height), cx0:min(x1 + CONTEXT, width)]
+        if isinstance(pixel_thresholds, np.ndarray):
+            pixel_thresholds = pixel_thresholds[context]
+        np.greater_equal(thermal_frame[context], pixel_thresholds, out=mask)
+        opened = cv2.morphologyEx(mask.view(np.uint8), cv2.MORPH_OPEN, self._kernel)
+        binary = np.ascontiguousarray(opened[y0 - cy0:y1 - cy0, x0 - cx0:x1 - cx0])
+        num_labels, labels = cv2.connectedComponents(binary, connectivity=8,
+                                                     ltype=cv2.CV_32S)
+        sums = {}
+        if num_labels > 1:
+            # Blob pixels in raster order, grouped by label (1..num_labels-1)
+            pixels = np.flatnonzero(binary.view(bool))
+            label = labels.ravel()[pixels] - 1
+            ys, xs = np.divmod(pixels, x1 - x0)
+            xs += x0
+            ys += y0
+            counts = self.tracker.blob_counts(thermal_frame[ys, xs], ys * width + xs)
+            n = num_labels - 1
+
+            weights = counts - (threshold - 1.0)
+            np.maximum(weights, 1.0, out=weights)
+            temps = self.tracker.temperature_lut[np.minimum(counts, SENSOR_COUNTS - 1)]
+            order = np.argsort(label, kind='stable')
+            starts = np.searchsorted(label[order], np.arange(n))
+            xs_o, ys_o = xs[order], ys[order]
+            sums = {
+                'area': np.bincount(label, minlength=n),
+                'weight': np.bincount(label, weights, n),
+                'weight_x': np.bincount(label, weights * xs, n),
+                'weight_y': np.bincount(label, weights * ys, n),
+                'temp_sum': np.bincount(label, temps, n),
+                'first': (ys_o * width + xs_o)[starts],
+                'left': np.minimum.reduceat(xs_o, starts),
+                'top': ys_o[starts],
+                'right': np.maximum.reduceat(xs_o, starts),
+                'bottom': np.maximum.reduceat(ys_o, starts),
+                'peak': np.maximum.reduceat(temps[order], starts),
+            }
+        return labels, sums
+
+    def _seam_pairs(self, parts):
+        """(blob, blob) index pairs of labels touching across a tile seam"""
+        offsets = np.cumsum([0] + [len(s.get('area', ())) for _, s in parts])
+        rows, cols = self.rows, self.cols
+        pairs = []
+
+        def touch(a, b, edge_a, edge_b):
+            la, lb = parts[a][0], parts[b][0]
+            ea, eb = edge_a(la), edge_b(lb)
+            for shift in (-1, 0, 1):
+                if shift < 0:
+                    pa, pb = ea[:shift], eb[-shift:]
+                elif shift > 0:
+                    pa, pb = ea[shift:], eb[:-shift]
+                else:
+                    pa, pb = ea, eb
+                both = (pa > 0) & (pb > 0)
+                if both.any():
+                    pairs.append(np.column_stack([pa[both] - 1 + offsets[a],
+                                                  pb[both] - 1 + offsets[b]]))
+
+        def corner(a, b, ya, xa, yb, xb):
+            la, lb = parts[a][0], parts[b][0]
+            if la[ya, xa] and lb[yb, xb]:
+                pairs.append(np.array([[la[ya, xa] - 1 + offsets[a],
+                                        lb[yb, xb] - 1 + offsets[b]]]))
+
+        for r in range(rows):
+            for c in range(cols):
+                i = r * cols + c
+                if not parts[i][1]:
+                    continue
+                if c + 1 < cols and parts[i + 1][1]:
+                    touch(i, i + 1, lambda l: l[:, -1], lambda l: l[:, 0])
+                if r + 1 < rows:
+                    below = i + cols
+                    if parts[below][1]:
+                        touch(i, below, lambda l: l[-1], lambda l: l[0])
+                    if c + 1 < cols and parts[below + 1][1]:
+                        corner(i, below + 1, -1, -1, 0, 0)
+                    if c > 0 and parts[below - 1][1]:
+                        corner(i, below - 1, -1, 0, 0, -1)
+        return np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.intp)
+
+    def _merge(self, parts):
+        """Join blob parts across seams and build the detection array"""
+        tracker = self.tracker
+        filled = [s for _, s in parts if s]
+        if not filled:
+            return np.zeros(0, dtype=DETECTION_DTYPE)
+        sums = {key: np.concatenate([s[key] for s in filled]) for key in filled[0]}
+        n = len(sums['area'])
+
+        # Union-find over the seam pairs; blob = index of its merged root
+        parent = np.arange(n)
+        pairs = self._seam_pairs(parts)
+        for a, b in np.unique(pairs, axis=0).tolist():
+            while parent[a] != a:
+                a = parent[a]
+            while parent[b] != b:
+                b = parent[b]
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+                self.seam_merges += 1
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+        roots, blob = np.unique(parent, return_inverse=True)
+        m = len(roots)
+
+        merged = {key: np.bincount(blob, sums[key], m) for key in _SUMS}
+        for key in _MINS:
+            merged[key] = np.full(m, np.iinfo(np.int64).max, dtype=np.int64)
+            np.minimum.at(merged[key], blob, sums[key])
+        for key in _MAXS:
+            merged[key] = np.full(m, -np.inf)
+            np.maximum.at(merged[key], blob, sums[key])
+
+        # Minimum size filter, then full-frame raster order of first pixels
+        keep = np.flatnonzero(merged['area'] > 10)
+        keep = keep[np.argsort(merged['first'][keep], kind='stable')]
+        area = merged['area'][keep]
+        cx = merged['weight_x'][keep] / merged['weight'][keep]
+        cy = merged['weight_y'][keep] / merged['weight'][keep]
+
+        detections = np.zeros(len(keep), dtype=DETECTION_DTYPE)
+        detections['x'], detections['y'] = tracker.pixel_to_position(cx, cy)
+        detections['temp'] = merged['peak'][keep]
+        detections['peak_temp'] = merged['peak'][keep]
+        detections['mean_temp'] = merged['temp_sum'][keep] / area
+        detections['area'] = area
+        detections['pixel_x'] = cx
+        detections['pixel_y'] = cy
+        detections['bbox_x'] = merged['left'][keep]
+        detections['bbox_y'] = merged['top'][keep]
+        detections['bbox_w'] = merged['right'][keep] - merged['left'][keep] + 1
+        detections['bbox_h'] = merged['bottom'][keep] - merged['top'][keep] + 1
+        return detections
@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+"""
+Pipelined capture / process / transmit for thermal droplet tracking
+Each stage runs on its own thread and hands work over through bounded
+queues, so a slow frame cannot stall acquisition
+"""
+
+import time
+import threading
+from collections import deque
+import numpy as np
+
+from latency_metrics import LatencyMonitor
+
+# Overflow policies for a full stage queue
+DROP_OLDEST = 'drop_oldest'  # Discard the oldest queued item, never wait
+BLOCK = 'block'              # Wait for the consumer to make room
+
+OVERFLOW_POLICIES = (DROP_OLDEST, BLOCK)
+
+# Optional per-frame work, in the order it is shed when processing falls
+# behind: visualizer updates, flight recorder, scheduled ROI full-frame sweeps
+SHED_WORK = ('display', 'record', 'sweep')
+
+# Why a frame was never processed
+SHED_OVERFLOW = 'overflow'  # Ring full, recycled by the capture stage
+SHED_STALE = 'stale'        # Skipped to reach the newest frame
+
+
+def _check_policy(policy):
+    if policy not in OVERFLOW_POLICIES:
+        raise ValueError(
+            f"Unknown overflow policy '{policy}' (expected one of {OVERFLOW_POLICIES})"
+        )
+    return policy
+
+
+class StageQueue:
+    """Bounded FIFO between two pipeline stages with an overflow policy"""
+
+    def __init__(self, maxsize, policy=DROP_OLDEST):
+        self.maxsize = max(1, maxsize)
+        self.policy = _check_policy(policy)
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.max_depth = 0
+
+    def put(self, item):
+        """Queue an item; returns False if the queue was closed"""
+        with self.cond:
+            while len(self.items) >= self.maxsize:
+                if self.closed:
+                    return False
+                if self.policy == DROP_OLDEST:
+                    self.items.popleft()
+                    self.dropped += 1
+                    break
+                self.cond.wait()
+            if self.closed:
+                return False
+            self.items.append(item)
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.cond.notify_all()
+            return True
+
+    def get(self):
+        """Next item, or None once the queue is closed and drained"""
+        with self.cond:
+            while not self.items:
+                if self.closed:
+                    return None
+                self.cond.wait()
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __len__(self):
+        return len(self.items)
+
+
+class FrameRing:
+    """
+    Preallocated ring of frame buffers between capture and processing
+
+    Holds up to `capacity` frames waiting to be processed, plus one buffer
+    being written by the capture stage and one being processed. When all
+    slots are queued, DROP_OLDEST recycles the oldest waiting frame and
+    BLOCK makes the capture stage wait. The IDs of the last shed_history
+    frames that were dropped unprocessed are kept in `shed` with the reason.
+    """
+
+    def __init__(self, capacity, shape, dtype=np.uint16, policy=DROP_OLDEST,
+                 shed_history=1024):
+        self.capacity = max(1, capacity)
+        self.policy = _check_policy(policy)
+        self.buffers = np.zeros((self.capacity + 2,) + tuple(shape), dtype=dtype)
+        self.free = deque(range(self.capacity + 2))
+        self.ready = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.skipped = 0
+        self.shed = deque(maxlen=shed_history)  # (frame_id, reason)
+        self.max_depth = 0
+
+    def acquire(self):
+        """Get a slot index to write the next frame into (None if closed)"""
+        with self.cond:
+            while True:
+                if self.closed:
+                    return None
+                if len(self.ready) < self.capacity and self.free:
+                    return self.free.popleft()
+                if self.policy == DROP_OLDEST and self.ready:
+                    slot, meta = self.ready.popleft()
+                    self.dropped += 1
+                    self.shed.append((meta['frame_id'], SHED_OVERFLOW))
+                    return slot
+                self.cond.wait()
+
+    def publish(self, slot, meta):
+        """Hand a filled slot to the processing stage"""
+        with self.cond:
+            self.ready.append((slot, meta))
+            self.max_depth = max(self.max_depth, len(self.ready))
+            self.cond.notify_all()
+
+    def take(self):
+        """Oldest filled (slot, meta), or None once closed and drained"""
+        with self.cond:
+            while not self.ready:
+                if self.closed:
+                    return None
+                self.cond.wait()
+            return self.ready.popleft()
+
+    def skip_stale(self, cutoff_ns):
+        """
+        If the oldest waiting frame became ready before cutoff_ns, recycle
+        every waiting frame but the newest. Returns the skipped frame IDs.
+        """
+        with self.cond:
+            if len(self.ready) < 2 or self.ready[0][1]['ready_ns'] >= cutoff_ns:
+                return []
+            skipped = []
+            while len(self.ready) > 1:
+                slot, meta = self.ready.popleft()
+                self.free.append(slot)
+                skipped.append(meta['frame_id'])
+                self.shed.append((meta['frame_id'], SHED_STALE))
+            self.skipped += len(skipped)
+            self.cond.notify_all()
+            return skipped
+
+    def release(self, slot):
+        """Return a processed slot to the free list"""
+        with self.cond:
+            self.free.append(slot)
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __len__(self):
+        return len(self.ready)
+
+
+class FrameScheduler:
+    """
+    Decides how much optional work each frame gets, from how late it is
+
+    A frame is late when it finishes processing more than one frame period
+    after it was ready in the ring: the next frame is already waiting. Each
+    late frame raises the shed level by one, dropping the next item of
+    SHED_WORK; recover_frames on-time frames in a row lower it by one.
+    Only once all optional work is shed may frames be skipped: when the
+    oldest waiting frame has waited max_lag_frames periods, processing
+    jumps to the newest one (skip=False processes every frame).
+    """
+
+    def __init__(self, frame_period=1/60.0, max_lag_frames=2, recover_frames=30,
+                 skip=True):
+        self.period_ns = int(frame_period * 1e9)
+        self.max_lag_ns = int(max_lag_frames * self.period_ns)
+        self.recover_frames = recover_frames
+        self.skip = skip
+        self.level = 0
+        self.max_level = 0
+        self.on_time = 0
+        self.late = 0
+        self.shed_counts = dict.fromkeys(SHED_WORK, 0)  # Sweeps count in RoiDetector
+
+    def sheds(self, work):
+        """Whether optional work is shed at the current level"""
+        return SHED_WORK.index(work) < self.level
+
+    def runs(self, work):
+        """Whether optional work due now runs (counted if shed)"""
+        if self.sheds(work):
+            self.shed_counts[work] += 1
+            return False
+        return True
+
+    def stale_cutoff(self, now_ns):
+        """Ring readiness time before which frames should be skipped (None = keep all)"""
+        if not self.skip or self.level < len(SHED_WORK):
+            return None
+        return now_ns - self.max_lag_ns
+
+    def finish(self, ready_ns, done_ns):
+        """Account one processed frame and update the shed level"""
+        if done_ns - ready_ns > self.period_ns:
+            self.late += 1
+            self.on_time = 0
+            if self.level < len(SHED_WORK):
+                self.level += 1
+                self.max_level = max(self.max_level, self.level)
+        else:
+            self.on_time += 1
+            if self.level and self.on_time >= self.recover_frames:
+                self.level -= 1
+                self.on_time = 0
+
+    def shedding(self):
+        """Names of the optional work currently shed"""
+        return SHED_WORK[:self.level]
+
+
+class TrackingPipeline:
+    """
+    Runs ThermalDropletTracker as capture → process → transmit threads
+
+    The capture thread copies each frame into the ring and releases the
+    camera buffer immediately. The processing thread detects and tracks,
+    then queues a track snapshot for the send thread. With send_thread
+    False the snapshot is sent inline by the processing thread. With a
+    display (shared_display.DisplayProcess) every display_interval-th frame
+    and its tracks are published to the visualizer process. With echo
+    an extra thread times the round trip of framed datagrams from the
+    timestamp echoes returned by the FPGA stand-in.
+
+    A FrameScheduler sheds display updates, recording and scheduled ROI
+    sweeps when frames finish late. With drop_frames it then skips to the
+    newest frame instead of working through a backlog, and a full ring
+    recycles its oldest frame; without it every frame is processed and
+    capture blocks on a full ring. Dropped frame IDs are in shed_frames().
+    With a collector (gc_control.IdleCollector) garbage collection is
+    frozen while the pipeline runs and happens after a frame when no
+    other frame is waiting.
+    """
+
+    def __init__(self, tracker, queue_size=3, drop_frames=False,
+                 send_queue_size=2, send_overflow=DROP_OLDEST,
+                 send_thread=True, display=None, display_interval=4, echo=False,
+                 frame_period=1/60.0, max_lag_frames=2, recover_frames=30,
+                 collector=None):
+        self.tracker = tracker
+        self.source = tracker.frame_source
+        self.queue_size = queue_size
+        self.frame_overflow = DROP_OLDEST if drop_frames else BLOCK
+        self.scheduler = FrameScheduler(frame_period, max_lag_frames, recover_frames,
+                                        skip=drop_frames)
+        self.collector = collector
+        self.send_thread = send_thread
+        self.display = display
+        self.display_interval = max(1, display_interval)
+        self._displayed_frame = None
+        self.echo = echo
+
+        self.ring = None
+        self.send_queue = StageQueue(send_queue_size, send_overflow)
+
+        self.stop_event = threading.Event()
+        self.sending_done = threading.Event()
+        self.threads = []
+
+        # Stage latency histograms (each written by a single stage)
+        self.latency = LatencyMonitor()
+
+        # Counters (each written by a single stage)
+        self.captured = 0
+        self.incomplete = 0
+        self.processed = 0
+        self.sent = 0
+        self.errors = 0
+        self.echoes = 0
+        self.bad_echoes = 0
+
+    def start(self):
+        """Start acquisition and the stage threads"""
+        self.ring = FrameRing(
+            self.queue_size,
+            (self.source.height, self.source.width),
+            policy=self.frame_overflow
+        )
+        if self.collector is not None:
+            self.collector.start()
+        self.source.begin()
+
+        stages = [('capture', self._capture_loop), ('process', self._process_loop)]
+        if self.send_thread:
+            stages.append(('send', self._send_loop))
+        if self.echo:
+            stages.append(('echo', self._echo_loop))
+        for name, target in stages:
+            thread = threading.Thread(target=target, name=f"thermal-{name}",
+                                      daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def stop(self):
+        """Stop capturing and wait for queued work to drain"""
+        self.stop_event.set()
+        if self.ring is not None:
+            self.ring.close()  # Wake a capture stage blocked on a full ring
+        self.join()
+        self.source.end()
+        if self.collector is not None:
+            self.collector.stop()
+
+    def join(self, timeout=None):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def stats(self):
+        """Stage counters and queue depths"""
+        ring = self.ring
+        scheduler = self.scheduler
+        return {
+            'captured': self.captured,
+            'incomplete': self.incomplete,
+            'processed': self.processed,
+            'sent': self.sent,
+            'errors': self.errors,
+            'frames_dropped': (ring.dropped + ring.skipped) if ring is not None else 0,
+            'frames_skipped': ring.skipped if ring is not None else 0,
+            'frames_late': scheduler.late,
+            'shed_level': scheduler.level,
+            'shed_max_level': scheduler.max_level,
+            'display_shed': scheduler.shed_counts['display'],
+            'record_shed': scheduler.shed_counts['record'],
+            'sweeps_deferred': self.tracker.roi.deferred,
+            'snapshots_dropped': self.send_queue.dropped,
+            'frame_queue_depth': len(ring) if ring is not None else 0,
+            'frame_queue_max': ring.max_depth if ring is not None else 0,
+            'send_queue_depth': len(self.send_queue),
+            'echoes': self.echoes,
+            'bad_echoes': self.bad_echoes,
+        }
+
+    def shed_frames(self):
+        """(frame_id, reason) of recently dropped frames, oldest first"""
+        return list(self.ring.shed) if self.ring is not None else []
+
+    # Stages --------------------------------------------------------------
+
+    def _capture_loop(self):
+        """Grab frames, copy them into the ring and release camera buffers"""
+        try:
+            while not self.stop_event.is_set():
+                image_result = self.source.next_image(1000)
+                if image_result is None:
+                    break
+
+                if image_result.IsIncomplete():
+                    image_result.Release()
+                    self.incomplete += 1
+                    if self.tracker.recorder is not None:
+                        self.tracker.recorder.note_incomplete()
+                    continue
+
+                arrived = time.perf_counter_ns()
+                camera_timestamp = image_result.GetTimeStamp()
+                slot = self.ring.acquire()
+                if slot is None:
+                    image_result.Release()
+                    break
+                np.copyto(self.ring.buffers[slot], image_result.GetNDArray())
+                image_result.Release()
+                ready = time.perf_counter_ns()
+                meta = {
+                    'frame_id': self.captured,
+                    'camera_timestamp': camera_timestamp,
+                    'camera_host_ns': self.tracker.camera_clock.update(camera_timestamp,
+                                                                       arrived),
+                    'ready_ns': ready,
+                    'capture_time': time.perf_counter(),
+                }
+                self.latency.record('grab', ready - meta['camera_host_ns'], self.captured)
+                self.ring.publish(slot, meta)
+                self.captured += 1
+        except Exception as e:
+            print(f"\nCapture error: {e}")
+            self.errors += 1
+        finally:
+            self.ring.close()
+
+    def _process_loop(self):
+        """Detect and track, then hand track snapshots to the send stage"""
+        tracker = self.tracker
+        scheduler = self.scheduler
+        try:
+            while True:
+                cutoff = scheduler.stale_cutoff(time.perf_counter_ns())
+                if cutoff is not None:
+                    self.ring.skip_stale(cutoff)
+                item = self.ring.take()
+                if item is None:
+                    break
+                slot, meta = item
+                frame_id = meta['frame_id']
+                self.latency.record('queue', time.perf_counter_ns() - meta['ready_ns'],
+                                    frame_id)
+                frame = self.ring.buffers[slot]
+                tracker.roi.defer_sweeps = scheduler.sheds('sweep')
+                try:
+                    detections = tracker.track_frame(frame, meta['camera_timestamp'])
+                    for stage in ('detect', 'associate', 'filter'):
+                        self.latency.record(stage, tracker.stage_ns[stage], frame_id)
+                    snapshot = tracker.trackers.snapshot()
+                    if tracker.recorder is not None and scheduler.runs('record'):
+                        start = time.perf_counter_ns()
+                        tracker.recorder.record(frame, snapshot, frame_id,
+                                                meta['camera_timestamp'], len(detections))
+                        self.latency.record('record', time.perf_counter_ns() - start,
+                                            frame_id)
+                    if self.display is not None and (
+                            self._displayed_frame is None
+                            or frame_id - self._displayed_frame >= self.display_interval
+                    ) and scheduler.runs('display'):
+                        self.display.publish(frame, detections, snapshot, frame_id,
+                                             meta['camera_timestamp'])
+                        self._displayed_frame = frame_id
+                except Exception as e:
+                    print(f"\nFrame processing error: {e}")
+                    self.errors += 1
+                    continue
+                finally:
+                    self.ring.release(slot)
+                    scheduler.finish(meta['ready_ns'], time.perf_counter_ns())
+
+                item = (snapshot, meta)
+                if self.send_thread:
+                    self.send_queue.put(item)
+                else:
+                    self._send(item)
+                tracker.frame_times.append(time.time())
+                self.processed += 1
+                if self.collector is not None:
+                    pause = self.collector.poll(idle=len(self.ring) == 0)
+                    if pause:
+                        self.latency.record('gc', pause, frame_id)
+        finally:
+            self.send_queue.close()
+            if not self.send_thread:
+                self.sending_done.set()
+
+    def _send_loop(self):
+        """Transmit track snapshots to the FPGA"""
+        try:
+            while True:
+                item = self.send_queue.get()
+                if item is None:
+                    break
+                self._send(item)
+        finally:
+            self.sending_done.set()
+
+    def _echo_loop(self):
+        """Record round-trip latency from timestamp echoes"""
+        while not self.stop_event.is_set():
+            try:
+                echo = self.tracker.receive_echo(0.1)
+            except ValueError:
+                self.bad_echoes += 1
+                continue
+            except OSError:
+                break  # Socket closed on shutdown
+            if echo is None:
+                # Nothing left in flight once sending has finished
+                if self.sending_done.is_set():
+                    break
+                continue
+            sequence, round_trip_ns = echo
+            self.latency.record('rtt', round_trip_ns, sequence)
+            self.echoes += 1
+
+    def _send(self, item):
+        snapshot, meta = item
+        try:
+            start = time.perf_counter_ns()
+            self.tracker.send_to_fpga(snapshot, meta['camera_timestamp'])
+            done = time.perf_counter_ns()
+            self.latency.record('send', done - start, meta['frame_id'])
+            self.latency.record('total', done - meta['camera_host_ns'], meta['frame_id'])
+            self.sent += 1
+        except (OSError, ValueError) as e:
+            print(f"\nFPGA send error: {e}")
+            self.errors += 1
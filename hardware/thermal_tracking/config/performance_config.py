@@ -5,7 +5,6 @@ These settings maximize real-time performance for 60Hz operation
 """
 
 import os
-import psutil
 
 # Network optimization for GigE Vision
 NETWORK_CONFIG = {
@@ -23,9 +22,10 @@ CAMERA_CONFIG = {
     'packet_delay': 0,        # Microseconds between packets (0 = max speed)
     'frame_burst': 1,         # Frames per burst
     'binning': None,          # No binning for max resolution
-    'roi': None,              # Full frame (320x256)
+    'roi': None,              # Full frame (sensor resolution)
     'pixel_format': 'Mono14', # 14-bit for temperature data
     'chunk_mode': True,       # Enable metadata chunks
+    'timestamp_delay_ms': 0.0,  # Exposure → chunk timestamp latency not seen by the host
     'event_notification': False,  # Polling is more deterministic
     'trigger_mode': 'Off'     # Free-running at max frame rate
 }
@@ -38,7 +38,26 @@ PROCESSING_CONFIG = {
     'numpy_threads': 2,       # NumPy internal parallelism
     'opencv_threads': 2,      # OpenCV internal parallelism
     'queue_size': 3,          # Frame buffer size (frames)
-    'drop_frames': False,     # Process every frame
+    'drop_frames': False,     # Process every frame (True = skip to the newest when behind)
+    'max_lag_frames': 2,      # Frame age (periods) that triggers a skip to the newest
+    'shed_recover_frames': 30,  # On-time frames before shed optional work resumes
+    'send_queue_size': 2,     # Track snapshots waiting for transmit
+    'send_overflow': 'drop_oldest',  # 'drop_oldest' or 'block' when send queue full
+    'roi_detection': False,   # Detect around predicted tracks between full sweeps
+    'roi_sweep_interval': 30, # Frames between full-frame sweeps in ROI mode
+    'roi_entry_band': 16,     # Rows under the crucible outlets always searched
+    'gc_mode': 'idle',        # 'idle': frozen start-up heap, GC between frames; 'auto'
+    'detection_tiles': None,  # 'ROWSxCOLS' tiled full-frame detection for large sensors
+    'detection_workers': None,  # Tile worker threads (None = one per tile)
+    'camera_rig': None,       # Calibrated multi-camera rig (.npy); None = single camera
+    'fusion_max_skew_ms': 20.0,  # Camera reports older than this sit a fused frame out
+    'fusion_gate_mm': 10.0,   # Ray distance for matching tracks across cameras
+    'display_rate': 15,       # Visualizer redraws per second (separate process)
+    'recorder_seconds': 10,   # Flight recorder ring length (0 = disabled, ~14 MB/s at 60 Hz)
+    'recorder_dir': 'recordings',  # Where flight recorder dumps are written
+    'metrics_port': 0,        # Local HTTP port for /metrics (0 = disabled)
+    'metrics_file': None,     # Path rewritten with metrics every second (None = disabled)
+    'control_socket': 'logs/thermal_control.sock',  # Local control channel (None = disabled)
     'profile_enabled': False  # Disable profiling in production
 }
 
@@ -54,19 +73,111 @@ SYSTEM_CONFIG = {
 
 # Kalman filter tuning for 60Hz
 KALMAN_CONFIG = {
-    'dt': 1/60.0,              # Time step (60Hz)
+    'dt': 1/60.0,              # Nominal time step (60Hz); real steps come from camera timestamps
+    'motion_model': 'ballistic',  # 'ballistic' (gravity + drag) or 'constant_velocity'
+    'gravity_mm_s2': (0.0, 9810.0),  # Image axes, +y down the image (level camera)
+    'drag_per_s': 0.0,         # Linear drag coefficient (1/s, 0 = free fall)
+    'initial_velocity_covariance': 1e4,  # New-track velocity prior ((mm/s)²)
+    'initial_velocity_mm_s': (0.0, 0.0),  # New-track velocity (image axes)
     'process_noise': 0.1,      # Process noise covariance
     'measurement_noise': 0.5,  # Position measurement noise (mm)
     'temp_noise': 5.0,         # Temperature noise (°C)
     'velocity_noise': 0.01,    # Velocity process noise
-    'max_missed_frames': 5,    # Frames before track is lost
-    'min_track_age': 3         # Frames before track is stable
+    'max_missed_frames': 5,    # Consecutive misses before a confirmed track is lost
+    'min_track_age': 3         # Updates before a track is confirmed and sent to the FPGA
+}
+
+# Online calibration from free-falling droplets (code/self_calibration.py)
+CALIBRATION_CONFIG = {
+    'self_calibration': False,  # Fit pixel_to_mm from confirmed tracks while running
+    'interval_s': 10.0,        # Seconds between background fits
+    'min_tracks': 10,          # Free-fall tracks that must agree before publishing
+    'max_residual_px': 0.5,    # RMS fit residual above which a track is not free fall
+    'max_spread': 0.03,        # Relative spread of track scales allowed for publishing
+    'min_change': 0.005,       # Relative scale change worth applying
+    'max_change': 0.25,        # Larger changes are rejected as implausible
+    'estimate_tilt': False,    # Also turn the ballistic gravity vector to the fitted tilt
+    'save_on_exit': True,      # Write an applied estimate to camera_calibration.npy
+    'capture_frames': 60,      # Frames averaged by --calibrate (600+ for Level 2+ steel)
+    'noise_threshold_sigma': 0.0,  # Adaptive thresholds: pixel noise margin (0 = off)
+    # Sensor calibration versions (code/sensor_calibration.py)
+    'sensor_dir': 'calibration/sensor',  # Version directories + CURRENT pointer
+    'reload_interval_s': 1.0,  # How often CURRENT is checked for a new version
+    'material': None,          # Alloy being printed (emissivity table); None = blackbody
+    'reflected_temp_c': 25.0,  # Chamber wall temperature reflected by the droplets
+    # Approximate LWIR emissivity of the molten alloys of ComponentRegistry
+    # LEVEL_CAPABILITIES; replace with values measured on the rig
+    'material_emissivity': {
+        'Al': 0.15,
+        'Steel': 0.30,
+        'Ti': 0.35,
+        'Cu': 0.10,
+        'Ni': 0.30
+    }
+}
+
+# Offline parameter tuning (tune_tracker.py, code/parameter_tuning.py)
+TUNING_CONFIG = {
+    'output': 'calibration/tuned_parameters.json',  # Ranked parameter file (--params)
+    'search': 'bayes',         # 'bayes' (model-based) or 'grid'
+    'trials': 64,              # Settings evaluated by the model-based search
+    'grid_points': 3,          # Values per range in a grid search
+    'workers': None,           # Worker processes (None = one per core)
+    'match_px': 4.0,           # Track ↔ ground-truth match radius (pixels)
+    # Score = continuity − Σ weight × penalty (higher is better)
+    'weights': {
+        'continuity': 1.0,         # Fraction of droplet-frames covered by a confirmed track
+        'id_switches': 0.5,        # Track ID changes per droplet
+        'position_error_mm': 0.2,  # RMS position error of matched tracks
+        'false_tracks': 0.5,       # Fraction of confirmed track-frames on no droplet
+        'compute_ms': 0.05,        # p99 tracking time per frame
+    },
+    # Searched parameters (control_server.PARAMETERS names = KALMAN_CONFIG
+    # keys): (low, high), (low, high, 'log') or a list of values
+    'space': {
+        'min_temp_celsius': (150.0, 280.0),
+        'association_gate_mm': (2.0, 20.0),
+        'max_missed_frames': (1, 10),
+        'process_noise': (0.01, 10.0, 'log'),
+        'velocity_noise': (0.001, 10.0, 'log'),
+        'measurement_noise': (0.05, 5.0, 'log'),
+    }
+}
+
+# Offline deflection analysis of high-speed footage for TE-000
+# (analyze_deflection.py, code/deflection_analysis.py)
+DEFLECTION_CONFIG = {
+    'output_dir': 'logs/deflection',  # deflections.npy/.csv + summary.json
+    'fps': 2000.0,             # Frame rate when the footage has no timestamps
+    'pixel_to_mm': 0.02,       # Scale of the high-speed camera (mm/pixel)
+    'bit_depth': 12,           # Significant bits of the camera frames (scaled to 14)
+    'dark_droplets': True,     # Backlit droplets are dark on a bright background
+    'threshold': 2000.0,       # Detection threshold (camera counts, after inversion)
+    'fall_speed_mm_s': 1050.0,  # Expected fall speed (docs/analysis/acoustic.md); new tracks start at it
+    'association_gate_mm': None,  # Track gate (mm); None = one frame of fall, at least min_gate_mm
+    'min_gate_mm': 0.5,        # Smallest derived gate
+    'measurement_noise': 0.01,  # Centroid noise at that scale (mm)
+    'tilt_deg': 0.0,           # Camera roll: fall direction relative to image +y
+    'min_points': 20,          # Detections needed to analyse a track
+    'entry_fraction': 0.0,     # Field-free lead of a track fitted as its entry path (0 = fit tangent)
+    'shard_frames': 20000,     # Frames whose new droplets one worker owns
+    'lead_frames': 20,         # Frames read before a shard so tracks are established
+    'max_track_frames': 5000,  # Frames a shard may read past its end to finish tracks
+    'workers': None,           # Worker processes (None = one per core)
+    'threshold_mm': 0.5,       # TE-000 acceptance: lateral deflection above this
+    'min_fraction': 0.5,       # Share of droplets that must exceed it
+    'verification_dir': '../../test_management/verification_status'  # --attach target
 }
 
 # FPGA communication settings
 FPGA_CONFIG = {
     'protocol': 'UDP',         # UDP for low latency
-    'packet_size': 28,         # 7 floats × 4 bytes
+    'packet_format': 'legacy', # 'legacy' (datagram per track) or 'framed' (per frame)
+    'timestamp_echo': False,   # Time round trips from stand-in echoes (fpga_link_test.py)
+    'latency_compensation': True,  # Send states predicted to actuation time
+    'link_delay_ms': 0.1,      # One-way link delay until echoes measure it
+    'actuation_delay_ms': 0.5, # FPGA receive → transducer update
+    'packet_size': 28,         # 7 floats × 4 bytes (per track record)
     'send_rate': 60,           # Hz (match camera rate)
     'socket_buffer': 65536,    # Socket buffer size
     'no_delay': True,          # Disable Nagle algorithm
@@ -106,6 +217,7 @@ def apply_network_optimizations():
 def apply_process_optimizations():
     """Apply process-level optimizations"""
     import resource
+    import psutil
     
     # Set process priority
     os.nice(SYSTEM_CONFIG['process_priority'])
@@ -164,6 +276,8 @@ def configure_spinnaker_optimizations(camera):
 
 def get_performance_stats():
     """Get current performance statistics"""
+    import psutil
+    
     stats = {
         'cpu_percent': psutil.cpu_percent(interval=1),
         'memory_percent': psutil.virtual_memory().percent,
@@ -184,6 +298,8 @@ def get_performance_stats():
 
 def validate_system_requirements():
     """Check if system meets performance requirements"""
+    import psutil
+    
     issues = []
     
     # Check CPU cores
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Software FPGA stand-in for the thermal tracker
+Listens on the FPGA UDP port and reports loss, reordering and jitter of
+the track stream; --soak runs the tracker on a synthetic 60 Hz scene
+against a local stand-in and checks the transmit path against the
+SR014 loop budget
+"""
+
+import sys
+import os
+import json
+import time
+import argparse
+import multiprocessing
+sys.path.append(os.path.join(os.path.dirname(__file__), 'code'))
+
+from fpga_standin import FpgaStandIn, format_stats
+from config.performance_config import PROCESSING_CONFIG, FPGA_CONFIG
+
+# SR014: total control loop time (see docs/behavioral/diagrams/control-loop.py)
+LOOP_BUDGET_MS = 3.0
+
+
+def listen(args):
+    """Receive until Ctrl+C or --duration, printing stats every interval"""
+    standin = FpgaStandIn(args.host, args.port, echo=args.echo,
+                          budget_ms=args.budget_ms)
+    host, port = standin.start()
+    print(f"FPGA stand-in listening on {host}:{port}"
+          f"{' (echoing timestamps)' if args.echo else ''}")
+    start = time.time()
+    try:
+        while not args.duration or time.time() - start < args.duration:
+            time.sleep(args.interval)
+            print(format_stats(standin.stats()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        standin.stop()
+    return standin.stats()
+
+
+def standin_process(conn, port, budget_ms):
+    """Soak-test stand-in, in its own process so it does not share the GIL"""
+    standin = FpgaStandIn('127.0.0.1', port, echo=True, budget_ms=budget_ms)
+    conn.send(standin.start())
+    while True:
+        command = conn.recv()
+        if command == 'stop':
+            standin.stop()
+            conn.send(standin.stats())
+            return
+        conn.send(standin.stats())
+
+
+def soak(args):
+    """Run the tracker at 60 Hz against a local stand-in"""
+    from thermal_droplet_tracker import ThermalDropletTracker
+    from synthetic_scene import SyntheticDropletScene, SyntheticFrameSource
+    from tracking_pipeline import TrackingPipeline
+
+    conn, child_conn = multiprocessing.Pipe()
+    child = multiprocessing.Process(target=standin_process,
+                                    args=(child_conn, args.port, args.budget_ms),
+                                    daemon=True)
+    child.start()
+    host, port = conn.recv()
+
+    scene = SyntheticDropletScene(num_droplets=args.droplets,
+                                  droplet_temp=args.droplet_temp, seed=args.seed)
+    num_frames = int(args.duration * scene.frame_rate) if args.duration else None
+    tracker = ThermalDropletTracker(
+        fpga_ip=host,
+        fpga_port=port,
+        frame_source=SyntheticFrameSource(scene, num_frames, speed=1.0)
+    )
+    tracker.min_temp_celsius = args.min_temp
+    tracker.fpga_protocol = 'framed'
+    tracker.latency_compensation = FPGA_CONFIG['latency_compensation']
+    tracker.actuation_delay_ns = int(FPGA_CONFIG['actuation_delay_ms'] * 1e6)
+    tracker.max_droplets = max(tracker.max_droplets, args.droplets)
+
+    pipeline = TrackingPipeline(
+        tracker,
+        queue_size=PROCESSING_CONFIG['queue_size'],
+        drop_frames=PROCESSING_CONFIG['drop_frames'],
+        send_queue_size=PROCESSING_CONFIG['send_queue_size'],
+        send_overflow=PROCESSING_CONFIG['send_overflow'],
+        echo=True
+    )
+    duration = f"{args.duration:g}s" if args.duration else "until Ctrl+C"
+    print(f"Soak test: {args.droplets} droplets at {scene.frame_rate:g} Hz for {duration}, "
+          f"stand-in on {host}:{port}, budget {args.budget_ms:.1f} ms\n")
+
+    pipeline.start()
+    try:
+        while pipeline.is_running():
+            report_at = time.time() + args.interval
+            while pipeline.is_running() and time.time() < report_at:
+                time.sleep(0.1)
+            conn.send('stats')
+            print(soak_line(conn.recv(), pipeline))
+    except KeyboardInterrupt:
+        print("\nStopping soak test...")
+    finally:
+        pipeline.stop()
+        conn.send('stop')
+        standin_stats = conn.recv()
+        child.join()
+        tracker.cleanup()
+
+    return soak_report(standin_stats, pipeline, args.budget_ms)
+
+
+def soak_line(standin_stats, pipeline):
+    latency = pipeline.latency.summary()
+    return (f"{format_stats(standin_stats)} | "
+            f"send p99 {latency['send']['p99'] / 1e6:.3f} ms, "
+            f"rtt p99/max {latency['rtt']['p99'] / 1e6:.3f}/{latency['rtt']['max'] / 1e6:.3f} ms")
+
+
+def soak_report(standin_stats, pipeline, budget_ms):
+    """Final soak summary; passes when no datagram was lost or over budget"""
+    budget_ns = int(budget_ms * 1e6)
+    histograms = pipeline.latency.histograms
+    stats = pipeline.stats()
+    report = {
+        'budget_ms': budget_ms,
+        'pipeline': stats,
+        'latency': pipeline.latency.summary(),
+        'standin': standin_stats,
+        'send_over_budget': histograms['send'].count_above(budget_ns),
+        'rtt_over_budget': histograms['rtt'].count_above(budget_ns),
+        'unanswered': stats['sent'] - stats['echoes'],
+        'fpga_clock': pipeline.tracker.fpga_clock.stats(),
+        'actuation_lead_ns': pipeline.tracker.last_lead_ns,
+    }
+    report['passed'] = (report['rtt_over_budget'] == 0
+                        and report['send_over_budget'] == 0
+                        and report['unanswered'] == 0
+                        and standin_stats['lost'] == 0
+                        and standin_stats['bad'] == 0
+                        and stats['echoes'] > 0)
+
+    print("\n" + "=" * 50)
+    print("SOAK TEST SUMMARY")
+    print("=" * 50)
+    print(f"Frames: {stats['captured']} captured, {stats['processed']} processed, "
+          f"{stats['sent']} sent, {stats['frames_dropped']} dropped")
+    print(f"Stand-in: {standin_stats['framed']} datagrams, {standin_stats['lost']} lost, "
+          f"{standin_stats['reordered']} reordered, {standin_stats['duplicates']} duplicated, "
+          f"{standin_stats['bad']} bad, {standin_stats['late']} late")
+    print(f"Echoes: {stats['echoes']} ({report['unanswered']} unanswered)")
+    print("Latency (ms)   p50      p99      max")
+    for stage in ('send', 'total', 'rtt'):
+        s = report['latency'][stage]
+        print(f"  {stage:<10} {s['p50'] / 1e6:7.3f}  {s['p99'] / 1e6:7.3f}  {s['max'] / 1e6:7.3f}")
+    clock = report['fpga_clock']
+    print(f"Stand-in clock offset {clock['offset_ns'] / 1e3:+.1f} us (same host: expect ~0), "
+          f"one-way delay {clock['one_way_ns'] / 1e3:.1f} us")
+    print(f"Over {budget_ms:.1f} ms budget: send {report['send_over_budget']}, "
+          f"round trip {report['rtt_over_budget']}")
+    print(f"Result: {'PASS' if report['passed'] else 'FAIL'}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Software FPGA stand-in: receive tracker packets and measure the link"
+    )
+    parser.add_argument('--host', default='0.0.0.0',
+                        help='Address to listen on')
+    parser.add_argument('--port', type=int, default=5000,
+                        help='UDP port to listen on (soak: 0 = any free port)')
+    parser.add_argument('--echo', action='store_true',
+                        help='Echo timestamps of framed datagrams back to the sender')
+    parser.add_argument('--budget-ms', type=float, default=LOOP_BUDGET_MS,
+                        help='Transmit budget for late / over-budget counts (ms)')
+    parser.add_argument('--interval', type=float, default=10.0,
+                        help='Seconds between status lines')
+    parser.add_argument('--duration', type=float, default=0,
+                        help='Stop after this many seconds (0 = until Ctrl+C)')
+    parser.add_argument('--soak', action='store_true',
+                        help='Run the tracker on a synthetic 60 Hz scene against a local stand-in')
+    parser.add_argument('--droplets', type=int, default=5,
+                        help='Droplets in view during the soak test')
+    parser.add_argument('--droplet-temp', type=float, default=300.0,
+                        help='Synthetic droplet temperature (°C)')
+    parser.add_argument('--min-temp', type=float, default=200,
+                        help='Tracker minimum temperature (°C)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Scene random seed')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Also write the final statistics as JSON')
+
+    args = parser.parse_args()
+    if args.soak:
+        result = soak(args)
+    else:
+        result = listen(args)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResults saved to {args.json}")
+    if args.soak and not result['passed']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,28 +8,171 @@ import sys
 import signal
 import argparse
 import os
+import time
 sys.path.append(os.path.join(os.path.dirname(__file__), 'code'))
 
 from thermal_droplet_tracker import ThermalDropletTracker
-from thermal_visualizer import ThermalVisualizer
+from frame_sources import FrameSource, ReplayFrameSource
+from synthetic_scene import scene_motion
+from tracking_pipeline import TrackingPipeline
+from latency_metrics import MetricsExporter
+from config.performance_config import PROCESSING_CONFIG, FPGA_CONFIG, CAMERA_CONFIG, KALMAN_CONFIG
+from config.performance_config import CALIBRATION_CONFIG
+from shared_display import DisplayProcess
+from flight_recorder import FlightRecorder, TRIGGER_SIGNAL
+from camera_fusion import MultiCameraTracker, load_camera_rig, live_sources
+from tiled_detection import TiledDetector
+from gc_control import IdleCollector, GC_IDLE, GC_MODES
+from clock_sync import HostClock
+from self_calibration import SelfCalibrator
+from sensor_calibration import SensorCalibrationStore
+from control_server import ControlServer, apply_parameters
+from parameter_tuning import load_tuned_parameters
+
+pipeline = None
+
+# Tuned (control socket) parameters that also have a command-line option
+CLI_PARAMETERS = {
+    'min_temp_celsius': ('min_temp', '--min-temp'),
+    'roi_detection': ('roi', '--roi'),
+    'roi_sweep_interval': ('roi_sweep', '--roi-sweep'),
+    'noise_threshold_sigma': ('noise_sigma', '--noise-sigma'),
+    'latency_compensation': ('latency_compensation', '--latency-compensation'),
+    'fpga_ip': ('fpga_ip', '--fpga-ip'),
+    'fpga_port': ('fpga_port', '--fpga-port'),
+}
+
+
+def given_options(parser, dests):
+    """The dests among dests that were set on the command line"""
+    # argparse only fills in defaults for attributes the namespace lacks
+    unset = object()
+    given = parser.parse_args(namespace=argparse.Namespace(**dict.fromkeys(dests, unset)))
+    return {dest for dest in dests if getattr(given, dest) is not unset}
+
 
 def signal_handler(sig, frame):
     """Clean shutdown on Ctrl+C"""
     print('\nShutting down thermal tracking...')
+    if pipeline is not None:
+        pipeline.stop()
     if 'tracker' in globals():
         tracker.cleanup()
     sys.exit(0)
 
-def load_calibration():
-    """Load saved calibration data"""
+def load_calibration(tracker):
+    """Apply saved calibration data (scale, and image centre for this resolution)"""
     import numpy as np
     try:
         calib_data = np.load('calibration/camera_calibration.npy', allow_pickle=True).item()
         print(f"Loaded calibration: 1 pixel = {calib_data['pixel_to_mm']:.3f} mm")
-        return calib_data['pixel_to_mm']
+        tracker.pixel_to_mm = calib_data['pixel_to_mm']
     except:
         print("No calibration found, using default (0.5 mm/pixel)")
-        return 0.5
+        tracker.pixel_to_mm = 0.5
+        return
+    height, width = tracker.frame_shape
+    if list(calib_data.get('resolution', [])) == [width, height]:
+        tracker.set_image_center(calib_data.get('image_center'))
+    else:
+        print(f"Calibration is for {calib_data.get('resolution')}, not {width}x{height}; "
+              f"using the frame centre")
+
+def save_self_calibration(tracker):
+    """Write the self-calibrated scale into the saved calibration data"""
+    import numpy as np
+    path = 'calibration/camera_calibration.npy'
+    try:
+        calib_data = np.load(path, allow_pickle=True).item()
+    except FileNotFoundError:
+        height, width = tracker.frame_shape
+        calib_data = {'camera_model': 'FLIR A35', 'resolution': [width, height]}
+    stats = tracker.calibrator.stats()
+    calib_data['pixel_to_mm'] = tracker.pixel_to_mm
+    calib_data['self_calibration'] = {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'tracks': stats['tracks'],
+        'spread': stats['spread'],
+        'tilt_deg': stats['tilt_deg'],
+    }
+    np.save(path, calib_data)
+    print(f"Self-calibration saved to {path}")
+
+def run_multi_camera(args, kalman_config, tuned):
+    """Track with every camera of a calibrated rig and send fused 3D tracks"""
+    global tracker
+    cameras = load_camera_rig(args.camera_rig)
+    if args.replay:
+        if len(args.replay) != len(cameras):
+            raise SystemExit(f"--replay needs one recording per camera "
+                             f"({len(cameras)} in {args.camera_rig})")
+        sources = [{'replay': path, 'speed': args.replay_speed, 'loop': args.replay_loop}
+                   for path in args.replay]
+    else:
+        sources = live_sources(cameras)
+    
+    # The main-process tracker only sends: fused frames are timestamped on
+    # the host clock, so no camera clock mapping is needed
+    tracker = ThermalDropletTracker(
+        fpga_ip=args.fpga_ip,
+        fpga_port=args.fpga_port,
+        frame_source=FrameSource()
+    )
+    tracker.camera_clock = HostClock()
+    tracker.min_track_age = 0  # Fused tracks start from confirmed camera tracks
+    tracker.fpga_protocol = args.fpga_protocol
+    tracker.latency_compensation = args.latency_compensation
+    tracker.link_delay_ns = int(FPGA_CONFIG['link_delay_ms'] * 1e6)
+    tracker.actuation_delay_ns = int(FPGA_CONFIG['actuation_delay_ms'] * 1e6)
+    
+    settings = {
+        'min_temp_celsius': args.min_temp,
+        'detection_mode': args.detection,
+        'roi_detection': args.roi,
+    }
+    settings.update((name, value) for name, value in tuned.items()
+                    if name in ('association_metric', 'association_gate_mm', 'mahalanobis_gate',
+                                'noise_threshold_sigma'))
+    fusion = MultiCameraTracker(
+        cameras, sources, tracker, settings, kalman_config,
+        max_skew_ms=PROCESSING_CONFIG['fusion_max_skew_ms'],
+        gate_mm=PROCESSING_CONFIG['fusion_gate_mm'],
+        min_track_age=kalman_config['min_track_age'],
+        max_missed_frames=kalman_config['max_missed_frames']
+    )
+    
+    print("\n" + "="*50)
+    print("MULTI-CAMERA THERMAL TRACKING ACTIVE")
+    print("="*50)
+    print(f"Cameras: {', '.join(c.name or str(i) for i, c in enumerate(cameras))}")
+    print(f"FPGA Target: {args.fpga_ip}:{args.fpga_port} ({args.fpga_protocol} packets, fused XYZ)")
+    print(f"Min Temperature: {args.min_temp:g}°C")
+    print("\nPress Ctrl+C to stop")
+    print("="*50 + "\n")
+    
+    fusion.start()
+    try:
+        start = time.perf_counter()
+        while fusion.is_running():
+            time.sleep(0.1)
+            stats = fusion.stats()
+            elapsed = time.perf_counter() - start
+            rates = ' '.join(f"{n / elapsed:.1f}" for n in stats['camera_frames'])
+            print(f"\rFused: {stats['fused'] / elapsed:.1f} Hz | Cameras: {rates} Hz"
+                  f" | Tracking: {stats['tracks']} droplets", end='')
+    except KeyboardInterrupt:
+        print('\nShutting down thermal tracking...')
+    finally:
+        fusion.stop()
+        stats = fusion.stats()
+        print(f"\nFused {stats['fused']} frames from {stats['camera_frames']} camera frames, "
+              f"{stats['skipped']} late camera reports left out, {stats['births']} tracks started")
+        print("Latency (ms)   p50      p99      max")
+        for stage, s in fusion.latency.summary().items():
+            if s['count']:
+                print(f"  {stage:<10} {s['p50'] / 1e6:7.3f}  {s['p99'] / 1e6:7.3f}  "
+                      f"{s['max'] / 1e6:7.3f}")
+        tracker.cleanup()
 
 def main():
     parser = argparse.ArgumentParser(
@@ -46,6 +189,24 @@ def main():
         default=5000,
         help='FPGA UDP port'
     )
+    parser.add_argument(
+        '--fpga-protocol',
+        choices=['legacy', 'framed'],
+        default=FPGA_CONFIG['packet_format'],
+        help='Packet format: one datagram per track, or one framed datagram per frame'
+    )
+    parser.add_argument(
+        '--fpga-echo',
+        action='store_true',
+        default=FPGA_CONFIG['timestamp_echo'],
+        help='Measure round-trip latency from timestamp echoes (framed packets, FPGA stand-in)'
+    )
+    parser.add_argument(
+        '--latency-compensation',
+        action=argparse.BooleanOptionalAction,
+        default=FPGA_CONFIG['latency_compensation'],
+        help='Send track states predicted to the expected actuation time'
+    )
     parser.add_argument(
         '--visualize',
         action='store_true',
@@ -56,6 +217,12 @@ def main():
         action='store_true',
         help='Run calibration procedure'
     )
+    parser.add_argument(
+        '--calibration-frames',
+        type=int,
+        default=CALIBRATION_CONFIG['capture_frames'],
+        help='Frames averaged by --calibrate (streamed, constant memory; more for steel)'
+    )
     parser.add_argument(
         '--save-frames',
         type=int,
@@ -68,25 +235,198 @@ def main():
         default=600,
         help='Minimum temperature to track (°C)'
     )
+    parser.add_argument(
+        '--detection',
+        choices=['raw', 'legacy'],
+        default='raw',
+        help='Detection mode: threshold raw 14-bit counts, or legacy 8-bit temperatures'
+    )
+    parser.add_argument(
+        '--params',
+        metavar='PATH',
+        help='Tuned parameter file from tune_tracker.py (overrides --min-temp and KALMAN_CONFIG)'
+    )
+    parser.add_argument(
+        '--params-rank',
+        type=int,
+        default=1,
+        help='Which ranked setting of --params to use'
+    )
+    parser.add_argument(
+        '--motion-model',
+        choices=['ballistic', 'constant_velocity'],
+        help='Track motion model: free fall with drag, or constant velocity '
+             '(default: KALMAN_CONFIG, or the motion of a replayed synthetic scene)'
+    )
+    parser.add_argument(
+        '--roi',
+        action='store_true',
+        default=PROCESSING_CONFIG['roi_detection'],
+        help='Detect only around predicted track positions between full-frame sweeps'
+    )
+    parser.add_argument(
+        '--roi-sweep',
+        type=int,
+        default=PROCESSING_CONFIG['roi_sweep_interval'],
+        help='Frames between full-frame sweeps in ROI mode'
+    )
+    parser.add_argument(
+        '--tiles',
+        metavar='ROWSxCOLS',
+        default=PROCESSING_CONFIG['detection_tiles'],
+        help='Split full-frame detection into tiles on a worker pool (e.g. 2x2, for large sensors)'
+    )
+    parser.add_argument(
+        '--gc',
+        choices=GC_MODES,
+        default=PROCESSING_CONFIG['gc_mode'],
+        help='Garbage collection: only between frames with a frozen start-up heap, or Python default'
+    )
+    parser.add_argument(
+        '--material',
+        choices=sorted(CALIBRATION_CONFIG['material_emissivity']),
+        default=CALIBRATION_CONFIG['material'],
+        help='Alloy being printed: temperatures use its emissivity table from the sensor calibration'
+    )
+    parser.add_argument(
+        '--noise-sigma',
+        type=float,
+        default=CALIBRATION_CONFIG['noise_threshold_sigma'],
+        help='Adaptive thresholds: hot pixels must clear this many times their own noise '
+             '(needs a sensor calibration noise map; 0=off)'
+    )
+    parser.add_argument(
+        '--self-calibrate',
+        action=argparse.BooleanOptionalAction,
+        default=CALIBRATION_CONFIG['self_calibration'],
+        help='Refine pixel_to_mm in the background from free-falling droplet tracks'
+    )
+    parser.add_argument(
+        '--drop-frames',
+        action=argparse.BooleanOptionalAction,
+        default=PROCESSING_CONFIG['drop_frames'],
+        help='Skip to the newest frame when processing falls behind (after shedding optional work)'
+    )
+    parser.add_argument(
+        '--record-seconds',
+        type=float,
+        default=PROCESSING_CONFIG['recorder_seconds'],
+        help='Flight recorder length; dumped on SIGUSR1, track loss or incomplete-image bursts (0=disabled)'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        default=PROCESSING_CONFIG['metrics_port'],
+        help='Serve latency metrics on http://127.0.0.1:PORT/metrics (0=disabled)'
+    )
+    parser.add_argument(
+        '--metrics-file',
+        default=PROCESSING_CONFIG['metrics_file'],
+        help='Rewrite latency metrics to this file every second'
+    )
+    parser.add_argument(
+        '--control-socket',
+        default=PROCESSING_CONFIG['control_socket'],
+        help='Unix socket for changing parameters, stats and recording while running '
+             '(see thermal_control.py; empty=disabled)'
+    )
+    parser.add_argument(
+        '--camera-rig',
+        default=PROCESSING_CONFIG['camera_rig'],
+        help='Calibrated camera rig (.npy): track every camera and send fused 3D positions'
+    )
+    parser.add_argument(
+        '--replay',
+        metavar='RECORDING',
+        nargs='+',
+        help='Replay a recorded Mono14 sequence instead of the live camera (one per rig camera)'
+    )
+    parser.add_argument(
+        '--replay-speed',
+        type=float,
+        default=1.0,
+        help='Replay speed relative to real time (0=as fast as possible)'
+    )
+    parser.add_argument(
+        '--replay-loop',
+        action='store_true',
+        help='Restart the replay when the recording ends'
+    )
     
     args = parser.parse_args()
+    kalman_config = dict(KALMAN_CONFIG)
+    if args.motion_model:
+        kalman_config['motion_model'] = args.motion_model
+    
+    # Tuned parameters: filter noise and lifecycle are KALMAN_CONFIG keys
+    tuned = {}
+    if args.params:
+        try:
+            tuned = load_tuned_parameters(args.params, args.params_rank)
+        except (OSError, ValueError, KeyError) as e:
+            parser.error(f"--params: {e}")
+        # Options given on the command line win over the file
+        given = given_options(parser, [dest for dest, _ in CLI_PARAMETERS.values()])
+        for name, (dest, option) in CLI_PARAMETERS.items():
+            if name in tuned and dest in given:
+                print(f"{option} {getattr(args, dest)} replaces tuned {name}={tuned.pop(name)}")
+        kalman_config.update((k, v) for k, v in tuned.items() if k in KALMAN_CONFIG)
+        args.min_temp = tuned.get('min_temp_celsius', args.min_temp)
+        print(f"Tuned parameters (rank {args.params_rank} of {args.params}): "
+              + ", ".join(f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}"
+                          for k, v in tuned.items()))
     
     # Create directories if needed
     os.makedirs('calibration', exist_ok=True)
     os.makedirs('logs', exist_ok=True)
     
+    if args.camera_rig:
+        run_multi_camera(args, kalman_config, tuned)
+        return
+    if args.replay and len(args.replay) > 1:
+        parser.error("several --replay recordings need --camera-rig")
+    
     # Initialize tracker
     global tracker
+    display = None
+    control = None
+    frame_source = None
+    if args.replay:
+        frame_source = ReplayFrameSource(
+            args.replay[0],
+            speed=args.replay_speed,
+            loop=args.replay_loop
+        )
+    
     tracker = ThermalDropletTracker(
         fpga_ip=args.fpga_ip,
-        fpga_port=args.fpga_port
+        fpga_port=args.fpga_port,
+        frame_source=frame_source
     )
     
     tracker.min_temp_celsius = args.min_temp
+    tracker.detection_mode = args.detection
+    tracker.fpga_protocol = args.fpga_protocol
+    tracker.latency_compensation = args.latency_compensation
+    tracker.link_delay_ns = int(FPGA_CONFIG['link_delay_ms'] * 1e6)
+    tracker.actuation_delay_ns = int(FPGA_CONFIG['actuation_delay_ms'] * 1e6)
+    tracker.camera_clock.fixed_delay_ns = int(CAMERA_CONFIG['timestamp_delay_ms'] * 1e6)
+    tracker.configure_kalman(kalman_config)
+    tracker.roi_detection = args.roi
+    tracker.roi.sweep_interval = args.roi_sweep
+    tracker.roi.entry_band = PROCESSING_CONFIG['roi_entry_band']
+    apply_parameters(tracker, tuned)
+    if args.tiles:
+        rows, cols = (int(n) for n in args.tiles.lower().split('x'))
+        tracker.tiler = TiledDetector(tracker, (rows, cols),
+                                      PROCESSING_CONFIG['detection_workers'])
     
     try:
         # Initialize camera
-        print("Initializing FLIR A35 thermal camera...")
+        if args.replay:
+            print("Initializing replay source...")
+        else:
+            print("Initializing FLIR A35 thermal camera...")
         tracker.initialize_camera()
         
         # Load or run calibration
@@ -95,15 +435,73 @@ def main():
             print("CAMERA CALIBRATION PROCEDURE")
             print("="*50)
             from calibration.camera_calibration import calibrate_camera
-            calibrate_camera(tracker)
+            calibrate_camera(tracker, args.calibration_frames)
         else:
-            tracker.pixel_to_mm = load_calibration()
+            load_calibration(tracker)
         
-        # Set up visualization if requested
-        visualizer = None
+        # A synthetic scene falls at its own gravity (often none), not the
+        # ballistic default's 9.81 m/s²
+        if args.replay and not args.motion_model:
+            motion = scene_motion(args.replay[0], tracker.pixel_to_mm)
+            if motion is not None:
+                kalman_config.update(motion)
+                tracker.configure_kalman(kalman_config)
+                print(f"Synthetic scene motion: {motion['motion_model']}, "
+                      f"gravity {motion['gravity_mm_s2'][1]:g} mm/s²")
+        
+        # Versioned sensor calibration (distortion, NUC, emissivity), reloaded
+        # when a new version is published
+        tracker.material = args.material
+        tracker.noise_threshold_sigma = args.noise_sigma
+        store = SensorCalibrationStore(CALIBRATION_CONFIG['sensor_dir'],
+                                       CALIBRATION_CONFIG['reload_interval_s'])
+        store.reload()
+        if not store.apply(tracker):
+            tracker.update_temperature_lut()
+        if tracker.material and (tracker.sensor is None
+                                 or tracker.sensor.temperature_lut(tracker.material) is None):
+            print(f"Warning: no emissivity table for {tracker.material}, "
+                  f"using blackbody temperatures")
+        tracker.calibration_store = store
+        store.start()
+        
+        # Set up visualization if requested (separate process)
         if args.visualize:
-            print("Starting visualization...")
-            visualizer = ThermalVisualizer(tracker)
+            print("Starting visualization process...")
+            display = DisplayProcess(
+                tracker,
+                rate=PROCESSING_CONFIG['display_rate'],
+                save_every=args.save_frames
+            )
+            display.start()
+        
+        # Background scale calibration from free-falling tracks
+        if args.self_calibrate:
+            tracker.calibrator = SelfCalibrator(
+                tracker,
+                interval=CALIBRATION_CONFIG['interval_s'],
+                min_tracks=CALIBRATION_CONFIG['min_tracks'],
+                max_residual_px=CALIBRATION_CONFIG['max_residual_px'],
+                max_spread=CALIBRATION_CONFIG['max_spread'],
+                min_change=CALIBRATION_CONFIG['min_change'],
+                max_change=CALIBRATION_CONFIG['max_change'],
+                estimate_tilt=CALIBRATION_CONFIG['estimate_tilt']
+            )
+            tracker.calibrator.start()
+        
+        # Flight recorder of the last few seconds of frames and tracks
+        if args.record_seconds > 0:
+            source = tracker.frame_source
+            tracker.recorder = FlightRecorder(
+                (source.height, source.width),
+                seconds=args.record_seconds,
+                frame_rate=1.0 / KALMAN_CONFIG['dt'],
+                max_tracks=max(64, tracker.max_droplets),
+                output_dir=PROCESSING_CONFIG['recorder_dir'],
+                to_pixel=tracker.mm_to_pixel
+            )
+            signal.signal(signal.SIGUSR1,
+                          lambda sig, frame: tracker.recorder.trigger(TRIGGER_SIGNAL))
         
         # Register signal handler for clean shutdown
         signal.signal(signal.SIGINT, signal_handler)
@@ -112,50 +510,140 @@ def main():
         print("\n" + "="*50)
         print("THERMAL DROPLET TRACKING ACTIVE")
         print("="*50)
-        print(f"FPGA Target: {args.fpga_ip}:{args.fpga_port}")
-        print(f"Min Temperature: {args.min_temp}°C")
-        print(f"Calibration: {tracker.pixel_to_mm:.3f} mm/pixel")
+        print(f"FPGA Target: {args.fpga_ip}:{args.fpga_port} ({args.fpga_protocol} packets)")
+        print(f"Min Temperature: {args.min_temp:g}°C")
+        print(f"Calibration: {tracker.pixel_to_mm:.3f} mm/pixel"
+              + (" (self-calibrating)" if tracker.calibrator else ""))
+        print(f"Motion model: {tracker.trackers.model.describe()}")
+        print(f"Sensor calibration: "
+              + (tracker.sensor.describe() if tracker.sensor else "none (raw sensor)")
+              + (f", material {tracker.material}" if tracker.material else ""))
+        height, width = tracker.frame_shape
+        cx, cy = tracker.mm_to_pixel((0.0, 0.0))
+        print(f"Image: {width}x{height}, centre at ({cx:g}, {cy:g})"
+              + (f", detection in {args.tiles} tiles" if tracker.tiler else ""))
         print(f"Visualization: {'Enabled' if args.visualize else 'Disabled'}")
+        if tracker.recorder is not None:
+            print(f"Flight recorder: last {args.record_seconds:g}s "
+                  f"(kill -USR1 {os.getpid()} to dump)")
         print("\nPress Ctrl+C to stop")
         print("="*50 + "\n")
         
-        # Main tracking loop
-        tracker.camera.BeginAcquisition()
-        frame_count = 0
+        # Main tracking pipeline (capture, process and send threads)
+        global pipeline
+        pipeline = TrackingPipeline(
+            tracker,
+            queue_size=PROCESSING_CONFIG['queue_size'],
+            drop_frames=args.drop_frames,
+            send_queue_size=PROCESSING_CONFIG['send_queue_size'],
+            send_overflow=PROCESSING_CONFIG['send_overflow'],
+            send_thread=(PROCESSING_CONFIG['parallel_tracks']
+                         and PROCESSING_CONFIG['max_threads'] >= 3),
+            display=display,
+            display_interval=max(1, round(1 / (KALMAN_CONFIG['dt']
+                                               * PROCESSING_CONFIG['display_rate']))),
+            echo=args.fpga_echo and args.fpga_protocol == 'framed',
+            frame_period=KALMAN_CONFIG['dt'],
+            max_lag_frames=PROCESSING_CONFIG['max_lag_frames'],
+            recover_frames=PROCESSING_CONFIG['shed_recover_frames'],
+            collector=IdleCollector() if args.gc == GC_IDLE else None
+        )
+        pipeline.start()
         
-        while True:
-            # Get next frame
-            image_result = tracker.camera.GetNextImage(1000)
-            
-            if image_result.IsIncomplete():
-                print("Image incomplete, skipping...")
-                continue
-            
-            # Process frame
-            result = tracker.process_frame(image_result)
-            frame_count += 1
-            
-            # Update visualization
-            if visualizer and result:
-                visualizer.update_display(result)
-                
-                # Save frames if requested
-                if args.save_frames > 0 and frame_count % args.save_frames == 0:
-                    filename = f"logs/thermal_frame_{frame_count:06d}.png"
-                    visualizer.save_frame(result, filename)
+        # Control channel: parameter changes are adopted between frames
+        if args.control_socket:
+            control = ControlServer(tracker, args.control_socket, pipeline=pipeline)
+            try:
+                control.start()
+            except RuntimeError as e:
+                print(f"Control socket disabled: {e} (use --control-socket PATH)")
+                control = None
+            else:
+                tracker.control = control
+                print(f"Control socket: {args.control_socket} (./thermal_control.py --help)")
+        
+        # Latency metrics export
+        exporter = MetricsExporter(pipeline)
+        if args.metrics_port:
+            host, port = exporter.serve(args.metrics_port)
+            print(f"Metrics: http://{host}:{port}/metrics")
+        last_metrics_write = 0.0
+        
+        while pipeline.is_running():
+            time.sleep(0.1)
             
-            # Release frame
-            image_result.Release()
+            if args.metrics_file and time.time() - last_metrics_write >= 1.0:
+                exporter.write(args.metrics_file)
+                last_metrics_write = time.time()
             
             # Display performance
             if len(tracker.frame_times) > 1:
                 fps = len(tracker.frame_times) / (
                     tracker.frame_times[-1] - tracker.frame_times[0]
                 )
-                status = f"FPS: {fps:.1f} | Tracking: {len(tracker.trackers)} droplets"
+                stats = pipeline.stats()
+                status = (f"FPS: {fps:.1f} | Tracking: {len(tracker.trackers)} droplets"
+                          f" | Queue: {stats['frame_queue_depth']}"
+                          f" | Dropped: {stats['frames_dropped']}")
+                shedding = pipeline.scheduler.shedding()
+                if shedding:
+                    status += f" | Shedding: {', '.join(shedding)}"
                 
-                if not args.visualize:
-                    print(f"\r{status}", end='')
+                print(f"\r{status}", end='')
+        
+        print("\nFrame source exhausted")
+        stats = pipeline.stats()
+        print(f"Captured {stats['captured']} frames, processed {stats['processed']}, "
+              f"dropped {stats['frames_dropped']}, incomplete {stats['incomplete']}")
+        if stats['frames_late']:
+            print(f"Late frames: {stats['frames_late']} (shed level up to "
+                  f"{stats['shed_max_level']}: display {stats['display_shed']}, "
+                  f"record {stats['record_shed']}, sweeps deferred "
+                  f"{stats['sweeps_deferred']}, skipped {stats['frames_skipped']})")
+        shed = pipeline.shed_frames()
+        if shed:
+            print("Dropped frames: " + ", ".join(f"{frame_id} ({reason})"
+                                                  for frame_id, reason in shed[-20:])
+                  + (f" (last 20 of {stats['frames_dropped']})"
+                     if stats['frames_dropped'] > 20 else ""))
+        print("Latency (ms)   p50      p99      max   (worst frame)")
+        for stage, s in pipeline.latency.summary().items():
+            if s['count']:
+                print(f"  {stage:<10} {s['p50'] / 1e6:7.3f}  {s['p99'] / 1e6:7.3f}  "
+                      f"{s['max'] / 1e6:7.3f}   ({s['max_frame']})")
+        camera_clock = tracker.camera_clock.stats()
+        fpga_clock = tracker.fpga_clock.stats()
+        print(f"Camera clock: drift {camera_clock['drift_ppm']:+.1f} ppm, "
+              f"{camera_clock['resets']} resets")
+        if fpga_clock['samples']:
+            print(f"FPGA clock: offset {fpga_clock['offset_ns'] / 1e6:+.3f} ms, "
+                  f"one-way delay {fpga_clock['one_way_ns'] / 1e6:.3f} ms")
+        if args.latency_compensation:
+            print(f"Latency compensation: last prediction {tracker.last_lead_ns / 1e6:.2f} ms ahead")
+        if pipeline.collector is not None:
+            gc_stats = pipeline.collector.stats()
+            print(f"GC: {gc_stats['frozen']} objects frozen, collections by generation "
+                  f"{gc_stats['collections']} ({gc_stats['forced']} while busy), "
+                  f"longest {gc_stats['max_pause_ns'] / 1e6:.3f} ms")
+        if tracker.calibrator is not None:
+            cal = tracker.calibrator.stats()
+            if cal['pixel_to_mm'] is not None:
+                print(f"Self-calibration: {cal['pixel_to_mm']:.4f} mm/pixel from "
+                      f"{cal['tracks']} tracks ({cal['rejected']} rejected), spread "
+                      f"{cal['spread'] * 100:.2f}%, tilt {cal['tilt_deg']:+.2f}°, "
+                      f"applied {cal['applied']} times; running {tracker.pixel_to_mm:.4f}")
+            else:
+                print("Self-calibration: not enough free-fall tracks")
+        if args.metrics_file:
+            exporter.write(args.metrics_file)
+        exporter.close()
+        if args.roi:
+            roi = tracker.roi.stats()
+            print(f"ROI: {roi['roi_frames']}/{roi['frames']} frames, "
+                  f"{roi['full_sweeps']} sweeps {roi['sweep_reasons']}, "
+                  f"hit rate {roi['hit_rate'] * 100:.1f}%, "
+                  f"{roi['sweep_outside']} found outside ROIs by sweeps, "
+                  f"{roi['pixel_fraction'] * 100:.0f}% of pixels processed")
         
     except Exception as e:
         print(f"\nError: {e}")
@@ -163,6 +651,22 @@ def main():
         traceback.print_exc()
     finally:
         print("\nCleaning up...")
+        if control is not None:
+            control.close()
+        if pipeline is not None:
+            pipeline.stop()
+        if display is not None:
+            display.stop()
+        if tracker.recorder is not None:
+            tracker.recorder.close()
+            for path in tracker.recorder.dumps:
+                print(f"Flight recording: {path}")
+        if tracker.calibration_store is not None:
+            tracker.calibration_store.close()
+        if tracker.calibrator is not None:
+            tracker.calibrator.close()
+            if tracker.calibrator.applied and CALIBRATION_CONFIG['save_on_exit']:
+                save_self_calibration(tracker)
         tracker.cleanup()
         sys.exit(0)
 
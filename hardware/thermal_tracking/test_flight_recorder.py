@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Flight recorder tests: track-loss triggers on synthetic replays and the
+.drec round trip
+"""
+
+import sys
+import os
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), 'code'))
+
+from config.performance_config import KALMAN_CONFIG
+from frame_sources import FrameSource
+from kalman_filter_bank import TRACK_DTYPE
+from flight_recorder import (FlightRecorder, FlightRecording, FramePacker, write_recording,
+                             TRIGGER_TRACK_LOSS, _RING_META_DTYPE)
+from synthetic_scene import SyntheticDropletScene, temperature_to_counts
+
+
+def replay(scene, frames, timestamps, output_dir):
+    """Track frames into a FlightRecorder, returning the trigger reasons"""
+    from thermal_droplet_tracker import ThermalDropletTracker
+
+    tracker = ThermalDropletTracker(frame_source=FrameSource())
+    tracker.configure_kalman(dict(KALMAN_CONFIG, **{
+        'motion_model': 'constant_velocity', 'gravity_mm_s2': (0.0, 0.0), 'drag_per_s': 0.0}))
+    tracker.min_temp_celsius = scene.droplet_temp / 2
+    recorder = FlightRecorder(frames.shape[1:], frame_rate=scene.frame_rate,
+                              output_dir=str(output_dir), to_pixel=tracker.mm_to_pixel)
+    triggers = []
+    recorder.trigger = lambda reason: triggers.append(reason)
+    try:
+        for i, frame in enumerate(frames):
+            detections = tracker.track_frame(frame, int(timestamps[i]))
+            recorder.record(frame, tracker.trackers.snapshot(), i, int(timestamps[i]),
+                            len(detections))
+    finally:
+        recorder.close()
+    return triggers
+
+
+def test_clean_replay_has_no_track_loss(tmp_path):
+    """Droplets leaving the bottom of the image are not lost tracks"""
+    for num_droplets in (5, 20):
+        scene = SyntheticDropletScene(num_droplets=num_droplets, seed=1)
+        frames, timestamps, _ = scene.generate(600)
+        triggers = replay(scene, frames, timestamps, tmp_path)
+        print(f"{num_droplets} droplets: {len(triggers)} triggers")
+        assert triggers == []
+
+
+def test_blanked_droplets_trigger_track_loss(tmp_path):
+    """Droplets vanishing mid-frame (sensor dropout) are lost tracks"""
+    scene = SyntheticDropletScene(num_droplets=5, seed=1)
+    frames, timestamps, _ = scene.generate(200)
+    frames[100:120] = int(temperature_to_counts(scene.background_temp))
+    triggers = replay(scene, frames, timestamps, tmp_path)
+    assert TRIGGER_TRACK_LOSS in triggers
+
+
+def test_recording_round_trip(tmp_path):
+    """Packed frames and tracks come back unchanged from a .drec file"""
+    shape = (24, 32)
+    rng = np.random.default_rng(0)
+    packer = FramePacker(shape)
+    images = rng.integers(0, 1 << 14, size=(6,) + shape, dtype=np.uint16)
+    images[3] = images[2]   # A repeated frame packs to an empty delta
+    frames = np.zeros((len(images), packer.size), dtype=np.uint8)
+    meta = np.zeros(len(images), dtype=_RING_META_DTYPE)
+    tracks = np.zeros((len(images), 4), dtype=TRACK_DTYPE)
+    for i, image in enumerate(images):
+        packer.pack(image, frames[i], keyframe=(i == 0))
+        meta[i] = (i, 100 + i, 1000 * i, 2000 * i, i % 4, i, i == 0)
+        tracks[i, :i % 4] = [(k, i, 2.0 * k, 0.0, 3.0, 220.0, i, 0) for k in range(i % 4)]
+
+    path = str(tmp_path / 'round_trip.drec')
+    write_recording(path, shape, frames, tracks, meta, 'test', 12345)
+    recording = FlightRecording(path)
+    assert len(recording) == len(images)
+    assert list(recording.frame_ids) == list(range(100, 106))
+    for i, image in enumerate(images):
+        assert np.array_equal(recording[i], image)
+        assert np.array_equal(recording.tracks(i), tracks[i, :i % 4])
+    # Random access decodes from the keyframe
+    assert np.array_equal(recording[4], images[4])
+    assert np.array_equal(recording[1], images[1])
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Control a running main_thermal_tracking.py through its control socket
+Changes parameters between frames without restarting the tracker, reads
+statistics, dumps the flight recorder and reloads the sensor calibration.
+
+    ./thermal_control.py get
+    ./thermal_control.py set min_temp_celsius=650 association_gate_mm=8
+    ./thermal_control.py set fpga_ip=192.168.1.51 fpga_port=5001
+    ./thermal_control.py stats
+    ./thermal_control.py record
+    ./thermal_control.py reload-calibration
+"""
+
+import sys
+import os
+import json
+import socket
+import argparse
+sys.path.append(os.path.join(os.path.dirname(__file__), 'code'))
+
+from config.performance_config import PROCESSING_CONFIG
+from control_server import COMMANDS
+
+
+def parse_value(text):
+    """JSON value (number, true/false), otherwise the text itself"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def request(path, message, timeout=5.0):
+    """Send one request and return the reply"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise SystemExit("Tracker closed the connection")
+    return json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Change parameters of, and query, a running thermal tracker"
+    )
+    parser.add_argument('command', choices=[c.replace('_', '-') for c in COMMANDS])
+    parser.add_argument('parameters', nargs='*', metavar='NAME=VALUE',
+                        help="Parameters for 'set' (applied together at the next frame)")
+    parser.add_argument('--socket', default=PROCESSING_CONFIG['control_socket'],
+                        help='Control socket of the tracker')
+    args = parser.parse_args()
+
+    message = {'command': args.command.replace('-', '_')}
+    if message['command'] == 'set':
+        if not args.parameters:
+            parser.error("set needs NAME=VALUE parameters")
+        changes = {}
+        for item in args.parameters:
+            name, sep, value = item.partition('=')
+            if not sep:
+                parser.error(f"expected NAME=VALUE, got '{item}'")
+            changes[name] = parse_value(value)
+        message['parameters'] = changes
+
+    try:
+        reply = request(args.socket, message)
+    except (FileNotFoundError, ConnectionRefusedError):
+        raise SystemExit(f"No tracker listening on {args.socket}")
+    print(json.dumps(reply, indent=2))
+    if not reply.get('ok'):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
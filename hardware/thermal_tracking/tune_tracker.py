@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Offline auto-tuner for the thermal droplet tracker
+Replays synthetic scenes and/or recordings with ground truth through the
+tracking core on a process pool, searches the detection threshold,
+association gate, track lifecycle and Kalman noise, and writes a ranked
+parameter file that main_thermal_tracking.py loads with --params
+"""
+
+import sys
+import os
+import argparse
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(__file__), 'code'))
+
+from config.performance_config import KALMAN_CONFIG, TUNING_CONFIG
+from parameter_tuning import METRICS, tune, save_ranking, check_space
+from synthetic_scene import SyntheticDropletScene, scene_motion
+
+
+def parse_value(text):
+    """int, float, true/false or the text itself"""
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return {'true': True, 'false': False}.get(text, text)
+
+
+def parse_param(text):
+    """NAME=LOW:HIGH[:log] (range) or NAME=V1,V2,... (values)"""
+    name, sep, spec = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected NAME=SPEC, got '{text}'")
+    if ':' in spec and ',' not in spec:
+        parts = spec.split(':')
+        if len(parts) == 2:
+            return name, (parse_value(parts[0]), parse_value(parts[1]))
+        if len(parts) == 3 and parts[2] == 'log':
+            return name, (parse_value(parts[0]), parse_value(parts[1]), 'log')
+        raise argparse.ArgumentTypeError(f"bad range '{spec}' (LOW:HIGH or LOW:HIGH:log)")
+    return name, [parse_value(value) for value in spec.split(',')]
+
+
+def synthetic_sequences(args, directory):
+    """Render --synthetic scenes into directory; sequence specs with a matching filter"""
+    pixel_to_mm = args.pixel_to_mm
+    frame_rate = 1.0 / KALMAN_CONFIG['dt']
+    kalman = dict(KALMAN_CONFIG, motion_model='ballistic', drag_per_s=0.0,
+                  gravity_mm_s2=(0.0, args.gravity * pixel_to_mm * frame_rate ** 2))
+    sequences = []
+    for i in range(args.synthetic):
+        scene = SyntheticDropletScene(
+            num_droplets=args.droplets,
+            droplet_temp=args.droplet_temp,
+            velocity=(0.0, args.velocity),
+            gravity=args.gravity,
+            noise=args.noise,
+            merge_distance=args.merge_distance,
+            frame_rate=frame_rate,
+            seed=args.seed + i
+        )
+        path = scene.save(os.path.join(directory, f"scene{i}"), args.frames)
+        sequences.append({'path': path, 'pixel_to_mm': pixel_to_mm, 'kalman': kalman})
+    return sequences
+
+
+def print_ranking(results, top):
+    header = f"{'Rank':>4} {'Score':>7}  " + ' '.join(f"{m:>17}" for m in METRICS)
+    print(header)
+    print('-' * len(header))
+    for r in results[:top]:
+        print(f"{r['rank']:>4} {r['score']:>7.3f}  "
+              + ' '.join(f"{r['metrics'][m]:>17.3f}" for m in METRICS))
+        print("     " + ", ".join(f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}"
+                                  for k, v in r['parameters'].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Search tracking parameters offline and write a ranked parameter file"
+    )
+    parser.add_argument('--recording', nargs='+', default=[], metavar='RECORDING',
+                        help='Recordings with ground truth (<name>.truth.npy next to them)')
+    parser.add_argument('--pixel-to-mm', type=float, default=0.5,
+                        help='Scale of the recordings and synthetic scenes (mm/pixel)')
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='Number of synthetic scenes (default: 2 without --recording)')
+    parser.add_argument('--frames', type=int, default=600,
+                        help='Frames per synthetic scene')
+    parser.add_argument('--droplets', type=int, default=5,
+                        help='Droplets in view in synthetic scenes')
+    parser.add_argument('--droplet-temp', type=float, default=300.0,
+                        help='Synthetic droplet temperature (°C)')
+    parser.add_argument('--velocity', type=float, default=3.0,
+                        help='Synthetic fall velocity (pixels/frame)')
+    parser.add_argument('--gravity', type=float, default=0.1,
+                        help='Synthetic fall acceleration (pixels/frame²)')
+    parser.add_argument('--noise', type=float, default=2.0,
+                        help='Synthetic sensor noise (counts, 1 sigma)')
+    parser.add_argument('--merge-distance', type=float, default=0.0,
+                        help='Merge synthetic droplets closer than this (pixels, 0=off)')
+    parser.add_argument('--scene-dir',
+                        help='Keep the rendered synthetic scenes here (default: temporary)')
+    parser.add_argument('--param', type=parse_param, action='append', metavar='NAME=SPEC',
+                        help='Searched parameter, NAME=LOW:HIGH[:log] or NAME=V1,V2,... '
+                             '(repeat; replaces TUNING_CONFIG space)')
+    parser.add_argument('--search', choices=['bayes', 'grid'], default=TUNING_CONFIG['search'])
+    parser.add_argument('--trials', type=int, default=TUNING_CONFIG['trials'],
+                        help='Settings evaluated by the model-based search')
+    parser.add_argument('--grid-points', type=int, default=TUNING_CONFIG['grid_points'],
+                        help='Values per range in a grid search')
+    parser.add_argument('--workers', type=int, default=TUNING_CONFIG['workers'],
+                        help='Worker processes (default: one per core)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--top', type=int, default=5, help='Settings printed')
+    parser.add_argument('--output', default=TUNING_CONFIG['output'],
+                        help='Ranked parameter file')
+    args = parser.parse_args()
+
+    space = dict(args.param) if args.param else dict(TUNING_CONFIG['space'])
+    try:
+        check_space(space)
+    except ValueError as e:
+        parser.error(str(e))
+    if not args.recording and not args.synthetic:
+        args.synthetic = 2
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.scene_dir or tmp
+        os.makedirs(directory, exist_ok=True)
+        sequences = [{'path': path, 'pixel_to_mm': args.pixel_to_mm,
+                      'kalman': dict(KALMAN_CONFIG, **(scene_motion(path, args.pixel_to_mm) or {}))}
+                     for path in args.recording]
+        sequences += synthetic_sequences(args, directory)
+
+        print(f"Tuning {', '.join(space)} over {len(sequences)} sequences "
+              f"({args.search}, {args.workers or os.cpu_count()} workers)")
+
+        def progress(result, done):
+            print(f"\r{done} settings evaluated, best so far "
+                  f"{max(result['score'], progress.best):.3f}", end='')
+            progress.best = max(result['score'], progress.best)
+        progress.best = float('-inf')
+
+        results = tune(space, sequences, TUNING_CONFIG['weights'],
+                       search=args.search, trials=args.trials, grid_points=args.grid_points,
+                       workers=args.workers, match_px=TUNING_CONFIG['match_px'],
+                       seed=args.seed, progress=progress)
+    print("\n")
+    print_ranking(results, args.top)
+
+    synthetic = None
+    if args.synthetic:
+        synthetic = {key: getattr(args, key) for key in (
+            'synthetic', 'frames', 'droplets', 'droplet_temp', 'velocity', 'gravity',
+            'noise', 'merge_distance', 'seed')}
+    save_ranking(args.output, results, search=args.search, space=space,
+                 weights=TUNING_CONFIG['weights'], recordings=args.recording,
+                 synthetic=synthetic, pixel_to_mm=args.pixel_to_mm)
+    print(f"\nRanked parameters saved to {args.output} "
+          f"(./main_thermal_tracking.py --params {args.output})")
+
+
+if __name__ == "__main__":
+    main()
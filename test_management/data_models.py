@@ -90,6 +90,19 @@ class TestExecution:
             'issues_found': self.issues_found
         }
 
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            test_id=data['test_id'],
+            status=TestStatus(data['status']),
+            result=TestResult(data['result']),
+            date_executed=datetime.fromisoformat(data['date_executed']) if data.get('date_executed') else None,
+            test_engineer=data.get('test_engineer', ""),
+            report_path=data.get('report_path', ""),
+            notes=data.get('notes', ""),
+            issues_found=data.get('issues_found', [])
+        )
+
 @dataclass
 class ComponentTestMapping:
     component_id: str
@@ -153,4 +166,19 @@ class ComponentVerification:
             'verification_date': self.verification_date.isoformat() if self.verification_date else None,
             'notes': self.notes,
             'completion_percentage': self.get_completion_percentage()
-        }
\ No newline at end of file
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            component_id=data['component_id'],
+            component_name=data['component_name'],
+            part_number=data['part_number'],
+            verification_status=VerificationStatus(data['verification_status']),
+            required_tests=data.get('required_tests', []),
+            completed_tests=data.get('completed_tests', []),
+            passed_tests=data.get('passed_tests', []),
+            failed_tests=data.get('failed_tests', []),
+            verification_date=datetime.fromisoformat(data['verification_date']) if data.get('verification_date') else None,
+            notes=data.get('notes', "")
+        )
\ No newline at end of file
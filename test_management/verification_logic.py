@@ -38,7 +38,7 @@ class VerificationEngine:
                 data = json.load(f)
                 verifications = {}
                 for comp_id, comp_data in data.items():
-                    verifications[comp_id] = ComponentVerification(**comp_data)
+                    verifications[comp_id] = ComponentVerification.from_dict(comp_data)
                 return verifications
         else:
             # Initialize from component mapper
@@ -72,10 +72,10 @@ class VerificationEngine:
                 data = json.load(f)
                 executions = {}
                 for test_id, test_data in data.items():
-                    # Handle datetime conversion
-                    if test_data.get('date_executed'):
-                        test_data['date_executed'] = datetime.fromisoformat(test_data['date_executed'])
-                    executions[test_id] = TestExecution(**test_data)
+                    executions[test_id] = TestExecution.from_dict(test_data)
+                # Tests added to the registry since the state was saved
+                for test_id, execution in self._initialize_test_executions().items():
+                    executions.setdefault(test_id, execution)
                 return executions
         else:
             # Initialize all tests as not started
@@ -114,7 +114,8 @@ class VerificationEngine:
                           result: Optional[TestResult] = None,
                           test_engineer: str = "",
                           notes: str = "",
-                          issues: List[str] = None) -> bool:
+                          issues: List[str] = None,
+                          report_path: str = "") -> bool:
         """Update test execution status and trigger component verification check"""
         if test_id not in self.test_executions:
             return False
@@ -136,6 +137,9 @@ class VerificationEngine:
         
         if notes:
             execution.notes = notes
+        
+        if report_path:
+            execution.report_path = report_path
             
         if issues:
             execution.issues_found.extend(issues)